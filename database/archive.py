@@ -0,0 +1,237 @@
+"""
+Архив старых строк actions по месяцам.
+
+actions только растёт: каждый день в неё пишется reminder_sent на каждого
+подписчика, а get_actions() без user_id (/logs, LoggingService.get_logs_for_today)
+читал таблицу целиком, чтобы отфильтровать один день в Python.
+
+Теперь строки старше N дней переезжают в отдельные SQLite-файлы по месяцам
+(archive_dir/actions-YYYY-MM.db, месяц — по d_local), а в основной базе остаётся
+манифест actions_archive: какой месяц в каком файле, сколько строк и диапазон
+ts_epoch. get_actions читает архив прозрачно: по манифесту открываются только те
+месяцы, что пересекаются с запрошенным периодом, поэтому «логи за сегодня» в
+архив не заглядывают вовсе. После переноса освободившиеся страницы основной базы
+возвращаются incremental_vacuum порциями, не блокируя запись надолго.
+
+Месяц переезжает порциями по ARCHIVE_BATCH_ROWS строк подряд по id: порция
+копируется в архив (INSERT OR IGNORE по id), архив коммитится, и только потом в
+короткой транзакции BEGIN IMMEDIATE основной базы строки этого диапазона id
+удаляются из actions вместе с обновлением манифеста. Писатели бота ждут одну
+порцию, а не весь месяц. Если процесс упадёт между двумя коммитами, повторный
+запуск перезапишет те же id в архив и доудалит их — строка не теряется и не
+дублируется.
+
+incremental_vacuum работает только в базе с auto_vacuum=INCREMENTAL. Новая база
+создаётся такой сразу (Database.__init__), а старую переводит полный VACUUM —
+он переписывает весь файл и держит базу всё это время, поэтому делается один раз
+при остановленном боте: tools/enable_incremental_vacuum.py. До этого compact
+ничего не делает и только пишет в лог, что перевод не выполнен.
+
+SQL по самой actions (сегменты пользователей, недоступные адресаты) видит только
+горячую часть. Для них важны последние недели, поэтому порог по умолчанию —
+полгода (ACTIONS_ARCHIVE_DAYS в main.py).
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_DAYS = 180
+DEFAULT_ARCHIVE_SEC = 24 * 3600
+VACUUM_STEP_PAGES = 2000
+ARCHIVE_BATCH_ROWS = 5000
+
+MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS actions_archive (
+    month TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    min_ts_epoch INTEGER,
+    max_ts_epoch INTEGER,
+    archived_at TEXT NOT NULL
+);
+"""
+
+# Схема файла архива: колонки actions плюс ts_epoch обычной колонкой — в архиве
+# строки неизменны, генерировать её при чтении незачем.
+ARCHIVE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    username TEXT,
+    name TEXT,
+    action TEXT NOT NULL,
+    details TEXT,
+    timestamp TEXT NOT NULL,
+    ts_epoch INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_actions_ts_epoch ON actions(ts_epoch);
+CREATE INDEX IF NOT EXISTS idx_actions_user_id_ts_epoch ON actions(user_id, ts_epoch);
+"""
+
+COLUMNS = "id, user_id, username, name, action, details, timestamp, ts_epoch"
+
+
+def archive_file(month: str) -> str:
+    return f"actions-{month}.db"
+
+
+def archive_actions(conn: sqlite3.Connection, archive_dir: str, older_than_days: int,
+                    batch_rows: int = ARCHIVE_BATCH_ROWS) -> int:
+    """
+    Переносит строки actions старше older_than_days в архивы по месяцам,
+    порциями по batch_rows. Возвращает число перенесённых строк.
+    """
+    cutoff = int(time.time()) - older_than_days * 86400
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(d_local, 1, 7) FROM actions WHERE ts_epoch < ? ORDER BY 1", (cutoff,))]
+    if not months:
+        return 0
+    os.makedirs(archive_dir, exist_ok=True)
+
+    moved = 0
+    for month in months:
+        arch = sqlite3.connect(os.path.join(archive_dir, archive_file(month)))
+        try:
+            arch.executescript(ARCHIVE_SCHEMA_SQL)
+            count, rows = _archive_month(conn, arch, month, cutoff, batch_rows)
+        finally:
+            arch.close()
+        moved += count
+        logger.info(f"Archived {count} actions for {month} ({rows} rows in archive)")
+    return moved
+
+
+def _archive_month(conn: sqlite3.Connection, arch: sqlite3.Connection, month: str, cutoff: int,
+                   batch_rows: int) -> tuple:
+    """Переносит один месяц порциями. Возвращает (перенесено, всего строк в архиве месяца)."""
+    where = "ts_epoch < :cutoff AND d_local >= :month || '-01' AND d_local < date(:month || '-01', '+1 month')"
+    # Манифест считается от того, что уже лежит в файле (в том числе после сбоя),
+    # и дальше только прибавляет вставленные порции — без COUNT(*) на каждую.
+    rows, min_ts, max_ts = arch.execute("SELECT COUNT(*), MIN(ts_epoch), MAX(ts_epoch) FROM actions").fetchone()
+    moved = 0
+    last_id = -1
+    while True:
+        params = {"cutoff": cutoff, "month": month, "after": last_id, "limit": batch_rows}
+        batch = conn.execute(f"SELECT {COLUMNS} FROM actions WHERE {where} AND id > :after ORDER BY id LIMIT :limit",
+                             params).fetchall()
+        if not batch:
+            return moved, rows
+        first_id, last_id = batch[0][0], batch[-1][0]
+        with arch:
+            inserted = arch.executemany(f"INSERT OR IGNORE INTO actions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [tuple(row) for row in batch]).rowcount
+        rows += inserted
+        batch_ts = [row[7] for row in batch if row[7] is not None]
+        if batch_ts:
+            min_ts = min(batch_ts) if min_ts is None else min(min_ts, *batch_ts)
+            max_ts = max(batch_ts) if max_ts is None else max(max_ts, *batch_ts)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            moved += conn.execute(f"DELETE FROM actions WHERE id BETWEEN :first AND :last AND {where}",
+                                  {"cutoff": cutoff, "month": month, "first": first_id, "last": last_id}).rowcount
+            conn.execute("""
+                INSERT INTO actions_archive (month, file, rows, min_ts_epoch, max_ts_epoch, archived_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(month) DO UPDATE SET
+                    rows = excluded.rows, min_ts_epoch = excluded.min_ts_epoch,
+                    max_ts_epoch = excluded.max_ts_epoch, archived_at = excluded.archived_at
+            """, (month, archive_file(month), rows, min_ts, max_ts))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def compact(conn: sqlite3.Connection, step_pages: int = VACUUM_STEP_PAGES) -> int:
+    """
+    Возвращает свободные страницы файлу порциями по step_pages, каждая в своей
+    транзакции. Возвращает число освобождённых страниц. База без
+    auto_vacuum=INCREMENTAL пропускается: её переводит enable_incremental_vacuum
+    при остановленном боте.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logger.warning("Compaction skipped: auto_vacuum is not INCREMENTAL, "
+                       "run tools/enable_incremental_vacuum.py while the bot is stopped")
+        return 0
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return freed
+        conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+        conn.commit()
+        freed += min(free, step_pages)
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    Переводит базу на auto_vacuum=INCREMENTAL полным VACUUM. Переписывает весь
+    файл и держит базу до конца — только для остановленного бота
+    (tools/enable_incremental_vacuum.py). Возвращает True, если перевод был нужен.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def archive_paths(conn: sqlite3.Connection, archive_dir: str,
+                  since_epoch: int = None, until_epoch: int = None) -> list:
+    """Пути файлов архива по возрастанию месяца — только месяцы, пересекающиеся с [since_epoch, until_epoch)."""
+    months = conn.execute("""
+        SELECT month, file FROM actions_archive
+        WHERE (? IS NULL OR max_ts_epoch >= ?) AND (? IS NULL OR min_ts_epoch < ?)
+        ORDER BY month
+    """, (since_epoch, since_epoch, until_epoch, until_epoch)).fetchall()
+    paths = []
+    for month, file in months:
+        path = os.path.join(archive_dir, file)
+        if not os.path.exists(path):
+            logger.warning(f"Archive file for {month} is missing: {path}")
+            continue
+        paths.append(path)
+    return paths
+
+
+def open_archive(path: str) -> sqlite3.Connection:
+    arch = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    arch.row_factory = sqlite3.Row
+    return arch
+
+
+def read_archived(conn: sqlite3.Connection, archive_dir: str, where: str = "1", params=(),
+                  since_epoch: int = None, until_epoch: int = None) -> list:
+    """
+    Строки архива (sqlite3.Row, по возрастанию времени) из месяцев манифеста,
+    пересекающихся с [since_epoch, until_epoch). where/params — фильтр по колонкам
+    архивной actions.
+    """
+    rows = []
+    for path in archive_paths(conn, archive_dir, since_epoch, until_epoch):
+        arch = open_archive(path)
+        try:
+            rows.extend(arch.execute(f"SELECT {COLUMNS} FROM actions WHERE {where} ORDER BY timestamp", params))
+        finally:
+            arch.close()
+    return rows
+
+
+async def run_archive_loop(db, older_than_days: int = DEFAULT_ARCHIVE_DAYS, interval_sec: float = DEFAULT_ARCHIVE_SEC):
+    """Фоновая задача main.py: раз в interval_sec переносит старые actions в архив."""
+    from database.async_db import call_db
+
+    while True:
+        try:
+            await call_db(db, "archive_actions", older_than_days)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Actions archiving failed: {e}", exc_info=True)
+        await asyncio.sleep(interval_sec)
@@ -0,0 +1,205 @@
+"""
+Асинхронный фасад над Database: запросы к SQLite уходят из event loop в потоки.
+
+Все хендлеры, цикл напоминаний и рассылка вызывают синхронные методы Database прямо
+в event loop. Пока идёт запрос, бот не отвечает никому: тяжёлый отчёт админки
+(get_admin_dashboard_summary, сегменты пользователей) подвешивал всех разом.
+
+Здесь чтение выполняется на небольшом пуле read-only соединений (WAL позволяет
+читать параллельно с записью), а запись — в одном выделенном потоке-писателе со
+своим соединением: писатель у SQLite всё равно один, и очередь в одном потоке
+честнее, чем драка за блокировку между потоками.
+
+Метод выполняется на «представлении» Database — объекте того же класса со своим
+соединением потока. Поэтому вызываются ровно те же методы, что и раньше, без
+дублирования SQL. Раньше представление было copy.copy исходного объекта, и всё,
+кроме соединения, застывало в момент создания потока: main.py при остановке ставил
+db.events = None, а представления продолжали писать в остановленный буфер, и так же
+мимо них проходила бы замена кэшей. Теперь у представления собственное только conn,
+остальные атрибуты читаются и пишутся на общем объекте (_DatabaseView).
+
+Переход постепенный. Database по-прежнему работает синхронно, а фасад доступен как
+db.aio. В переведённых местах вызов идёт через call_db(db, "метод", ...): если фасад
+есть — через потоки, если нет (тесты, утилиты в tools/) — как раньше, синхронно.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from database import statement_counter
+
+logger = logging.getLogger(__name__)
+
+# Методы с такими префиксами только читают и могут идти на пул читателей.
+_READ_PREFIXES = ("get_", "count_", "is_", "has_")
+
+# Исключения из правила: по имени читатели, а на деле пишут. get_user создаёт
+# запись для нового пользователя, остальные вызывают get_user внутри. На read-only
+# соединении такая вставка упала бы, и новый пользователь не попал бы в базу.
+_WRITING_READERS = frozenset({"get_user", "is_card_available", "is_deck_available"})
+
+DEFAULT_READERS = 3
+
+
+def _is_read(method_name: str) -> bool:
+    return method_name.startswith(_READ_PREFIXES) and method_name not in _WRITING_READERS
+
+
+class _DatabaseView:
+    """
+    Примесь к классу Database для представлений потоков: conn свой, всё остальное —
+    атрибуты общего объекта. Методы берутся из класса, поэтому self.conn внутри них —
+    соединение потока, а self.events, self.user_cache и прочее — текущие значения
+    исходного Database, в том числе заменённые после создания представления.
+    """
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, "_shared_db"), name)
+
+    def __setattr__(self, name, value):
+        if name == "conn":
+            object.__setattr__(self, name, value)
+        else:
+            setattr(object.__getattribute__(self, "_shared_db"), name, value)
+
+
+@functools.lru_cache(maxsize=None)
+def _view_class(cls):
+    return type(f"{cls.__name__}View", (_DatabaseView, cls), {})
+
+
+class AsyncDatabase:
+    """Неблокирующий доступ к Database: await adb.get_user(...) вместо db.get_user(...)."""
+
+    def __init__(self, db, readers: int = DEFAULT_READERS):
+        self.sync = db
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        # Базу в памяти нельзя открыть вторым соединением: там и чтение, и запись
+        # идут через исходный объект в потоке-писателе. Так работают только тесты.
+        path = getattr(db, "path", None)
+        self._shared = not path or path == ":memory:"
+
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="db-write", initializer=self._open_writer)
+        self._readers = self._writer if self._shared else ThreadPoolExecutor(
+            max_workers=max(1, readers), thread_name_prefix="db-read", initializer=self._open_reader)
+
+        db.aio = self
+        logger.info(
+            f"AsyncDatabase initialized: readers={0 if self._shared else max(1, readers)}, "
+            f"shared={self._shared}")
+
+    # --- Соединения потоков ---
+
+    def _connect(self, target: str, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            target, check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, **kwargs)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=5000")
+        profiler = getattr(self.sync, "profiler", None)
+        if profiler is not None:
+            profiler.attach(conn)
+        else:
+            statement_counter.attach(conn)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _bind(self, conn: sqlite3.Connection):
+        """Представление Database, работающее через соединение текущего потока."""
+        view = object.__new__(_view_class(type(self.sync)))
+        object.__setattr__(view, "_shared_db", self.sync)
+        view.conn = conn
+        return view
+
+    def _open_writer(self):
+        if self._shared:
+            self._local.view = self.sync
+            return
+        self._local.view = self._bind(self._connect(self.sync.path))
+
+    def _open_reader(self):
+        uri = f"file:{quote(self.sync.path)}?mode=ro"
+        self._local.view = self._bind(self._connect(uri, uri=True))
+
+    # --- Выполнение ---
+
+    async def _submit(self, executor, fn, *args, **kwargs):
+        # Контекст копируем явно: run_in_executor его не переносит, а счётчики
+        # запросов на апдейт живут в contextvars.
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        return await loop.run_in_executor(executor, call)
+
+    def _call_on_view(self, method_name: str, *args, **kwargs):
+        return getattr(self._local.view, method_name)(*args, **kwargs)
+
+    def _apply_on_view(self, func, *args, **kwargs):
+        return func(self._local.view, *args, **kwargs)
+
+    async def run_read(self, func, *args, **kwargs):
+        """Выполняет func(db, ...) на соединении читателя. Для функций вне Database."""
+        return await self._submit(self._readers, self._apply_on_view, func, *args, **kwargs)
+
+    async def run_write(self, func, *args, **kwargs):
+        """Выполняет func(db, ...) в потоке-писателе."""
+        return await self._submit(self._writer, self._apply_on_view, func, *args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if not callable(attr):
+            return attr
+        executor = self._readers if _is_read(name) else self._writer
+
+        async def method(*args, **kwargs):
+            return await self._submit(executor, self._call_on_view, name, *args, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    def close(self):
+        """Дожидается начатых запросов и закрывает соединения потоков."""
+        self._writer.shutdown(wait=True)
+        if self._readers is not self._writer:
+            self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Error closing pooled connection: {e}", exc_info=True)
+            self._connections.clear()
+        if getattr(self.sync, "aio", None) is self:
+            self.sync.aio = None
+        logger.info("AsyncDatabase closed.")
+
+
+async def call_db(db, method_name: str, *args, **kwargs):
+    """
+    Вызов метода базы из асинхронного кода. Если у объекта есть фасад (db.aio), запрос
+    уйдёт в поток, иначе выполнится синхронно, как раньше. Через эту прослойку
+    переводятся старые места вызова: они продолжают работать и с подставными базами
+    в тестах, у которых фасада нет.
+    """
+    aio = getattr(db, "aio", None)
+    if aio is None:
+        return getattr(db, method_name)(*args, **kwargs)
+    return await getattr(aio, method_name)(*args, **kwargs)
+
+
+async def run_db_read(db, func, *args, **kwargs):
+    """То же для функций вида func(db, ...), которые читают через db.conn напрямую."""
+    aio = getattr(db, "aio", None)
+    if aio is None:
+        return func(db, *args, **kwargs)
+    return await aio.run_read(func, *args, **kwargs)
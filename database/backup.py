@@ -0,0 +1,194 @@
+"""
+Резервные копии базы на лету через SQLite backup API.
+
+Раньше копию можно было снять только через sqlite_web или копированием
+/data/bot.db, пока бот пишет: файл без WAL рядом мог оказаться несогласованным,
+а узнать об этом можно было только при восстановлении.
+
+Теперь фоновая задача main.py раз в interval_sec снимает снимок в каталог
+backup_dir (bot-YYYYMMDD-HHMMSS.db), проверяет его PRAGMA integrity_check и
+хранит последние keep штук. Снимок пишется во временный .part и переименовывается
+только после проверки, поэтому в каталоге не бывает недописанных копий.
+
+Копирование идёт шагами по step_pages страниц с паузой step_sleep между ними, из
+отдельного соединения только для чтения. Блокировка источника держится на время
+одного шага, а не всей копии; в WAL читатель писателей не держит вовсе. Если
+между шагами базу меняет другое соединение (буфер событий, основной писатель),
+SQLite начинает копию заново. После max_restarts перезапусков копия снимается
+одним шагом: в WAL это одна читающая транзакция, запись она не останавливает.
+
+Ожидание блокировки записи считается по времени шагов копии. Раньше его мерил
+отдельный поток: каждые 50 мс он брал и отпускал BEGIN IMMEDIATE — то есть сам
+двадцать раз в секунду отнимал блокировку записи у бота, пока шла копия. Теперь
+замер бесплатный: в WAL читатель писателей не держит, и ожидание — ноль; в
+режиме с журналом отката шаг держит разделяемую блокировку источника, и писатель
+ждёт не дольше самого долгого шага, а всего — не больше суммы шагов.
+
+Месячные архивы actions (database/archive.py) сюда не входят: после записи
+они не меняются, и их достаточно копировать обычным способом.
+"""
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STEP_PAGES = 1024
+DEFAULT_STEP_SLEEP = 0.01
+DEFAULT_KEEP = 7
+DEFAULT_MAX_RESTARTS = 5
+DEFAULT_BACKUP_SEC = 24 * 3600
+STAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class _Restarted(Exception):
+    """Копию слишком часто начинали заново — переходим на один шаг."""
+
+
+def snapshot_prefix(source_path: str) -> str:
+    return os.path.splitext(os.path.basename(source_path))[0] or "bot"
+
+
+def list_snapshots(backup_dir: str, prefix: str) -> list:
+    """Готовые снимки, от старых к новым (имя содержит время, сортировка по имени)."""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(name for name in os.listdir(backup_dir)
+                  if name.startswith(f"{prefix}-") and name.endswith(".db"))
+
+
+def rotate(backup_dir: str, prefix: str, keep: int = DEFAULT_KEEP) -> list:
+    """Удаляет снимки сверх keep последних. Возвращает имена удалённых."""
+    removed = []
+    for name in list_snapshots(backup_dir, prefix)[:-keep] if keep > 0 else []:
+        try:
+            os.remove(os.path.join(backup_dir, name))
+            removed.append(name)
+        except OSError as e:
+            logger.error(f"Failed to remove old backup {name}: {e}")
+    return removed
+
+
+def backup(source_path: str, backup_dir: str, step_pages: int = DEFAULT_STEP_PAGES,
+           step_sleep: float = DEFAULT_STEP_SLEEP, keep: int = DEFAULT_KEEP,
+           max_restarts: int = DEFAULT_MAX_RESTARTS) -> dict:
+    """
+    Снимает проверенный снимок source_path в backup_dir и чистит старые.
+    Возвращает отчёт: файл, размер, время, шаги, перезапуски, самый долгий шаг
+    и оценка ожидания блокировки записи во время копии. При неудаче file = None.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    prefix = snapshot_prefix(source_path)
+    name = f"{prefix}-{datetime.now().strftime(STAMP_FORMAT)}.db"
+    final_path = os.path.join(backup_dir, name)
+    part_path = final_path + ".part"
+
+    report = {"file": None, "bytes": 0, "pages": 0, "steps": 0, "restarts": 0, "single_step": False,
+              "duration_ms": 0.0, "max_step_ms": 0.0, "lock_wait_max_ms": 0.0, "lock_wait_total_ms": 0.0,
+              "journal_mode": None, "integrity": None, "removed": []}
+    state = {"remaining": None, "last": None, "total_step_ms": 0.0}
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        report["steps"] += 1
+        report["pages"] = total
+        step_ms = (now - state["last"]) * 1000
+        report["max_step_ms"] = max(report["max_step_ms"], step_ms)
+        state["total_step_ms"] += step_ms
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            report["restarts"] += 1
+            if report["restarts"] > max_restarts:
+                raise _Restarted()
+        state["remaining"] = remaining
+        # sleep= у Connection.backup ждёт только при SQLITE_BUSY, паузу между шагами делаем сами
+        if remaining and step_sleep > 0:
+            time.sleep(step_sleep)
+        state["last"] = time.perf_counter()
+
+    started = time.perf_counter()
+    src = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True, check_same_thread=False)
+    src.execute("PRAGMA busy_timeout=5000")
+    dst = sqlite3.connect(part_path)
+    try:
+        report["journal_mode"] = src.execute("PRAGMA journal_mode").fetchone()[0]
+        try:
+            state["last"] = time.perf_counter()
+            src.backup(dst, pages=step_pages, progress=progress, sleep=step_sleep)
+        except _Restarted:
+            logger.warning(f"Backup restarted {report['restarts']} times, finishing in a single step")
+            report["single_step"] = True
+            state["last"] = time.perf_counter()
+            src.backup(dst, pages=-1)
+            step_ms = (time.perf_counter() - state["last"]) * 1000
+            report["max_step_ms"] = max(report["max_step_ms"], step_ms)
+            state["total_step_ms"] += step_ms
+            report["steps"] += 1
+        report["duration_ms"] = (time.perf_counter() - started) * 1000
+        report["integrity"] = dst.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Backup of {source_path} failed: {e}", exc_info=True)
+        report["integrity"] = f"error: {e}"
+    finally:
+        dst.close()
+        src.close()
+
+    if report["journal_mode"] != "wal":
+        report["lock_wait_max_ms"] = report["max_step_ms"]
+        report["lock_wait_total_ms"] = state["total_step_ms"]
+    for key in ("duration_ms", "max_step_ms", "lock_wait_max_ms", "lock_wait_total_ms"):
+        report[key] = round(report[key], 2)
+
+    if report["integrity"] != "ok":
+        logger.error(f"Backup snapshot {name} rejected: integrity_check={report['integrity']}")
+        for path in (part_path, part_path + "-journal", part_path + "-wal", part_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        return report
+
+    os.replace(part_path, final_path)
+    report["file"] = final_path
+    report["bytes"] = os.path.getsize(final_path)
+    report["removed"] = rotate(backup_dir, prefix, keep)
+    logger.info(f"Backup {name}: {report['bytes']} bytes in {report['duration_ms']} ms, "
+                f"{report['steps']} steps, {report['restarts']} restarts, max step {report['max_step_ms']} ms, "
+                f"write lock wait up to {report['lock_wait_max_ms']} ms ({report['journal_mode']})")
+    return report
+
+
+def seconds_until_due(backup_dir: str, prefix: str, interval_sec: float) -> float:
+    """Сколько ждать до следующего снимка: считаем от последнего, чтобы рестарты бота не плодили копии."""
+    snapshots = list_snapshots(backup_dir, prefix)
+    if not snapshots:
+        return 0.0
+    try:
+        taken = datetime.strptime(snapshots[-1][len(prefix) + 1:-3], STAMP_FORMAT)
+    except ValueError:
+        return 0.0
+    return max(0.0, interval_sec - (datetime.now() - taken).total_seconds())
+
+
+async def run_backup_loop(db, backup_dir: str, interval_sec: float = DEFAULT_BACKUP_SEC, keep: int = DEFAULT_KEEP):
+    """
+    Фоновая задача main.py: снимок раз в interval_sec. Копия идёт в потоке пула,
+    а не на потоке писателя AsyncDatabase, — запись бота её не ждёт.
+    Отчёт последнего снимка — в db.last_backup.
+    """
+    prefix = snapshot_prefix(db.path)
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(seconds_until_due(backup_dir, prefix, interval_sec))
+        report = None
+        try:
+            report = await loop.run_in_executor(None, functools.partial(backup, db.path, backup_dir, keep=keep))
+            db.last_backup = report
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Scheduled backup failed: {e}", exc_info=True)
+        if report is None or report["file"] is None:
+            # Неудачный снимок не сдвигает расписание по файлам — повторим через час
+            await asyncio.sleep(min(interval_sec, 3600))
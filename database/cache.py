@@ -0,0 +1,93 @@
+"""
+Ограниченный LRU-кэш со сроком жизни записей.
+
+Нужен Database для get_user: его вызывают по нескольку раз на каждый апдейт
+(middleware подписки, log_action, главное меню, карта дня, напоминания), и каждый
+раз это был SELECT плюс разбор трёх отметок времени через decode_timestamp.
+
+Кэш потокобезопасен: Database используют и event loop, и потоки db.aio.
+Срок жизни страхует от записей в обход Database (sqlite_web, утилиты в tools/):
+такие изменения станут видны не позже чем через ttl секунд. maxsize=0 или
+ttl<=0 выключают кэш совсем (замеры без кэша).
+
+Гонка «прочитали старое — параллельно записали — положили старое в кэш»
+закрыта поколениями: generation() берётся до чтения из базы, а set() с
+устаревшим поколением ничего не кладёт.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 300.0):
+        self.maxsize = max(int(maxsize), 0)
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key):
+        """Значение из кэша или MISSING."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation: int = None):
+        if self.maxsize == 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return  # пока читали из базы, кэш инвалидировали — значение могло устареть
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
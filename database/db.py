@@ -6,6 +6,12 @@ from datetime import datetime, date, timedelta
 import os
 import time
 import uuid
+from database.cache import LRUCache, MISSING
+from database.event_buffer import EventBuffer, TABLE_SQL as EVENT_SQL
+from database.migrations import migrate
+from database import archive, reachability, rollups, statement_counter, subscription_cache, user_stats
+from database.subscription_cache import SubscriptionCache, FIRST_CARD_SCENARIO
+from database.json_codec import ActionRecord, dumps as json_dumps
 try:
     from config_local import TIMEZONE
 except ImportError:
@@ -21,11 +27,17 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+ACTION_COLUMNS = ("id", "user_id", "username", "name", "action", "details", "timestamp")
+ACTIONS_PAGE_SIZE = 500
+
 # --- КЛАСС Database ---
 class Database:
-    def __init__(self, path="/data/bot.db"):
+    def __init__(self, path="/data/bot.db", user_cache_size: int = 2048, user_cache_ttl: float = 300.0,
+                 dashboard_ttl: float = 300.0, archive_dir: str = None,
+                 subscription_cache_size: int = subscription_cache.DEFAULT_MAXSIZE):
         """
         Инициализация соединения с БД.
+        archive_dir — каталог месячных архивов actions (по умолчанию archive/ рядом с базой).
         """
         db_dir = os.path.dirname(path)
         if db_dir and not os.path.exists(db_dir):
@@ -37,7 +49,10 @@ class Database:
                 path = os.path.basename(path)
                 logger.warning(f"Attempting to use database in current directory: {path}")
 
+        self.path = path
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(path), "archive")
         try:
+            fresh_file = not os.path.exists(path) or os.path.getsize(path) == 0
             # Используем нужные detect_types
             self.conn = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
             logger.info(f"Database connection initialized at path: {path}")
@@ -46,6 +61,11 @@ class Database:
             # WAL позволяет читать во время записи, busy_timeout заставляет подождать блокировку
             # вместо мгновенного "database is locked".
             try:
+                # auto_vacuum ставится только в пустой базе, до первой таблицы: тогда архив
+                # actions возвращает место incremental_vacuum порциями. Старую базу переводит
+                # tools/enable_incremental_vacuum.py (database/archive.py).
+                if fresh_file:
+                    self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
                 journal_mode = self.conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
                 self.conn.execute("PRAGMA busy_timeout=5000")
                 logger.info(f"SQLite pragmas applied: journal_mode={journal_mode}, busy_timeout=5000ms")
@@ -63,11 +83,30 @@ class Database:
 
             self.conn.row_factory = sqlite3.Row
             self.bot = None # Устанавливается в main.py
-
-            self.create_tables()
-            self.create_author_tables()
-            self._run_migrations()
-            self.create_indexes()
+            self.aio = None # Асинхронный фасад (database/async_db.py), создаётся в main.py
+            self.events = None # Буфер групповой записи событий, см. enable_write_behind
+            self.user_cache = LRUCache(maxsize=user_cache_size, ttl=user_cache_ttl) # Кэш get_user
+            self.dashboard_cache = LRUCache(maxsize=64, ttl=dashboard_ttl) # Снимки метрик админки
+            self.profiler = None # Профилировщик запросов (database/profiler.py), включается DB_PROFILE
+            self.last_backup = None # Отчёт последнего снимка (database/backup.py)
+            self.update_metrics = None # Метрики апдейтов (modules/update_metrics.py), ставится в main.py
+
+            # Схема доводится реестром шагов (database/migrations.py). При актуальной
+            # схеме это одно чтение PRAGMA user_version. create_tables и компания —
+            # теперь тело первого шага: новые изменения схемы добавляются новым шагом.
+            schema_started = time.perf_counter()
+            applied = migrate(self)
+            logger.info(f"Schema check: {applied} migrations applied in {(time.perf_counter() - schema_started) * 1000:.1f} ms")
+
+            # Кэш SubscriptionMiddleware: поднимается из subscription_checks, чтобы рестарт
+            # не отправлял всех активных пользователей заново в get_chat_member
+            self.subscriptions = SubscriptionCache(maxsize=subscription_cache_size)
+            loaded = self.subscriptions.load(self.conn, datetime.now(TIMEZONE).date())
+            logger.info(f"Subscription cache loaded {loaded} users")
+
+            # Счёт запросов на апдейт (modules/update_metrics.py). Ставится последним:
+            # трассировка у соединения одна, а запросы открытия базы ни к какому апдейту не относятся
+            statement_counter.attach(self.conn)
 
         except sqlite3.Error as e:
             logger.critical(f"Database initialization failed: Could not connect or setup tables/migrations/indexes at {path}. Error: {e}", exc_info=True)
@@ -195,6 +234,7 @@ class Database:
                         step TEXT NOT NULL,
                         metadata TEXT,
                         timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                        session_id TEXT,
                         FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
                     )""")
                 
@@ -320,6 +360,8 @@ class Database:
             self._add_columns_if_not_exist('users', users_columns)
             reflection_columns = { 'ai_summary': 'TEXT' }
             self._add_columns_if_not_exist('evening_reflections', reflection_columns)
+            # Нужна раньше шага 10 реестра: агрегаты шагов 6–7 уже читают колонку
+            self._add_columns_if_not_exist('scenario_logs', {'session_id': 'TEXT'})
             logger.info("Database migrations finished successfully.")
         except Exception as e:
             logger.error(f"Error during database migration process: {e}", exc_info=True)
@@ -380,7 +422,32 @@ class Database:
 
     def get_user(self, user_id):
         # ... (код метода get_user) ...
-        """Получает данные пользователя. Если не найден, создает запись."""
+        """
+        Получает данные пользователя. Если не найден, создает запись.
+
+        Записи кэшируются (self.user_cache): get_user зовут по нескольку раз на апдейт,
+        а каждый промах — это SELECT и разбор трёх отметок времени. Наружу всегда
+        отдаётся копия, чтобы правка словаря вызывающим не портила кэш. Все, кто
+        пишет в users, обязаны звать _invalidate_user.
+        """
+        cached = self.user_cache.get(user_id)
+        if cached is not MISSING:
+            return dict(cached)
+        generation = self.user_cache.generation()
+        user_dict = self._load_user(user_id)
+        if user_dict is None:
+            return {"user_id": user_id, "name": "", "username": "", "last_request": None, "reminder_time": None, "reminder_time_evening": None, "bonus_available": False, "first_seen": None, "last_request_nature": None, "last_request_message": None}
+        self.user_cache.set(user_id, user_dict, generation=generation)
+        return dict(user_dict)
+
+    def _invalidate_user(self, user_id):
+        self.user_cache.invalidate(user_id)
+
+    def get_user_cache_stats(self) -> dict:
+        return self.user_cache.stats()
+
+    def _load_user(self, user_id):
+        """Читает (или создаёт) запись пользователя из базы. None — если база ответила ошибкой."""
         try:
             cursor = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
             row = cursor.fetchone()
@@ -444,41 +511,53 @@ class Database:
             return default_user_data
         except sqlite3.Error as e:
             logger.error(f"Failed to get or create user {user_id}: {e}", exc_info=True)
-            return {"user_id": user_id, "name": "", "username": "", "last_request": None, "reminder_time": None, "reminder_time_evening": None, "bonus_available": False, "first_seen": None, "last_request_nature": None, "last_request_message": None}
+            return None
+
+    # Колонки users, которые можно менять через update_user.
+    USER_COLUMNS = ("name", "username", "last_request", "reminder_time", "reminder_time_evening",
+                    "bonus_available", "first_seen", "last_request_nature", "last_request_message", "gender")
 
     def update_user(self, user_id, data):
         # ... (код метода update_user) ...
-        """Обновляет данные пользователя (INSERT OR REPLACE)."""
-        current_user_data = self.get_user(user_id)
-        name_to_save = data.get("name", current_user_data.get("name", ""))
-        username_to_save = data.get("username", current_user_data.get("username", ""))
-        reminder_to_save = data.get("reminder_time", current_user_data.get("reminder_time"))
-        reminder_evening_to_save = data.get("reminder_time_evening", current_user_data.get("reminder_time_evening"))
-        bonus_to_save = data.get("bonus_available", current_user_data.get("bonus_available", False))
-        last_request_to_save = None
-        last_request_input = data.get("last_request", current_user_data.get("last_request"))
-        if isinstance(last_request_input, datetime):
-            last_request_to_save = last_request_input.isoformat()
-        elif isinstance(last_request_input, str):
-             last_request_to_save = last_request_input
-        
-        # Обработка first_seen
-        first_seen_to_save = current_user_data.get("first_seen")
-        if not first_seen_to_save and data.get("first_seen"):
-            first_seen_to_save = data.get("first_seen")
-        elif not first_seen_to_save:
-            first_seen_to_save = datetime.now().isoformat()
-        
+        """
+        Обновляет у пользователя только переданные поля (UPSERT по user_id).
+
+        Раньше здесь был get_user плюс INSERT OR REPLACE всех колонок: лишнее чтение,
+        удаление и вставка строки заново на каждый вызов, а непереданные
+        last_request_nature/last_request_message и gender затирались. Теперь один
+        INSERT ... ON CONFLICT DO UPDATE по переданным колонкам, без чтения.
+        first_seen, как и прежде, ставится один раз и не перезаписывается.
+        """
+        values = {}
+        for column, value in data.items():
+            if column not in self.USER_COLUMNS:
+                logger.warning(f"update_user: unknown column '{column}' for user {user_id} ignored")
+                continue
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif column == "bonus_available":
+                value = int(bool(value))
+            values[column] = value
+
+        first_seen = values.pop("first_seen", None) or datetime.now().isoformat()
+        # Новая строка получает те же умолчания, что создаёт get_user.
+        insert_values = {"name": "", "username": "", "bonus_available": 0, **values, "first_seen": first_seen}
+        columns = ", ".join(insert_values)
+        placeholders = ", ".join("?" for _ in insert_values)
+        assignments = [f"{column} = excluded.{column}" for column in values]
+        assignments.append(
+            "first_seen = CASE WHEN users.first_seen IS NULL OR users.first_seen = '' "
+            "THEN excluded.first_seen ELSE users.first_seen END")
         try:
             with self.conn:
-                self.conn.execute("""
-                    INSERT OR REPLACE INTO users (user_id, name, username, last_request, reminder_time, reminder_time_evening, bonus_available, first_seen, last_request_nature, last_request_message)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, ( user_id, name_to_save, username_to_save, last_request_to_save,
-                       reminder_to_save, reminder_evening_to_save, int(bonus_to_save), first_seen_to_save,
-                       data.get("last_request_nature"), data.get("last_request_message")))
+                self.conn.execute(
+                    f"INSERT INTO users (user_id, {columns}) VALUES (?, {placeholders}) "
+                    f"ON CONFLICT(user_id) DO UPDATE SET {', '.join(assignments)}",
+                    (user_id, *insert_values.values()))
         except sqlite3.Error as e:
             logger.error(f"Failed to update user {user_id}: {e}", exc_info=True)
+        finally:
+            self._invalidate_user(user_id)
 
 
     def get_user_cards(self, user_id, deck_name: str = 'nature'):
@@ -530,10 +609,13 @@ class Database:
         else: timestamp_str = datetime.now(TIMEZONE).isoformat()
         details_json = None
         if details is not None:
-            try: details_json = json.dumps(details, ensure_ascii=False, indent=2)
+            try: details_json = json_dumps(details)
             except TypeError as e:
                 logger.error(f"Failed to serialize details for action '{action}', user {user_id}: {e}. Details: {details}")
-                details_json = json.dumps({"error": "serialization_failed", "original_details_type": str(type(details))})
+                details_json = json_dumps({"error": "serialization_failed", "original_details_type": str(type(details))})
+        if self.events is not None:
+            self.events.add("actions", (user_id, username, name, action, details_json, timestamp_str))
+            return
         try:
             with self.conn:
                 self.conn.execute(
@@ -543,36 +625,111 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Failed to save action '{action}' for user {user_id}: {e}. Details JSON: {details_json}", exc_info=True)
 
-    def get_actions(self, user_id=None):
+    def get_actions(self, user_id=None, since: datetime = None, until: datetime = None):
         # ... (код метода get_actions) ...
-        """Получает список действий пользователя (или всех), отсортированных по времени."""
-        actions = []
-        try:
-            sql = "SELECT id, user_id, username, name, action, details, timestamp FROM actions"
-            params = []
-            if user_id:
-                sql += " WHERE user_id = ?"
-                params.append(user_id)
-            sql += " ORDER BY timestamp ASC"
-            cursor = self.conn.execute(sql, params)
-            for row in cursor.fetchall():
-                row_dict = dict(row)
-                details_dict = {}
-                if row_dict.get("details"):
-                    try: details_dict = json.loads(row_dict["details"])
-                    except (json.JSONDecodeError, TypeError) as e:
-                        logger.warning(f"Failed to decode details JSON for action ID {row_dict.get('id')}, user {row_dict.get('user_id')}: {e}. Raw details: {row_dict['details']}")
-                        details_dict = {"error": "invalid_json", "raw_details": row_dict["details"]}
-                timestamp_str = row_dict.get("timestamp", datetime.min.isoformat())
-                actions.append({
-                    "id": row_dict.get("id"), "user_id": row_dict.get("user_id"),
-                    "username": row_dict.get("username"), "name": row_dict.get("name"),
-                    "action": row_dict.get("action"), "details": details_dict,
-                    "timestamp": timestamp_str
-                })
-        except sqlite3.Error as e:
-            logger.error(f"Failed to get actions (user_id: {user_id}): {e}", exc_info=True)
-        return actions
+        """
+        Получает список действий пользователя (или всех), отсортированных по времени.
+        since/until (aware datetime) ограничивают период [since, until) по индексу
+        ts_epoch. Строки, перенесённые в месячные архивы (database/archive.py),
+        подмешиваются из тех месяцев, что пересекаются с периодом. details
+        разбирается при первом обращении (database/json_codec.py).
+        Список целиком — для новых мест лучше iter_actions.
+        """
+        return list(self.iter_actions(user_id, since=since, until=until))
+
+    def iter_actions(self, user_id=None, actions=None, since: datetime = None, until: datetime = None,
+                     after_id: int = None, columns=None, exclude_actions=None,
+                     newest_first: bool = False, page_size: int = ACTIONS_PAGE_SIZE):
+        """
+        Действия по одному, страницами по page_size строк с ключом (ts_epoch, id):
+        в памяти не больше страницы, каждая страница — отдельный короткий запрос.
+
+        actions / exclude_actions — только эти типы / все, кроме этих; since/until —
+        период [since, until); after_id — строки с id больше заданного (дочитать новое).
+        columns — какие колонки отдавать (из ACTION_COLUMNS); без details строки —
+        обычные dict, с details — ActionRecord, details разбирается при обращении.
+        newest_first — от новых к старым: «последнее действие» — первый элемент,
+        дальше страницы не читаются.
+
+        Раньше get_actions собирал всё в список, и /users_list ради одной последней
+        строки на человека читал всю его историю.
+        """
+        columns = tuple(columns or ACTION_COLUMNS)
+        unknown = set(columns) - set(ACTION_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown actions columns: {sorted(unknown)}")
+        self.flush_events()
+
+        conditions, params = [], []
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        since_epoch = int(since.timestamp()) if since else None
+        until_epoch = int(until.timestamp()) if until else None
+        if since_epoch is not None:
+            conditions.append("ts_epoch >= ?")
+            params.append(since_epoch)
+        if until_epoch is not None:
+            conditions.append("ts_epoch < ?")
+            params.append(until_epoch)
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        for values, op in ((actions, "IN"), (exclude_actions, "NOT IN")):
+            if values is not None:
+                values = list(values)
+                conditions.append(f"action {op} ({', '.join('?' * len(values))})")
+                params.extend(values)
+        where = " AND ".join(conditions) or "1"
+
+        try:
+            paths = archive.archive_paths(self.conn, self.archive_dir, since_epoch, until_epoch)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read actions archive manifest: {e}", exc_info=True)
+            paths = []
+        sources = paths + [None]  # None — основная база, она новее любого архива
+        for path in reversed(sources) if newest_first else sources:
+            conn = archive.open_archive(path) if path else self.conn
+            try:
+                for row in self._action_pages(conn, where, params, columns, newest_first, page_size):
+                    fields = {name: row[name] for name in columns if name != "details"}
+                    yield ActionRecord(row["details"], **fields) if "details" in columns else fields
+            except sqlite3.Error as e:
+                logger.error(f"Failed to iterate actions (user_id: {user_id}, archive: {path}): {e}", exc_info=True)
+                return
+            finally:
+                if path:
+                    conn.close()
+
+    @staticmethod
+    def _action_pages(conn, where: str, params: list, columns: tuple, newest_first: bool, page_size: int):
+        """
+        Строки actions страницами по ключу (ts_epoch, id). NULL в ts_epoch
+        (нераспознанное время) идут первыми по возрастанию, поэтому у границы
+        страницы с NULL своё условие.
+        """
+        select = ", ".join(dict.fromkeys(("id", "ts_epoch") + columns))
+        direction = "DESC" if newest_first else "ASC"
+        cmp = "<" if newest_first else ">"
+        last = None
+        while True:
+            keyset, keyset_params = "", []
+            if last is not None:
+                ts, row_id = last
+                if ts is None:
+                    keyset = f" AND ((ts_epoch IS NULL AND id {cmp} ?)" + ("" if newest_first else " OR ts_epoch IS NOT NULL") + ")"
+                    keyset_params = [row_id]
+                else:
+                    keyset = f" AND (ts_epoch {cmp} ? OR (ts_epoch = ? AND id {cmp} ?)" + (" OR ts_epoch IS NULL" if newest_first else "") + ")"
+                    keyset_params = [ts, ts, row_id]
+            rows = conn.execute(
+                f"SELECT {select} FROM actions WHERE {where}{keyset}"
+                f" ORDER BY ts_epoch {direction}, id {direction} LIMIT ?",
+                [*params, *keyset_params, page_size]).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last = (rows[-1]["ts_epoch"], rows[-1]["id"])
 
     def get_reminder_times(self):
         # ... (код метода get_reminder_times) ...
@@ -844,12 +1001,25 @@ class Database:
     def log_scenario_step(self, user_id: int, scenario: str, step: str, metadata: dict = None):
         """Логирует шаг сценария с метаданными."""
         try:
-            metadata_json = json.dumps(metadata) if metadata else None
+            metadata_json = json_dumps(metadata) if metadata else None
+            # session_id дублируется в колонку: по ней индекс для воронки и агрегатов
+            session_id = metadata.get("session_id") if metadata else None
+            # Счётчик шагов и последний шаг сессии — в строке user_scenarios
+            step_params = (step, session_id, user_id)
+            if self.events is not None:
+                # Время фиксируем сейчас, в формате CURRENT_TIMESTAMP, а не в момент сброса.
+                ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                self.events.add("scenario_logs", (user_id, scenario, step, metadata_json, ts, session_id))
+                if session_id:
+                    self.events.add("user_scenarios", step_params)
+                return
             with self.conn:
                 self.conn.execute(
-                    "INSERT INTO scenario_logs (user_id, scenario, step, metadata) VALUES (?, ?, ?, ?)",
-                    (user_id, scenario, step, metadata_json)
+                    "INSERT INTO scenario_logs (user_id, scenario, step, metadata, session_id) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, scenario, step, metadata_json, session_id)
                 )
+                if session_id:
+                    self.conn.execute(EVENT_SQL["user_scenarios"], step_params)
             logger.debug(f"Logged scenario step: user={user_id}, scenario={scenario}, step={step}")
         except sqlite3.Error as e:
             logger.error(f"Failed to log scenario step for user {user_id}: {e}", exc_info=True)
@@ -893,7 +1063,7 @@ class Database:
                     MIN(LENGTH(request_text)) as min_length,
                     MAX(LENGTH(request_text)) as max_length
                 FROM user_requests 
-                WHERE timestamp >= datetime('now', '-{days} days')
+                WHERE ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - {days} * 86400
                 {excluded_condition}
             """, params)
             
@@ -937,9 +1107,9 @@ class Database:
                     u.username as user_username
                 FROM user_requests ur
                 LEFT JOIN users u ON ur.user_id = u.user_id
-                WHERE ur.timestamp >= datetime('now', '-{days} days')
+                WHERE ur.ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - {days} * 86400
                 {excluded_condition}
-                ORDER BY ur.timestamp DESC
+                ORDER BY ur.ts_epoch DESC
                 LIMIT ?
             """, params + [limit])
             
@@ -973,55 +1143,78 @@ class Database:
         try:
             if session_id is None:
                 session_id = f"{user_id}_{scenario}_{datetime.now(TIMEZONE).strftime('%Y%m%d_%H%M%S')}"
-            
+                steps_count, last_step = 0, None
+            else:
+                # Сессию могли открыть раньше строки: «Карта дня» пишет scenario_started
+                # до выбора колоды. Эти шаги засчитываем сразу.
+                self.flush_events()
+                steps_count, last_step = self.conn.execute(
+                    "SELECT COUNT(*), (SELECT step FROM scenario_logs WHERE session_id = :s AND user_id = :u"
+                    " ORDER BY rowid DESC LIMIT 1)"
+                    " FROM scenario_logs WHERE session_id = :s AND user_id = :u",
+                    {"s": session_id, "u": user_id}
+                ).fetchone()
+
+            started_at = datetime.now(TIMEZONE)
             with self.conn:
                 self.conn.execute(
-                    "INSERT INTO user_scenarios (user_id, scenario, started_at, status, session_id) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, scenario, datetime.now(TIMEZONE).isoformat(), 'in_progress', session_id)
+                    "INSERT INTO user_scenarios (user_id, scenario, started_at, status, session_id, steps_count, last_step)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, scenario, started_at.isoformat(), 'in_progress', session_id, steps_count, last_step)
                 )
+                self.conn.execute(user_stats.START_SQL, user_stats.start_params(user_id, started_at))
             logger.info(f"Started scenario: user={user_id}, scenario={scenario}, session={session_id}")
             return session_id
         except sqlite3.Error as e:
             logger.error(f"Failed to start scenario for user {user_id}: {e}", exc_info=True)
             return None
 
+    @staticmethod
+    def _scenario_session_where(user_id: int, scenario: str, session_id: str = None):
+        """
+        Условие на незавершённую строку user_scenarios. Сессию определяет session_id,
+        без сверки scenario: «Карта дня» открывает строку как card_of_day_<колода>,
+        а завершает как card_of_day, и по паре scenario + session_id строка не находилась.
+        """
+        if session_id:
+            return "user_id = ? AND session_id = ? AND status = 'in_progress'", (user_id, session_id)
+        return "user_id = ? AND scenario = ? AND status = 'in_progress'", (user_id, scenario)
+
     def complete_user_scenario(self, user_id: int, scenario: str, session_id: str = None):
-        """Завершает сценарий пользователя."""
+        """
+        Завершает сценарий пользователя.
+
+        Раньше steps_count считался как COUNT(*) по всем шагам пользователя в этом
+        сценарии за всё время — число росло со стажем, а запрос замедлялся. Теперь
+        log_scenario_step ведёт счётчик в строке сессии, и завершение — один UPDATE.
+        """
+        self.flush_events()  # счётчик шагов обновляется вместе со сбросом событий
         try:
-            # Подсчитываем количество шагов
-            cursor = self.conn.execute(
-                "SELECT COUNT(*) FROM scenario_logs WHERE user_id = ? AND scenario = ?",
-                (user_id, scenario)
-            )
-            steps_count = cursor.fetchone()[0]
-            
-            # Обновляем статус сценария
-            if session_id:
-                where_clause = "user_id = ? AND scenario = ? AND session_id = ? AND status = 'in_progress'"
-                params = (user_id, scenario, session_id)
-            else:
-                where_clause = "user_id = ? AND scenario = ? AND status = 'in_progress'"
-                params = (user_id, scenario)
-            
+            where_clause, params = self._scenario_session_where(user_id, scenario, session_id)
             with self.conn:
-                self.conn.execute(
-                    f"UPDATE user_scenarios SET completed_at = ?, status = 'completed', steps_count = ? WHERE {where_clause}",
-                    (datetime.now(TIMEZONE).isoformat(), steps_count, *params)
+                steps_count = self.conn.execute(
+                    f"SELECT COALESCE(SUM(steps_count), 0) FROM user_scenarios WHERE {where_clause}", params
+                ).fetchone()[0]
+                cursor = self.conn.execute(
+                    f"UPDATE user_scenarios SET completed_at = ?, status = 'completed' WHERE {where_clause}",
+                    (datetime.now(TIMEZONE).isoformat(), *params)
                 )
+                if cursor.rowcount > 0:
+                    self.conn.execute(user_stats.COMPLETE_SQL,
+                                      {"user_id": user_id, "sessions": cursor.rowcount, "steps": steps_count})
+                    if scenario == FIRST_CARD_SCENARIO:
+                        self.conn.execute(subscription_cache.FIRST_CARD_SQL, (user_id, int(time.time())))
+            if cursor.rowcount > 0 and scenario == FIRST_CARD_SCENARIO:
+                self.subscriptions.set_first_card(user_id, True)
             logger.info(f"Completed scenario: user={user_id}, scenario={scenario}, steps={steps_count}")
         except sqlite3.Error as e:
             logger.error(f"Failed to complete scenario for user {user_id}: {e}", exc_info=True)
 
     def abandon_user_scenario(self, user_id: int, scenario: str, session_id: str = None):
-        """Отмечает сценарий как брошенный."""
+        """Отмечает сценарий как брошенный. Счётчик шагов и последний шаг остаются в строке."""
+        self.flush_events()
         try:
-            if session_id:
-                where_clause = "user_id = ? AND scenario = ? AND session_id = ? AND status = 'in_progress'"
-                params = (user_id, scenario, session_id)
-            else:
-                where_clause = "user_id = ? AND scenario = ? AND status = 'in_progress'"
-                params = (user_id, scenario)
-            
+            where_clause, params = self._scenario_session_where(user_id, scenario, session_id)
             with self.conn:
                 self.conn.execute(
                     f"UPDATE user_scenarios SET status = 'abandoned' WHERE {where_clause}",
@@ -1032,7 +1225,7 @@ class Database:
             logger.error(f"Failed to abandon scenario for user {user_id}: {e}", exc_info=True)
 
     def get_scenario_stats(self, scenario: str = 'card_of_day', days: int = 7):
-        """Получает статистику по сценарию через VIEW (v_sessions_daily)."""
+        """Получает статистику по сценарию из дневных агрегатов (daily_scenario_sessions)."""
         try:
             # Раньше при days == 7 (значение по умолчанию на дашборде) отдавалась статистика
             # ТОЛЬКО за сегодня, хотя подпись гласила «7 дней». Теперь период честный.
@@ -1041,11 +1234,13 @@ class Database:
             else:
                 period_filter = f"d_local >= date('now', '+3 hours', '-{days} days')"
             
+            # Среднее число шагов — событий на сессию, как AVG(step_count) по v_sessions.
             cursor = self.conn.execute(f"""
                 SELECT 
-                    COALESCE(SUM(started), 0) as total_starts,
-                    COALESCE(SUM(completed), 0) as total_completions
-                FROM v_sessions_daily 
+                    COALESCE(SUM(sessions), 0) as total_starts,
+                    COALESCE(SUM(completed), 0) as total_completions,
+                    1.0 * SUM(events) / SUM(sessions) as avg_steps
+                FROM daily_scenario_sessions 
                 WHERE scenario = ? AND {period_filter}
             """, (scenario,))
             
@@ -1053,17 +1248,7 @@ class Database:
             total_starts = row[0] if row else 0
             total_completions = row[1] if row else 0
             total_abandoned = total_starts - total_completions if total_starts > total_completions else 0
-            
-            # Рассчитываем среднее количество шагов
-            cursor = self.conn.execute(f"""
-                SELECT 
-                    AVG(step_count) as avg_steps
-                FROM v_sessions 
-                WHERE scenario = ? AND {period_filter.replace('d_local', 'started_date')}
-            """, (scenario,))
-            
-            avg_steps_row = cursor.fetchone()
-            avg_steps = round(avg_steps_row[0], 1) if avg_steps_row and avg_steps_row[0] else 0
+            avg_steps = round(row[2], 1) if row and row[2] else 0
             
             return {
                 'scenario': scenario,
@@ -1077,8 +1262,8 @@ class Database:
             }
         except sqlite3.Error as e:
             logger.error(f"Failed to get scenario stats for {scenario}: {e}", exc_info=True)
-            # Фоллбэк на старый метод, если VIEW не существует
-            logger.warning(f"Falling back to legacy scenario stats (VIEW might not exist yet)")
+            # Фоллбэк на старый метод, если агрегатов ещё нет
+            logger.warning(f"Falling back to legacy scenario stats (rollups might not exist yet)")
             return {
                 'scenario': scenario,
                 'period_days': days,
@@ -1106,7 +1291,7 @@ class Database:
             cursor = self.conn.execute(
                 f"""SELECT step, COUNT(*) as count 
                    FROM scenario_logs 
-                   WHERE scenario = ? AND timestamp >= datetime('now', '-{days} days')
+                   WHERE scenario = ? AND ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - {days} * 86400
                    {excluded_condition}
                    GROUP BY step 
                    ORDER BY count DESC""",
@@ -1136,7 +1321,26 @@ class Database:
             return []
 
     def has_completed_scenario_first_time(self, user_id: int, scenario: str) -> bool:
-        """Проверяет, завершил ли пользователь сценарий хотя бы один раз."""
+        """
+        Проверяет, завершил ли пользователь сценарий хотя бы один раз.
+
+        Для карты дня ответ кэшируется (self.subscriptions): метод зовёт
+        SubscriptionMiddleware на каждый апдейт. Сбрасывает «нет» complete_user_scenario.
+        Промах кэша (вытеснение, размер 0) читает subscription_checks и сессии
+        card_of_day_<колода>: строка сессии хранит имя с колодой.
+        """
+        if scenario == FIRST_CARD_SCENARIO:
+            cached = self.subscriptions.first_card(user_id)
+            if cached is not None:
+                return cached
+            try:
+                completed = bool(self.conn.execute(
+                    subscription_cache.FIRST_CARD_LOOKUP_SQL, {"user_id": user_id}).fetchone()[0])
+            except sqlite3.Error as e:
+                logger.error(f"Failed to check first card for user {user_id}: {e}", exc_info=True)
+                return False
+            self.subscriptions.set_first_card(user_id, completed)
+            return completed
         try:
             cursor = self.conn.execute(
                 "SELECT COUNT(*) as count FROM user_scenarios WHERE user_id = ? AND scenario = ? AND status = 'completed'",
@@ -1148,166 +1352,65 @@ class Database:
             logger.error(f"Failed to check first completion for user {user_id}, scenario {scenario}: {e}", exc_info=True)
             return False
 
+    def save_subscription_check(self, user_id: int, day: date, status: str = None):
+        """Отмечает проверку подписки за день day в кэше и в subscription_checks."""
+        self.subscriptions.mark_checked(user_id, day, status)
+        self.subscriptions.set_first_card(user_id, True)  # проверяют только тех, кто завершил первую карту
+        try:
+            with self.conn:
+                self.conn.execute(subscription_cache.CHECK_SQL, (user_id, day.isoformat(), status, int(time.time())))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save subscription check for user {user_id}: {e}", exc_info=True)
+
+    def get_subscription_cache_stats(self) -> dict:
+        return self.subscriptions.stats()
+
     def get_user_advanced_stats(self, user_id: int):
-        """Получает расширенную статистику пользователя."""
+        """
+        Получает расширенную статистику пользователя из счётчиков user_stats
+        (database/user_stats.py) — одна строка вместо девяти запросов к user_scenarios.
+        """
         try:
-            stats = {}
+            row = self.conn.execute("SELECT * FROM user_stats WHERE user_id = ?", (user_id,)).fetchone()
             
-            # 1. Максимальное количество дней подряд без пропуска
-            cursor = self.conn.execute("""
-                WITH RECURSIVE dates AS (
-                    SELECT DATE(started_at) as date
-                    FROM user_scenarios 
-                    WHERE user_id = ?
-                    GROUP BY DATE(started_at)
-                    ORDER BY date
-                ),
-                consecutive_days AS (
-                    SELECT date, 1 as streak
-                    FROM dates
-                    WHERE date = (SELECT MIN(date) FROM dates)
-                    
-                    UNION ALL
-                    
-                    SELECT d.date, 
-                           CASE 
-                               WHEN d.date = DATE(cd.date, '+1 day') THEN cd.streak + 1
-                               ELSE 1
-                           END as streak
-                    FROM dates d
-                    JOIN consecutive_days cd ON d.date > cd.date
-                    WHERE d.date = (
-                        SELECT MIN(date) FROM dates WHERE date > cd.date
-                    )
-                )
-                SELECT MAX(streak) as max_streak
-                FROM consecutive_days
-            """, (user_id,))
-            stats['max_consecutive_days'] = cursor.fetchone()['max_streak'] or 0
+            total = row['total_sessions'] if row else 0
+            completed = row['completed_sessions'] if row else 0
+            unique_days = row['unique_days'] if row else 0
+            hours = json.loads(row['hours']) if row else [0] * 24
+            weekdays = json.loads(row['weekdays']) if row else [0] * 7
             
-            # 2. Текущая серия дней подряд
-            cursor = self.conn.execute("""
-                WITH RECURSIVE dates AS (
-                    SELECT DATE(started_at) as date
-                    FROM user_scenarios 
-                    WHERE user_id = ?
-                    GROUP BY DATE(started_at)
-                    ORDER BY date DESC
-                ),
-                current_streak AS (
-                    SELECT date, 1 as streak
-                    FROM dates
-                    WHERE date = (SELECT MAX(date) FROM dates)
-                    
-                    UNION ALL
-                    
-                    SELECT d.date, cs.streak + 1
-                    FROM dates d
-                    JOIN current_streak cs ON d.date = DATE(cs.date, '-1 day')
-                )
-                SELECT MAX(streak) as current_streak
-                FROM current_streak
-            """, (user_id,))
-            stats['current_streak'] = cursor.fetchone()['current_streak'] or 0
+            stats = {}
+            # 1-2. Серии дней подряд
+            stats['max_consecutive_days'] = row['max_streak'] if row else 0
+            stats['current_streak'] = row['current_streak'] if row else 0
             
             # 3. Любимое время дня
-            cursor = self.conn.execute("""
-                SELECT 
-                    CASE 
-                        WHEN CAST(strftime('%H', started_at) AS INTEGER) BETWEEN 6 AND 11 THEN 'утро (6-12)'
-                        WHEN CAST(strftime('%H', started_at) AS INTEGER) BETWEEN 12 AND 17 THEN 'день (12-18)'
-                        WHEN CAST(strftime('%H', started_at) AS INTEGER) BETWEEN 18 AND 23 THEN 'вечер (18-24)'
-                        ELSE 'ночь (0-6)'
-                    END as time_period,
-                    COUNT(*) as count
-                FROM user_scenarios 
-                WHERE user_id = ?
-                GROUP BY time_period
-                ORDER BY count DESC
-                LIMIT 1
-            """, (user_id,))
-            time_result = cursor.fetchone()
-            stats['favorite_time'] = time_result['time_period'] if time_result else "нет данных"
+            periods = {
+                'утро (6-12)': sum(hours[6:12]),
+                'день (12-18)': sum(hours[12:18]),
+                'вечер (18-24)': sum(hours[18:24]),
+                'ночь (0-6)': sum(hours[0:6]),
+            }
+            favorite_time = max(periods, key=periods.get)
+            stats['favorite_time'] = favorite_time if periods[favorite_time] else "нет данных"
             
-            # 4. Любимый день недели
-            cursor = self.conn.execute("""
-                SELECT 
-                    CASE strftime('%w', started_at)
-                        WHEN '0' THEN 'воскресенье'
-                        WHEN '1' THEN 'понедельник'
-                        WHEN '2' THEN 'вторник'
-                        WHEN '3' THEN 'среда'
-                        WHEN '4' THEN 'четверг'
-                        WHEN '5' THEN 'пятница'
-                        WHEN '6' THEN 'суббота'
-                    END as day_name,
-                    COUNT(*) as count
-                FROM user_scenarios 
-                WHERE user_id = ?
-                GROUP BY day_name
-                ORDER BY count DESC
-                LIMIT 1
-            """, (user_id,))
-            day_result = cursor.fetchone()
-            stats['favorite_day'] = day_result['day_name'] if day_result else "нет данных"
+            # 4. Любимый день недели (воскресенье = 0, как strftime('%w'))
+            day_names = ['воскресенье', 'понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота']
+            favorite_day = max(range(7), key=lambda d: weekdays[d])
+            stats['favorite_day'] = day_names[favorite_day] if weekdays[favorite_day] else "нет данных"
             
             # 5. Средняя глубина прохождения сценариев
-            cursor = self.conn.execute("""
-                SELECT 
-                    AVG(steps_count) as avg_steps,
-                    COUNT(*) as total_sessions
-                FROM user_scenarios 
-                WHERE user_id = ? AND status = 'completed'
-            """, (user_id,))
-            depth_result = cursor.fetchone()
-            stats['avg_session_depth'] = round(depth_result['avg_steps'], 1) if depth_result['avg_steps'] else 0
-            stats['total_completed_sessions'] = depth_result['total_sessions'] or 0
+            stats['avg_session_depth'] = round(row['total_steps'] / completed, 1) if completed else 0
+            stats['total_completed_sessions'] = completed
             
             # 6. Процент завершения сценариев
-            cursor = self.conn.execute("""
-                SELECT 
-                    COUNT(*) as total_sessions,
-                    SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_sessions
-                FROM user_scenarios 
-                WHERE user_id = ?
-            """, (user_id,))
-            completion_result = cursor.fetchone()
-            total = completion_result['total_sessions'] or 0
-            completed = completion_result['completed_sessions'] or 0
             stats['completion_rate'] = round((completed / total * 100), 1) if total > 0 else 0
             
-            # 7. Первый и последний день использования
-            cursor = self.conn.execute("""
-                SELECT 
-                    MIN(DATE(started_at)) as first_day,
-                    MAX(DATE(started_at)) as last_day
-                FROM user_scenarios 
-                WHERE user_id = ?
-            """, (user_id,))
-            dates_result = cursor.fetchone()
-            stats['first_day'] = dates_result['first_day'] if dates_result['first_day'] else None
-            stats['last_day'] = dates_result['last_day'] if dates_result['last_day'] else None
-            
-            # 8. Общее количество дней использования
-            cursor = self.conn.execute("""
-                SELECT COUNT(DISTINCT DATE(started_at)) as unique_days
-                FROM user_scenarios 
-                WHERE user_id = ?
-            """, (user_id,))
-            stats['total_unique_days'] = cursor.fetchone()['unique_days'] or 0
-            
-            # 9. Среднее количество сессий в день
-            cursor = self.conn.execute("""
-                SELECT 
-                    COUNT(*) as total_sessions,
-                    COUNT(DISTINCT DATE(started_at)) as unique_days
-                FROM user_scenarios 
-                WHERE user_id = ?
-            """, (user_id,))
-            sessions_result = cursor.fetchone()
-            total_sessions = sessions_result['total_sessions'] or 0
-            unique_days = sessions_result['unique_days'] or 1
-            stats['avg_sessions_per_day'] = round(total_sessions / unique_days, 1)
+            # 7-9. Дни использования
+            stats['first_day'] = row['first_day'] if row else None
+            stats['last_day'] = row['last_day'] if row else None
+            stats['total_unique_days'] = unique_days
+            stats['avg_sessions_per_day'] = round(total / (unique_days or 1), 1)
             
             # 10. Достижения (бейджи)
             achievements = []
@@ -1328,93 +1431,93 @@ class Database:
             
             return stats
             
-        except sqlite3.Error as e:
+        except (sqlite3.Error, ValueError) as e:
             logger.error(f"Failed to get advanced stats for user {user_id}: {e}", exc_info=True)
             return {}
 
     # --- НОВЫЕ МЕТОДЫ ДЛЯ АДМИН-ПАНЕЛИ ---
     
     def get_retention_metrics(self, days: int = 7):
-        """Получает метрики удержания (D1, D7) из scenario_logs."""
+        """
+        Получает метрики удержания (D1, D7) по когортам (user_cohorts, database/rollups.py).
+
+        Раньше два почти одинаковых CTE заново искали первый день каждого пользователя
+        по scenario_logs и соединяли журнал сам с собой. Кроме того, «первым днём»
+        считался первый день внутри окна, а в знаменатель попадали и те, чей D7 ещё
+        не наступил. Теперь первый день — настоящий, а Dk считается только по
+        когортам окна, которым уже исполнилось k дней.
+        """
         try:
-            # Получаем список исключаемых пользователей
-            try:
-                from config_local import NO_LOGS_USERS
-            except ImportError:
-                from config import NO_LOGS_USERS
-            
-            excluded_users = NO_LOGS_USERS if NO_LOGS_USERS else []
-            excluded_condition = f"AND l1.user_id NOT IN ({','.join(['?'] * len(excluded_users))})" if excluded_users else ""
-            
-            # D1 Retention: пользователи, вернувшиеся на следующий день
             cursor = self.conn.execute(f"""
-                WITH user_first_day AS (
-                    SELECT user_id, MIN(DATE(timestamp, '+3 hours')) as first_day
-                    FROM scenario_logs
-                    WHERE DATE(timestamp, '+3 hours') >= DATE('now', '+3 hours', '-{days} days')
-                    GROUP BY user_id
-                ),
-                user_next_day AS (
-                    SELECT DISTINCT l.user_id
-                    FROM scenario_logs l
-                    INNER JOIN user_first_day ufd ON l.user_id = ufd.user_id
-                    WHERE DATE(l.timestamp, '+3 hours') = DATE(ufd.first_day, '+1 day')
-                )
                 SELECT 
-                    COUNT(DISTINCT ufd.user_id) as total_users,
-                    COUNT(DISTINCT und.user_id) as returned_users
-                FROM user_first_day ufd
-                LEFT JOIN user_next_day und ON ufd.user_id = und.user_id
-                WHERE 1=1 {excluded_condition.replace('l1', 'ufd')}
-            """, list(excluded_users) if excluded_users else [])
-            
-            d1_data = cursor.fetchone()
-            d1_retention = (d1_data['returned_users'] / d1_data['total_users'] * 100) if d1_data['total_users'] > 0 else 0
-            
-            # D7 Retention: пользователи, вернувшиеся на 7-й день
-            cursor = self.conn.execute(f"""
-                WITH user_first_day AS (
-                    SELECT user_id, MIN(DATE(timestamp, '+3 hours')) as first_day
-                    FROM scenario_logs
-                    WHERE DATE(timestamp, '+3 hours') >= DATE('now', '+3 hours', '-{days} days')
-                    GROUP BY user_id
-                ),
-                user_7th_day AS (
-                    SELECT DISTINCT l.user_id
-                    FROM scenario_logs l
-                    INNER JOIN user_first_day ufd ON l.user_id = ufd.user_id
-                    WHERE DATE(l.timestamp, '+3 hours') = DATE(ufd.first_day, '+7 days')
-                )
-                SELECT 
-                    COUNT(DISTINCT ufd.user_id) as total_users,
-                    COUNT(DISTINCT u7d.user_id) as returned_users
-                FROM user_first_day ufd
-                LEFT JOIN user_7th_day u7d ON ufd.user_id = u7d.user_id
-                WHERE 1=1 {excluded_condition.replace('l1', 'ufd')}
-            """, list(excluded_users) if excluded_users else [])
-            
-            d7_data = cursor.fetchone()
-            d7_retention = (d7_data['returned_users'] / d7_data['total_users'] * 100) if d7_data['total_users'] > 0 else 0
+                    SUM(first_day <= date('now', '+3 hours', '-1 day')) as d1_total,
+                    SUM(first_day <= date('now', '+3 hours', '-1 day') AND (activity >> 1) & 1) as d1_returned,
+                    SUM(first_day <= date('now', '+3 hours', '-7 days')) as d7_total,
+                    SUM(first_day <= date('now', '+3 hours', '-7 days') AND (activity >> 7) & 1) as d7_returned
+                FROM user_cohorts
+                WHERE first_day >= date('now', '+3 hours', '-{days} days')
+            """)
+            row = cursor.fetchone()
+            d1_total, d1_returned = row['d1_total'] or 0, row['d1_returned'] or 0
+            d7_total, d7_returned = row['d7_total'] or 0, row['d7_returned'] or 0
+            d1_retention = (d1_returned / d1_total * 100) if d1_total > 0 else 0
+            d7_retention = (d7_returned / d7_total * 100) if d7_total > 0 else 0
             
             return {
                 'd1_retention': round(d1_retention, 1),
                 'd7_retention': round(d7_retention, 1),
-                'd1_total_users': d1_data['total_users'],
-                'd1_returned_users': d1_data['returned_users'],
-                'd7_total_users': d7_data['total_users'],
-                'd7_returned_users': d7_data['returned_users']
+                'd1_total_users': d1_total,
+                'd1_returned_users': d1_returned,
+                'd7_total_users': d7_total,
+                'd7_returned_users': d7_returned
             }
         except sqlite3.Error as e:
             logger.error(f"Failed to get retention metrics: {e}", exc_info=True)
             return {'d1_retention': 0, 'd7_retention': 0, 'd1_total_users': 0, 'd1_returned_users': 0, 'd7_total_users': 0, 'd7_returned_users': 0}
 
+    def get_cohort_retention_matrix(self, days: int = 30, max_day: int = 30):
+        """
+        Матрица удержания по дневным когортам за последние days дней.
+
+        Возвращает список от свежих когорт к старым:
+        {'first_day': 'YYYY-MM-DD', 'size': N, 'retained': [D0, D1, ..., D{max_day}]},
+        где Dk — сколько человек из когорты были активны на k-й день, или None,
+        если этот день для когорты ещё не наступил.
+        """
+        max_day = min(max_day, rollups.MAX_COHORT_DAY)
+        try:
+            columns = ", ".join(f"SUM((activity >> {k}) & 1)" for k in range(max_day + 1))
+            cursor = self.conn.execute(f"""
+                SELECT 
+                    first_day,
+                    COUNT(*) as size,
+                    CAST(julianday(date('now', '+3 hours')) - julianday(first_day) AS INTEGER) as age,
+                    {columns}
+                FROM user_cohorts
+                WHERE first_day >= date('now', '+3 hours', '-{days} days')
+                GROUP BY first_day
+                ORDER BY first_day DESC
+            """)
+            matrix = []
+            for row in cursor.fetchall():
+                age = row[2]
+                matrix.append({
+                    'first_day': row[0],
+                    'size': row[1],
+                    'retained': [row[3 + k] if k <= age else None for k in range(max_day + 1)]
+                })
+            return matrix
+        except sqlite3.Error as e:
+            logger.error(f"Failed to get cohort retention matrix: {e}", exc_info=True)
+            return []
+
     def get_dau_metrics(self, days: int = 7):
-        """Получает метрики DAU (Daily Active Users) через VIEW (v_dau_daily)."""
+        """Получает метрики DAU (Daily Active Users) из дневных агрегатов (daily_active_users)."""
         try:
             # DAU за сегодня
             cursor = self.conn.execute("""
-                SELECT COALESCE(dau, 0) as dau
-                FROM v_dau_daily 
+                SELECT COUNT(*) as dau
+                FROM daily_active_users 
                 WHERE d_local = date('now', '+3 hours')
             """)
             row = cursor.fetchone()
@@ -1422,8 +1525,8 @@ class Database:
             
             # DAU за вчера
             cursor = self.conn.execute("""
-                SELECT COALESCE(dau, 0) as dau
-                FROM v_dau_daily 
+                SELECT COUNT(*) as dau
+                FROM daily_active_users 
                 WHERE d_local = date('now', '+3 hours', '-1 day')
             """)
             row = cursor.fetchone()
@@ -1432,8 +1535,8 @@ class Database:
             # Средний DAU за 7 дней
             cursor = self.conn.execute("""
                 SELECT AVG(dau) as avg_dau
-                FROM v_dau_daily 
-                WHERE d_local >= date('now', '+3 hours', '-7 days')
+                FROM (SELECT COUNT(*) as dau FROM daily_active_users
+                      WHERE d_local >= date('now', '+3 hours', '-7 days') GROUP BY d_local)
             """)
             row = cursor.fetchone()
             dau_7 = row[0] if row and row[0] else 0
@@ -1441,8 +1544,8 @@ class Database:
             # Средний DAU за 30 дней
             cursor = self.conn.execute("""
                 SELECT AVG(dau) as avg_dau
-                FROM v_dau_daily 
-                WHERE d_local >= date('now', '+3 hours', '-30 days')
+                FROM (SELECT COUNT(*) as dau FROM daily_active_users
+                      WHERE d_local >= date('now', '+3 hours', '-30 days') GROUP BY d_local)
             """)
             row = cursor.fetchone()
             dau_30 = row[0] if row and row[0] else 0
@@ -1455,11 +1558,11 @@ class Database:
             }
         except sqlite3.Error as e:
             logger.error(f"Failed to get DAU metrics: {e}", exc_info=True)
-            logger.warning(f"Falling back to legacy DAU metrics (VIEW might not exist yet)")
+            logger.warning(f"Falling back to legacy DAU metrics (rollups might not exist yet)")
             return {'dau_today': 0, 'dau_yesterday': 0, 'dau_7': 0, 'dau_30': 0}
 
     def get_card_funnel_metrics(self, days: int = 7, include_excluded_users: bool = False):
-        """Получает метрики воронки сценария 'Карта дня' через VIEW (v_events)."""
+        """Получает метрики воронки сценария 'Карта дня' из дневных агрегатов (daily_scenario_steps)."""
         try:
             # Определяем фильтр периода
             if days == 0:  # Сегодня
@@ -1469,25 +1572,25 @@ class Database:
             
             # Если нужно включить исключенных пользователей, используем scenario_logs напрямую
             if include_excluded_users:
-                # Используем scenario_logs с JSON_EXTRACT для session_id
+                # Используем scenario_logs напрямую, session_id — колонка таблицы
                 cursor = self.conn.execute(f"""
                     SELECT
                         step,
-                        COUNT(DISTINCT JSON_EXTRACT(metadata, '$.session_id')) as count
+                        COUNT(DISTINCT session_id) as count
                     FROM scenario_logs
                     WHERE scenario = 'card_of_day'
-                      AND {period_filter.replace('d_local', "DATE(timestamp, '+3 hours')")}
+                      AND {period_filter}
                     GROUP BY step
                 """)
             else:
-                # Используем v_events (по умолчанию)
+                # По умолчанию — агрегаты без ignored_users, как раньше v_events
                 cursor = self.conn.execute(f"""
                     SELECT
-                        event,
-                        COUNT(DISTINCT session_id) as count
-                    FROM v_events
+                        step,
+                        SUM(sessions) as count
+                    FROM daily_scenario_steps
                     WHERE scenario = 'card_of_day' AND {period_filter}
-                    GROUP BY event
+                    GROUP BY step
                 """)
             
             # Собираем статистику по шагам
@@ -1543,7 +1646,7 @@ class Database:
             }
         except sqlite3.Error as e:
             logger.error(f"Failed to get card funnel metrics: {e}", exc_info=True)
-            logger.warning(f"Falling back to zero metrics (VIEW might not exist yet)")
+            logger.warning(f"Falling back to zero metrics (rollups might not exist yet)")
             return {'step1': {'count': 0, 'pct': 0}, 'step2': {'count': 0, 'pct': 0}, 'step3': {'count': 0, 'pct': 0}, 'step4': {'count': 0, 'pct': 0}, 'step5': {'count': 0, 'pct': 0}, 'step6': {'count': 0, 'pct': 0}, 'step7': {'count': 0, 'pct': 0}, 'completion_rate': 0}
 
     def get_value_metrics(self, days: int = 7, include_excluded_users: bool = False):
@@ -1574,7 +1677,7 @@ class Database:
                     FROM scenario_logs 
                     WHERE scenario = 'card_of_day' 
                     AND step = 'mood_change_recorded'
-                    AND timestamp >= datetime('now', '-{days} days', '+3 hours')
+                    AND ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - {days} * 86400
                     {excluded_condition}
                     GROUP BY user_id
                 ) sessions
@@ -1590,11 +1693,11 @@ class Database:
             cursor = self.conn.execute(f"""
                 SELECT 
                     COUNT(*) as total_feedback,
-                    SUM(CASE WHEN metadata LIKE '%"rating": "helped"%' OR metadata LIKE '%"rating": "interesting"%' THEN 1 ELSE 0 END) as positive_feedback
+                    SUM(CASE WHEN json_extract(metadata, '$.rating') IN ('helped', 'interesting') THEN 1 ELSE 0 END) as positive_feedback
                 FROM scenario_logs 
                 WHERE scenario = 'card_of_day' 
                 AND step = 'usefulness_rating'
-                AND timestamp >= datetime('now', '-{days} days', '+3 hours')
+                AND ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - {days} * 86400
                 {excluded_condition}
             """, list(excluded_users) if excluded_users else [])
             
@@ -1615,47 +1718,29 @@ class Database:
             return {'resource_lift': {'positive_pct': 0, 'negative_pct': 0, 'total_sessions': 0}, 'feedback_score': 0, 'total_feedback': 0}
 
     def get_deck_popularity_metrics(self, days: int = 7):
-        """Получает метрики популярности колод через VIEW (v_decks_daily) с fallback на scenario_logs."""
+        """Получает метрики популярности колод из дневных агрегатов (daily_deck_draws)."""
         try:
             # Определяем фильтр периода
             if days == 0:  # Сегодня
                 period_filter = "d_local = date('now', '+3 hours')"
-                period_filter_logs = "DATE(timestamp, '+3 hours') = DATE('now', '+3 hours')"
             else:
                 period_filter = f"d_local >= date('now', '+3 hours', '-{days} days')"
-                period_filter_logs = f"DATE(timestamp, '+3 hours') >= DATE('now', '+3 hours', '-{days} days')"
             
-            # Сначала пробуем VIEW
+            # Раньше здесь был v_decks_daily, который искал колоду в metadata.deck и
+            # всегда был пуст, и fallback на полный проход scenario_logs по deck_name.
+            # Агрегат понимает оба ключа. unique_users — сумма дневных, как и было.
             cursor = self.conn.execute(f"""
                 SELECT 
                     deck,
                     SUM(draws) as total_draws,
-                    SUM(uniq_users) as unique_users
-                FROM v_decks_daily 
-                WHERE {period_filter} AND deck IS NOT NULL
+                    SUM(users) as unique_users
+                FROM daily_deck_draws 
+                WHERE {period_filter}
                 GROUP BY deck
             """)
             
             deck_stats = cursor.fetchall()
             
-            # Если VIEW пустой, используем fallback на scenario_logs
-            if not deck_stats:
-                logger.warning("v_decks_daily is empty, falling back to scenario_logs")
-                cursor = self.conn.execute(f"""
-                    SELECT 
-                        JSON_EXTRACT(metadata, '$.deck_name') as deck,
-                        COUNT(*) as total_draws,
-                        COUNT(DISTINCT user_id) as unique_users
-                    FROM scenario_logs 
-                    WHERE scenario = 'card_of_day' 
-                    AND step = 'card_drawn'
-                    AND {period_filter_logs}
-                    AND JSON_EXTRACT(metadata, '$.deck_name') IS NOT NULL
-                    AND user_id NOT IN (SELECT user_id FROM ignored_users)
-                    GROUP BY JSON_EXTRACT(metadata, '$.deck_name')
-                """)
-                deck_stats = cursor.fetchall()
-            
             deck_stats_dict = {}
             total_draws_all = 0
             
@@ -1687,7 +1772,7 @@ class Database:
             }
         except sqlite3.Error as e:
             logger.error(f"Failed to get deck popularity metrics: {e}", exc_info=True)
-            logger.warning(f"Falling back to zero deck metrics (VIEW might not exist yet)")
+            logger.warning(f"Falling back to zero deck metrics (rollups might not exist yet)")
             return {
                 'decks': {
                     'nature': {'total_draws': 0, 'unique_users': 0, 'percentage': 0},
@@ -1807,32 +1892,54 @@ class Database:
                 'recent_reflections': []
             }
 
-    def get_admin_dashboard_summary(self, days: int = 7):
-        """Получает сводку для главного дашборда админки."""
+    # Части сводки дашборда: ключ в summary -> (метод, аргументы без days)
+    DASHBOARD_PARTS = {
+        'retention': ('get_retention_metrics', ()),
+        'dau': ('get_dau_metrics', ()),
+        'card_stats': ('get_scenario_stats', ('card_of_day',)),
+        'evening_stats': ('get_scenario_stats', ('evening_reflection',)),
+        'funnel': ('get_card_funnel_metrics', ()),
+        'value': ('get_value_metrics', ()),
+        'deck_popularity': ('get_deck_popularity_metrics', ()),
+    }
+
+    def get_admin_dashboard_summary(self, days: int = 7, force: bool = False):
+        """
+        Получает сводку для главного дашборда админки.
+
+        Раньше все семь метрик пересчитывались при каждом открытии дашборда,
+        удержания, воронки и ценности, в том числе при простом переключении
+        вкладок. Теперь каждая метрика хранится снимком по ключу (метод, days)
+        в self.dashboard_cache на dashboard_ttl секунд, а горячие периоды
+        заранее обновляет фоновая задача (modules/admin/dashboard.py).
+        force=True — пересчитать сейчас (кнопка «Обновить»).
+        В summary['as_of'] — время самого старого из снимков.
+        """
         try:
-            # Основные метрики
-            retention = self.get_retention_metrics(days)
-            dau = self.get_dau_metrics(days)
-            card_stats = self.get_scenario_stats('card_of_day', days)
-            evening_stats = self.get_scenario_stats('evening_reflection', days)
-            funnel = self.get_card_funnel_metrics(days)
-            value = self.get_value_metrics(days)
-            deck_popularity = self.get_deck_popularity_metrics(days)
-            
-            return {
-                'retention': retention,
-                'dau': dau,
-                'card_stats': card_stats,
-                'evening_stats': evening_stats,
-                'funnel': funnel,
-                'value': value,
-                'deck_popularity': deck_popularity,
-                'period_days': days
-            }
+            summary = {}
+            computed = []
+            for key, (method, args) in self.DASHBOARD_PARTS.items():
+                summary[key], as_of = self._metric_snapshot(method, (*args, days), force)
+                computed.append(as_of)
+            summary['period_days'] = days
+            summary['as_of'] = min(computed)
+            return summary
         except Exception as e:
             logger.error(f"Failed to get admin dashboard summary: {e}", exc_info=True)
             return None
 
+    def _metric_snapshot(self, method: str, args: tuple, force: bool = False):
+        """(значение, время расчёта) метрики из кэша снимков или свежим расчётом."""
+        key = (method, *args)
+        if not force:
+            cached = self.dashboard_cache.get(key)
+            if cached is not MISSING:
+                return cached
+        generation = self.dashboard_cache.generation()
+        snapshot = (getattr(self, method)(*args), datetime.now(TIMEZONE))
+        self.dashboard_cache.set(key, snapshot, generation=generation)
+        return snapshot
+
     # --- МЕТОДЫ ДЛЯ РАБОТЫ С ПОСТАМИ И РАССЫЛКАМИ ---
     
     def create_post(self, title: str, content: str, created_by: int, media_file_id: str = None) -> int:
@@ -2022,42 +2129,35 @@ class Database:
             logger.error(f"Error logging mailing result: {e}")
             return False
     
+    def record_reachability(self, user_id: int, status: str = None, error: str = None) -> bool:
+        """
+        Обновляет признак доступности по итогу отправки (database/reachability.py).
+        status — статус рассылки ('sent'/'blocked'/'failed'), error — текст ошибки.
+        """
+        try:
+            with self.conn:
+                reachability.record(self.conn, user_id, status, error)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error recording reachability for user {user_id}: {e}")
+            return False
+
     def get_unreachable_user_ids(self) -> set:
         """
         Пользователи, до которых бот достучаться не может: заблокировали его или
         удалили аккаунт. Нужно, чтобы не тратить на них рассылку и не портить
         статистику доставки — в прошлых рассылках треть «неудач» была именно такой.
 
-        Признак берём из двух источников: журнала рассылок и журнала напоминаний.
-        Напоминания уходят ежедневно, поэтому дают куда более свежую картину, чем
-        рассылки. Человек мог заблокировать бота и вернуться, поэтому по каждому
-        смотрим только самый последний сигнал.
+        Признак складывается из двух источников: рассылок и напоминаний — те уходят
+        ежедневно и дают куда более свежую картину. Человек мог заблокировать бота
+        и вернуться, поэтому по каждому хранится только самый последний сигнал.
 
-        Время в двух таблицах хранится по-разному ('2025-12-02 10:17:41' против
-        '2026-08-08T19:00:39.342977+03:00'), поэтому перед сравнением приводим обе
-        отметки к одному виду, иначе сортировка по свежести врёт.
+        Раньше метод каждый раз сканировал mailing_logs и все reminder_sent в actions
+        с LIKE по тексту ошибок. Теперь признак ведётся в user_reachability в момент
+        отправки, а здесь — чтение по частичному индексу.
         """
         try:
-            cursor = self.conn.execute("""
-                WITH signals AS (
-                    SELECT user_id,
-                           replace(substr(sent_at, 1, 19), 'T', ' ') AS ts,
-                           CASE WHEN status = 'blocked'
-                                  OR COALESCE(error_message, '') LIKE '%Forbidden%'
-                                THEN 0 ELSE 1 END AS ok
-                    FROM mailing_logs
-                    UNION ALL
-                    SELECT user_id,
-                           replace(substr(timestamp, 1, 19), 'T', ' ') AS ts,
-                           CASE WHEN details LIKE '%Forbidden%' THEN 0 ELSE 1 END AS ok
-                    FROM actions
-                    WHERE action = 'reminder_sent'
-                )
-                SELECT s.user_id
-                FROM signals s
-                WHERE s.ok = 0
-                  AND s.ts = (SELECT MAX(ts) FROM signals x WHERE x.user_id = s.user_id)
-            """)
+            cursor = self.conn.execute("SELECT user_id FROM user_reachability WHERE reachable = 0")
             return {row[0] for row in cursor.fetchall()}
         except sqlite3.Error as e:
             logger.error(f"Error getting unreachable users: {e}")
@@ -2103,9 +2203,74 @@ class Database:
 
     # --- КОНЕЦ НОВЫХ МЕТОДОВ ---
 
+    # --- ГРУППОВАЯ ЗАПИСЬ СОБЫТИЙ ---
+
+    def enable_write_behind(self, interval_ms: int = 200, max_rows: int = 200):
+        """
+        Включает отложенную запись save_action и log_scenario_step (database/event_buffer.py).
+        Буфер пишет через своё соединение, чтобы сброс не делил транзакцию с хендлерами.
+        """
+        if self.events is not None:
+            return self.events
+        if self.path and self.path != ":memory:":
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            own = True
+        else:
+            conn, own = self.conn, False
+        self.events = EventBuffer(conn, interval_ms=interval_ms, max_rows=max_rows, own_connection=own)
+        self.events.start()
+        return self.events
+
+    def flush_events(self) -> int:
+        """Дописывает накопленные события. Вызывается там, где нужны свежие actions/scenario_logs."""
+        if self.events is None:
+            return 0
+        return self.events.flush()
+
+    def get_event_buffer_stats(self) -> dict:
+        return self.events.stats() if self.events is not None else {}
+
+    def refresh_rollups(self) -> int:
+        """Дописывает дневные агрегаты дашборда (database/rollups.py). Возвращает число новых событий."""
+        try:
+            self.flush_events()
+            return rollups.refresh(self.conn)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to refresh daily rollups: {e}", exc_info=True)
+            return 0
+
+    def rebuild_rollups(self) -> int:
+        """Пересобирает дневные агрегаты с нуля."""
+        try:
+            self.flush_events()
+            return rollups.rebuild(self.conn)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to rebuild daily rollups: {e}", exc_info=True)
+            return 0
+
+    def archive_actions(self, older_than_days: int = archive.DEFAULT_ARCHIVE_DAYS) -> int:
+        """
+        Переносит actions старше older_than_days в месячные архивы и возвращает
+        освободившееся место файлу базы (если она уже на auto_vacuum=INCREMENTAL).
+        Возвращает число перенесённых строк.
+        """
+        try:
+            self.flush_events()
+            moved = archive.archive_actions(self.conn, self.archive_dir, older_than_days)
+            if moved:
+                archive.compact(self.conn)
+            return moved
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Failed to archive actions: {e}", exc_info=True)
+            return 0
+
     def close(self):
         # ... (код метода close) ...
         """Закрывает соединение с базой данных."""
+        if self.events is not None:
+            self.events.stop()
+            self.events = None
         if self.conn:
             try:
                 self.conn.close()
@@ -2172,7 +2337,7 @@ class Database:
                 self.conn.execute("""
                     UPDATE users SET first_seen = ? WHERE user_id = ? AND (first_seen IS NULL OR first_seen = '')
                 """, (first_seen.isoformat(), user_id))
-            
+            self._invalidate_user(user_id)
             return True
         except sqlite3.Error as e:
             logger.error(f"Error updating first_seen for user {user_id}: {e}", exc_info=True)
@@ -2273,12 +2438,12 @@ class Database:
                 SELECT card_number
                 FROM user_requests 
                 WHERE user_id = ? 
-                AND timestamp >= ? 
-                AND timestamp <= ?
+                AND ts_epoch >= ? 
+                AND ts_epoch <= ?
                 AND card_number IS NOT NULL
-                ORDER BY timestamp DESC
+                ORDER BY ts_epoch DESC
                 LIMIT 1
-            """, (user_id, today_start.isoformat(), today_end.isoformat()))
+            """, (user_id, int(today_start.timestamp()), int(today_end.timestamp())))
             
             result = cursor.fetchone()
             if result and result[0] is not None:
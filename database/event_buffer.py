@@ -0,0 +1,232 @@
+"""
+Буфер событий с групповой записью для actions и scenario_logs.
+
+save_action и log_scenario_step раньше открывали свою транзакцию на каждый вызов.
+Одна сессия «Карты дня» даёт их больше десятка подряд (log_action и
+log_scenario_step идут парами), и каждый вызов стоил отдельный коммит с fsync на
+горячем пути ответа пользователю.
+
+Теперь строки складываются в очередь в памяти, а фоновый поток раз в interval_ms
+(или как только набралось max_rows) пишет всё накопленное одной транзакцией, по
+одному executemany на таблицу. События только дописываются и никогда не
+обновляются, поэтому отложенная запись не меняет их смысла — меняется только
+момент, когда строка станет видна.
+
+Для мест, которым нужны свежие данные (счётчик шагов при завершении сценария,
+get_actions), есть flush(): он синхронно дописывает очередь. Метрики админки
+могут отставать на один интервал, это не заметно.
+
+Если база занята или заблокирована (OperationalError), пачка возвращается в
+начало очереди и уходит со следующей попыткой. Раньше так же возвращалась пачка
+при любой sqlite3.Error, и одна строка, нарушающая ограничение (IntegrityError),
+валила каждый следующий сброс и навсегда запирала очередь. Теперь при прочих
+ошибках пачка пишется заново построчно: строки, которые база не принимает,
+отбрасываются в лог со счётчиком rejected, остальные доходят.
+
+Очередь ограничена max_pending: если база недоступна долго, старые события
+отбрасываются со счётчиком dropped, а бот не съедает всю память.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_MS = 200
+DEFAULT_MAX_ROWS = 200
+DEFAULT_MAX_PENDING = 50_000
+
+# Порядок колонок в кортежах очереди совпадает с порядком в INSERT. Время события
+# фиксируется при постановке в очередь, а не при сбросе: для scenario_logs это тот же
+# формат, что даёт CURRENT_TIMESTAMP (UTC, 'YYYY-MM-DD HH:MM:SS').
+TABLE_SQL = {
+    "actions": "INSERT INTO actions (user_id, username, name, action, details, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+    "scenario_logs": "INSERT INTO scenario_logs (user_id, scenario, step, metadata, timestamp, session_id) VALUES (?, ?, ?, ?, ?, ?)",
+    # Не вставка, а счётчик шагов сессии (log_scenario_step): сбрасывается той же
+    # транзакцией, что и сами шаги, поэтому steps_count не расходится с журналом.
+    "user_scenarios": ("UPDATE user_scenarios SET steps_count = COALESCE(steps_count, 0) + 1, last_step = ?"
+                       " WHERE session_id = ? AND user_id = ? AND status = 'in_progress'"),
+}
+
+
+class EventBuffer:
+    """Очередь вставок с фоновым сбросом одной транзакцией."""
+
+    def __init__(self, conn: sqlite3.Connection, interval_ms: int = DEFAULT_INTERVAL_MS,
+                 max_rows: int = DEFAULT_MAX_ROWS, max_pending: int = DEFAULT_MAX_PENDING,
+                 own_connection: bool = False):
+        self.conn = conn
+        self.interval = max(interval_ms, 1) / 1000
+        self.max_rows = max(max_rows, 1)
+        self.max_pending = max(max_pending, self.max_rows)
+        self._own_connection = own_connection
+
+        self._queue: deque = deque()          # (table, params)
+        self._queue_lock = threading.Lock()   # короткие операции с очередью
+        self._flush_lock = threading.Lock()   # одна запись в базу за раз
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.enqueued = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # --- Очередь ---
+
+    def add(self, table: str, params: tuple):
+        with self._queue_lock:
+            self._queue.append((table, params))
+            self.enqueued += 1
+            overflow = len(self._queue) - self.max_pending
+            if overflow > 0:
+                for _ in range(overflow):
+                    self._queue.popleft()
+                self.dropped += overflow
+                logger.error(f"EventBuffer overflow: dropped {overflow} oldest events (total dropped {self.dropped})")
+            depth = len(self._queue)
+            self.max_depth = max(self.max_depth, depth)
+        if depth >= self.max_rows:
+            self._wakeup.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    # --- Запись ---
+
+    def flush(self) -> int:
+        """
+        Дописывает всё накопленное одной транзакцией. Возвращает число записанных строк.
+
+        Проверка очереди — только под _flush_lock: пока фоновый поток пишет уже
+        вынутую пачку, очередь пуста, но строки ещё не в базе. Без блокировки
+        flush() возвращался сразу, и complete_user_scenario закрывал сессию раньше,
+        чем доходил счётчик шагов, — UPDATE со status = 'in_progress' потом не
+        находил строку, и шаги терялись. Теперь вызов ждёт пачку в полёте (а при
+        её ошибке — сам повторяет запись вернувшихся в очередь строк).
+        """
+        with self._flush_lock:
+            with self._queue_lock:
+                batch = list(self._queue)
+                self._queue.clear()
+            if not batch:
+                return 0
+
+            grouped: dict[str, list] = {}
+            for table, params in batch:
+                grouped.setdefault(table, []).append(params)
+
+            started = time.perf_counter()
+            try:
+                with self.conn:
+                    for table, rows in grouped.items():
+                        self.conn.executemany(TABLE_SQL[table], rows)
+                written = len(batch)
+            except sqlite3.OperationalError as e:
+                return self._requeue(batch, e)
+            except sqlite3.Error as e:
+                logger.error(f"EventBuffer flush of {len(batch)} rows failed, writing row by row: {e}")
+                try:
+                    written = self._write_row_by_row(batch)
+                except sqlite3.OperationalError as e:
+                    return self._requeue(batch, e)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.flushed_rows += written
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            return written
+
+    def _requeue(self, batch: list, error: sqlite3.Error) -> int:
+        """Возвращает пачку в начало очереди: база занята, строки уйдут со следующей попыткой."""
+        self.failed_flushes += 1
+        with self._queue_lock:
+            self._queue.extendleft(reversed(batch))
+        logger.error(f"EventBuffer flush of {len(batch)} rows failed, will retry: {error}", exc_info=True)
+        return 0
+
+    def _write_row_by_row(self, batch: list) -> int:
+        """
+        Пишет пачку по одной строке в одной транзакции и отбрасывает строки, которые
+        база не принимает. Ошибка ограничения откатывает только свой оператор, так что
+        остальные строки транзакции остаются. OperationalError пробрасывается наружу:
+        это не плохая строка, а занятая база, и пачку надо повторить целиком.
+        """
+        written = 0
+        with self.conn:
+            for table, params in batch:
+                try:
+                    self.conn.execute(TABLE_SQL[table], params)
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    self.rejected += 1
+                    logger.error(f"EventBuffer rejected {table} row {params!r}: {e}")
+                else:
+                    written += 1
+        return written
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Поток сброса не должен умирать: иначе события копились бы до переполнения.
+                logger.error(f"EventBuffer flusher error: {e}", exc_info=True)
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="db-event-flush", daemon=True)
+        self._thread.start()
+        logger.info(f"EventBuffer started: interval={self.interval * 1000:.0f}ms, max_rows={self.max_rows}")
+
+    def stop(self):
+        """Останавливает фоновый поток и дописывает остаток очереди."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        written = self.flush()
+        if self._queue:
+            logger.error(f"EventBuffer stopped with {len(self._queue)} unwritten events")
+        if self._own_connection:
+            try:
+                self.conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing EventBuffer connection: {e}", exc_info=True)
+        logger.info(f"EventBuffer stopped, final flush wrote {written} rows. Stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "rows_per_flush": round(self.flushed_rows / self.flushes, 1) if self.flushes else 0.0,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
@@ -0,0 +1,308 @@
+"""
+Хранилище состояний FSM aiogram в SQLite (таблица fsm_storage, шаг миграции 14).
+
+Раньше main.py держал состояния в MemoryStorage: каждый перезапуск (а бутстрап
+с GitHub перезапускает бота часто) выбрасывал людей из середины «Карты дня»,
+вечерней рефлексии, обучения и теста «Стать автором». Заодно MemoryStorage
+заводит запись на любого, кто хоть раз написал боту, и не удаляет её никогда.
+
+Теперь:
+  * чтение — только из памяти: при открытии загружаются все записи, и
+    get_state/get_data на горячем пути в базу не ходят;
+  * запись откладывается: set_state/set_data помечают ключ, а фоновая задача раз
+    в interval_ms пишет все изменённые ключи одним executemany в потоке. Пять
+    update_data подряд в одном хендлере дают одну строку в одной транзакции;
+  * пустая запись (state = None и data = {}) удаляется и из памяти, и из базы —
+    state.clear() освобождает место сразу;
+  * запись, которую не трогали дольше ttl, выбрасывается фоновой чисткой (sweep):
+    брошенные на середине сценарии иначе держали бы в памяти тексты запросов и
+    ответов навсегда. О каждой выброшенной записи сообщается on_expire — main.py
+    закрывает по ней сессию в user_scenarios как abandoned. Записи, простоявшие
+    дольше ttl, пока бот был выключен, загружаются со временем последней записи
+    и уходят первой же чисткой сразу после старта — тоже через on_expire, иначе
+    их сессии навсегда остались бы незакрытыми;
+  * stats() — число живых записей по группам состояний и примерный объём data
+    (размер её JSON на момент последней записи), чтобы рост был виден без профайлера;
+  * data хранится минифицированным JSON без экранирования кириллицы
+    (json_codec.dumps). Значение, которое не сериализуется в JSON, живёт только в
+    памяти — ошибка пишется в лог, а хендлер продолжает работать.
+
+Потеря при падении процесса — не больше одного интервала изменений.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from database.json_codec import dumps
+
+try:
+    from aiogram.exceptions import DataNotDictLikeError
+except ImportError:  # aiogram до 3.4
+    DataNotDictLikeError = TypeError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_MS = 500
+DEFAULT_TTL_SEC = 7 * 24 * 3600
+DEFAULT_SWEEP_SEC = 600
+
+UPSERT_SQL = """
+INSERT INTO fsm_storage (key, user_id, state, data, updated_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+"""
+DELETE_SQL = "DELETE FROM fsm_storage WHERE key = ?"
+
+
+class FSMRecord:
+    __slots__ = ("user_id", "state", "data", "touched", "size")
+
+    def __init__(self, user_id, state=None, data=None, touched=None, size=0):
+        self.user_id = user_id
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched if touched is not None else time.time()
+        self.size = size  # байт JSON data при последней записи в базу
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage aiogram: память как кэш чтения, SQLite — отложенная запись изменений."""
+
+    def __init__(self, path: str, interval_ms: int = DEFAULT_INTERVAL_MS, ttl_sec: float = DEFAULT_TTL_SEC,
+                 sweep_sec: float = DEFAULT_SWEEP_SEC, key_builder: KeyBuilder = None, on_expire=None):
+        """on_expire — async (user_id, state, data) для каждой записи, выброшенной за простой."""
+        self.path = path
+        self.on_expire = on_expire
+        self.interval = max(interval_ms, 1) / 1000
+        self.ttl = ttl_sec
+        self.sweep_interval = sweep_sec
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+
+        self.records: dict[str, FSMRecord] = {}
+        self._dirty: set[str] = set()
+        self._write_lock = asyncio.Lock()
+        self._task = None
+
+        self.flushes = 0
+        self.written_rows = 0
+        self.failed_flushes = 0
+        self.expired = 0
+        self.expire_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.load()
+
+    # --- Загрузка ---
+
+    def load(self) -> int:
+        """
+        Читает все записи; touched — время последней записи в базу. Простоявшие
+        дольше ttl выбросит первый sweep. Возвращает число загруженных.
+        """
+        try:
+            rows = self.conn.execute("SELECT key, user_id, state, data, updated_at FROM fsm_storage").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load FSM storage from {self.path}: {e}", exc_info=True)
+            return 0
+        for key, user_id, state, raw, updated_at in rows:
+            try:
+                data = json.loads(raw) if raw else {}
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping FSM record {key} with broken data: {e}")
+                continue
+            self.records[key] = FSMRecord(user_id, state, data, updated_at, len(raw.encode("utf-8")) if raw else 0)
+        cutoff = time.time() - self.ttl
+        stale = sum(record.touched < cutoff for record in self.records.values())
+        logger.info(f"FSM storage loaded {len(self.records)} records from {self.path} ({stale} idle past ttl)")
+        return len(self.records)
+
+    # --- BaseStorage ---
+
+    def _record(self, key: StorageKey, create: bool = False):
+        name = self.key_builder.build(key)
+        record = self.records.get(name)
+        if record is None and create:
+            record = self.records[name] = FSMRecord(key.user_id)
+        if record is not None:
+            record.touched = time.time()
+        return name, record
+
+    def _changed(self, name: str, record: FSMRecord):
+        if record.empty:
+            self.records.pop(name, None)
+        self._dirty.add(name)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        name, record = self._record(key, create=state is not None)
+        if record is None or record.state == state:
+            return
+        record.state = state
+        self._changed(name, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = self._record(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name, record = self._record(key, create=bool(data))
+        if record is None:
+            return
+        record.data = data.copy()
+        self._changed(name, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = self._record(key)
+        return record.data.copy() if record else {}
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись, дописывает изменения и закрывает соединение."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._dirty:
+            logger.error(f"FSM storage closed with {len(self._dirty)} unwritten records")
+        self.conn.close()
+        logger.info(f"FSM storage closed. Stats: {self.stats()}")
+
+    # --- Запись ---
+
+    def _snapshot(self):
+        """Строки для записи по изменённым ключам; ключи без записи — удаления."""
+        upserts, deletes = [], []
+        now = int(time.time())
+        for name in self._dirty:
+            record = self.records.get(name)
+            if record is None:
+                deletes.append((name,))
+                continue
+            try:
+                raw = dumps(record.data)
+                record.size = len(raw.encode("utf-8"))
+                upserts.append((name, record.user_id, record.state, raw, now))
+            except (TypeError, ValueError) as e:
+                logger.error(f"FSM data for {name} is not JSON-serializable, kept in memory only: {e}")
+        return upserts, deletes
+
+    def _write(self, upserts, deletes):
+        with self.conn:
+            if upserts:
+                self.conn.executemany(UPSERT_SQL, upserts)
+            if deletes:
+                self.conn.executemany(DELETE_SQL, deletes)
+
+    async def flush(self) -> int:
+        """Пишет изменённые ключи одной транзакцией в потоке. Возвращает число строк."""
+        async with self._write_lock:
+            if not self._dirty:
+                return 0
+            upserts, deletes = self._snapshot()
+            batch = set(self._dirty)
+            self._dirty.clear()
+            started = time.perf_counter()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, upserts, deletes)
+            except sqlite3.Error as e:
+                self.failed_flushes += 1
+                self._dirty |= batch
+                logger.error(f"FSM storage flush of {len(batch)} records failed, will retry: {e}", exc_info=True)
+                return 0
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.written_rows += len(upserts) + len(deletes)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return len(upserts) + len(deletes)
+
+    def expire_idle(self, now: float = None) -> list:
+        """
+        Выбрасывает записи, которых не касались дольше ttl (строки в базе удалит
+        следующий flush). Возвращает [(ключ, FSMRecord)] выброшенных.
+        """
+        cutoff = (now if now is not None else time.time()) - self.ttl
+        idle = [(name, record) for name, record in self.records.items() if record.touched < cutoff]
+        for name, _ in idle:
+            del self.records[name]
+            self._dirty.add(name)
+        self.expired += len(idle)
+        if idle:
+            logger.info(f"FSM storage expired {len(idle)} idle records")
+        return idle
+
+    async def sweep(self, now: float = None) -> int:
+        """Выбрасывает простаивающие записи, сообщает о них on_expire и пишет сводку в лог."""
+        idle = self.expire_idle(now)
+        for name, record in idle if self.on_expire else ():
+            try:
+                await self.on_expire(record.user_id, record.state, record.data)
+            except Exception as e:
+                self.expire_errors += 1
+                logger.error(f"FSM on_expire failed for {name}: {e}", exc_info=True)
+        stats = self.stats()
+        logger.info(f"FSM storage: {stats['records']} live records, ~{stats['data_bytes']} bytes of data,"
+                    f" by state group {stats['groups']}, expired {len(idle)} (total {self.expired})")
+        return len(idle)
+
+    async def _run(self):
+        next_sweep = time.monotonic()  # первая чистка сразу: записи, простоявшие за время остановки
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if time.monotonic() >= next_sweep:
+                    await self.sweep()
+                    next_sweep = time.monotonic() + self.sweep_interval
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Задача не должна умирать: иначе изменения копились бы до остановки
+                logger.error(f"FSM storage flusher error: {e}", exc_info=True)
+
+    def start(self):
+        """Запускает фоновую запись; вызывается внутри работающего event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"FSM storage started: interval={self.interval * 1000:.0f}ms, ttl={self.ttl:.0f}s")
+
+    def stats(self) -> dict:
+        groups = {}
+        data_bytes = 0
+        for record in self.records.values():
+            group = record.state.split(":", 1)[0] if record.state else "(без состояния)"
+            groups[group] = groups.get(group, 0) + 1
+            data_bytes += record.size
+        return {
+            "records": len(self.records),
+            "groups": groups,
+            "data_bytes": data_bytes,
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "written_rows": self.written_rows,
+            "failed_flushes": self.failed_flushes,
+            "expired": self.expired,
+            "expire_errors": self.expire_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
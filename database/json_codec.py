@@ -0,0 +1,214 @@
+"""
+Компактное хранение JSON в actions.details и scenario_logs.metadata.
+
+Раньше save_action писал details через json.dumps(..., indent=2): каждая строка
+actions несла переводы строк и отступы, а log_scenario_step экранировал кириллицу
+в \\uXXXX — шесть байт на букву вместо двух. get_actions при этом разбирал details
+каждой строки, хотя вызывающим обычно нужны только action и timestamp.
+
+Теперь:
+  * dumps — минифицированный JSON без экранирования не-ASCII;
+  * get_actions отдаёт ActionRecord: details разбирается при первом обращении;
+  * compact_column переписывает старые строки порциями (tools/compact_json.py);
+  * iter_json читает большой JSON-файл по элементам, не загружая его целиком
+    (импорт старых data/*.json, database/legacy_import.py).
+
+Формат остаётся текстовым JSON, а не msgpack/CBOR: json_extract по metadata
+используют VIEW, агрегаты дашборда и метрики, и двоичный формат их бы сломал.
+Читать старые строки можно как раньше — меняется только форма записи, поэтому
+сравнивать JSON как текст (LIKE '%"rating": "helped"%') больше нельзя.
+"""
+import json
+import logging
+import re
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 1000
+DEFAULT_CHUNK = 64 * 1024
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_details(raw, action_id=None, user_id=None) -> dict:
+    """details из строки actions; битый JSON не роняет чтение, а возвращается как есть."""
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.warning(f"Failed to decode details JSON for action ID {action_id}, user {user_id}: {e}. Raw details: {raw}")
+        return {"error": "invalid_json", "raw_details": raw}
+
+
+class ActionRecord(dict):
+    """
+    Строка get_actions. Ключ details появляется при первом обращении к нему
+    (record["details"], record.get("details"), перебор ключей и сравнение).
+    """
+    __slots__ = ("_raw_details",)
+
+    def __init__(self, raw_details, **fields):
+        super().__init__(**fields)
+        self._raw_details = raw_details
+
+    def _details(self):
+        if not dict.__contains__(self, "details"):
+            dict.__setitem__(self, "details", decode_details(self._raw_details, self.get("id"), self.get("user_id")))
+        return dict.__getitem__(self, "details")
+
+    def __missing__(self, key):
+        if key == "details":
+            return self._details()
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == "details":
+            return self._details()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        return key == "details" or super().__contains__(key)
+
+    def __iter__(self):
+        self._details()
+        return super().__iter__()
+
+    def __len__(self):
+        self._details()
+        return super().__len__()
+
+    def keys(self):
+        self._details()
+        return super().keys()
+
+    def items(self):
+        self._details()
+        return super().items()
+
+    def values(self):
+        self._details()
+        return super().values()
+
+    def copy(self):
+        self._details()
+        return dict(super().items())
+
+    def __eq__(self, other):
+        self._details()
+        if isinstance(other, ActionRecord):
+            other._details()
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._details()
+        return super().__repr__()
+
+
+def compact_column(conn: sqlite3.Connection, table: str, column: str, batch_size: int = DEFAULT_BATCH,
+                   key: str = "id"):
+    """
+    Переписывает column в компактный вид порциями по batch_size строк, каждая в
+    своей транзакции. Строки с невалидным JSON не трогает. Возвращает
+    (переписано строк, байт до, байт после) — байты считаются по изменённым строкам.
+    """
+    rewritten = before = after = 0
+    last = None
+    while True:
+        rows = conn.execute(
+            f"SELECT {key}, {column} FROM {table} WHERE {column} IS NOT NULL"
+            f" AND (? IS NULL OR {key} > ?) ORDER BY {key} LIMIT ?",
+            (last, last, batch_size)).fetchall()
+        if not rows:
+            return rewritten, before, after
+        last = rows[-1][0]
+        updates = []
+        for row_key, raw in rows:
+            try:
+                compact = dumps(json.loads(raw))
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if compact != raw:
+                updates.append((compact, row_key))
+                before += len(raw.encode("utf-8"))
+                after += len(compact.encode("utf-8"))
+        if updates:
+            with conn:
+                conn.executemany(f"UPDATE {table} SET {column} = ? WHERE {key} = ?", updates)
+            rewritten += len(updates)
+
+
+def iter_json(fp, chunk_size: int = DEFAULT_CHUNK):
+    """
+    Потоковый разбор файла, в корне которого массив или объект: отдаёт элементы
+    массива или пары (ключ, значение) объекта по одному. В памяти держится только
+    непрочитанный хвост буфера и текущий элемент.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WS.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return buf[pos] if pos < len(buf) else ""
+            fill()
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buf) and not eof:
+                fill()  # число могло оборваться на границе куска
+                continue
+            pos = end
+            return obj
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", buf, pos)
+        pos += 1
+
+    opening = peek()
+    if opening not in ("[", "{"):
+        raise json.JSONDecodeError("Expecting array or object", buf, pos)
+    closing = "]" if opening == "[" else "}"
+    pos += 1
+    first = True
+    while True:
+        if peek() == closing:
+            return
+        if not first:
+            expect(",")
+        first = False
+        if opening == "[":
+            yield value()
+        else:
+            if peek() != '"':
+                raise json.JSONDecodeError("Expecting property name", buf, pos)
+            key = value()
+            expect(":")
+            yield key, value()
@@ -0,0 +1,307 @@
+"""
+Импорт состояния бота до перехода на SQLite (data/*.json) в базу.
+
+Раньше историю переносили скриптами из tools/legacy по одному файлу: каждый
+делал json.load целиком и писал построчно, по коммиту на строку, — на большой
+живой базе это минуты и постоянно занятая блокировка записи.
+
+Теперь файлы читаются потоково (json_codec.iter_json), строки пишутся
+executemany порциями по batch_size, каждая порция — своя короткая транзакция,
+так что бот между ними успевает писать. Повторный импорт ничего не дублирует:
+каждая таблица проверяется по естественному ключу.
+
+  user_names, reminder_times, last_request — users: поле заполняется, только если
+      в базе оно пустое, живые данные главнее;
+  bonus_available — users: только новые пользователи;
+  user_cards      — user_cards по (user_id, card_number, deck_name), колода 'nature';
+  referrals       — referrals по referred_id (UNIQUE);
+  feedback        — feedback по (user_id, timestamp);
+  user_requests   — user_requests по (user_id, ts_epoch, request_text), время в UTC,
+                    как у CURRENT_TIMESTAMP;
+  user_actions    — actions по (user_id, ts_epoch, timestamp, action), с учётом
+                    месяцев, уже перенесённых в архив (database/archive.py);
+  card_feedback   — actions с action = 'card_feedback', после user_actions.
+
+card_feedback.json — ответы «да/нет» по картам без времени. Раньше файл не
+импортировался: считалось, что те же ответы есть в user_actions.json. Это не так —
+в файле 85 ответов, а действий card_feedback в user_actions.json всего 15, и
+остальные 70 терялись. Теперь ответы сверяются с уже записанными card_feedback
+(вместе с архивом) по (user_id, карта, ответ) с учётом повторов, и пишутся только
+недостающие. Времени у них нет, поэтому им ставится время последнего известного
+card_feedback — конец эпохи JSON-файлов: бот давно пишет оценки как
+interaction_feedback_provided, и такие строки не попадают в свежие периоды метрик.
+Если card_feedback в базе ещё нет — время изменения файла. В details у таких строк
+есть source = 'card_feedback.json'.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from database.archive import read_archived
+from database.json_codec import DEFAULT_BATCH, dumps, iter_json
+
+logger = logging.getLogger(__name__)
+
+MSK = timezone(timedelta(hours=3))
+
+
+def _user_field_sql(column: str, only_empty: str) -> str:
+    return f"""
+        INSERT INTO users (user_id, name, username, {column}) VALUES (:user_id, '', '', :value)
+        ON CONFLICT(user_id) DO UPDATE SET {column} = excluded.{column}
+        WHERE {only_empty} AND excluded.{column} IS NOT NULL AND excluded.{column} <> ''
+    """
+
+
+USER_NAME_SQL = """
+    INSERT INTO users (user_id, name, username) VALUES (:user_id, :value, '')
+    ON CONFLICT(user_id) DO UPDATE SET name = excluded.name
+    WHERE COALESCE(users.name, '') = '' AND excluded.name <> ''
+"""
+BONUS_SQL = """
+    INSERT INTO users (user_id, name, username, bonus_available) VALUES (:user_id, '', '', :value)
+    ON CONFLICT(user_id) DO NOTHING
+"""
+USER_CARD_SQL = """
+    INSERT INTO user_cards (user_id, card_number, deck_name)
+    SELECT :user_id, :card_number, 'nature'
+    WHERE NOT EXISTS (SELECT 1 FROM user_cards
+                      WHERE user_id = :user_id AND card_number = :card_number AND deck_name = 'nature')
+"""
+REFERRAL_SQL = "INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (:referrer_id, :referred_id)"
+FEEDBACK_SQL = """
+    INSERT INTO feedback (user_id, name, feedback, timestamp)
+    SELECT :user_id, :name, :feedback, :timestamp
+    WHERE NOT EXISTS (SELECT 1 FROM feedback WHERE user_id = :user_id AND timestamp = :timestamp)
+"""
+USER_REQUEST_SQL = """
+    INSERT INTO user_requests (user_id, request_text, timestamp)
+    SELECT :user_id, :request_text, :timestamp
+    WHERE NOT EXISTS (SELECT 1 FROM user_requests
+                      WHERE ts_epoch = CAST(strftime('%s', :timestamp) AS INTEGER)
+                        AND user_id = :user_id AND request_text = :request_text)
+"""
+ACTION_SQL = """
+    INSERT INTO actions (user_id, username, name, action, details, timestamp)
+    SELECT :user_id, :username, :name, :action, :details, :timestamp
+    WHERE NOT EXISTS (SELECT 1 FROM actions
+                      WHERE user_id = :user_id AND ts_epoch = CAST(strftime('%s', :timestamp) AS INTEGER)
+                        AND timestamp = :timestamp AND action = :action)
+"""
+# Без проверки на дубли: у ответов из card_feedback.json одно время на всех, их
+# сверяет _KnownFeedback по счётчикам.
+CARD_FEEDBACK_SQL = """
+    INSERT INTO actions (user_id, username, name, action, details, timestamp)
+    VALUES (:user_id, :username, :name, 'card_feedback', :details, :timestamp)
+"""
+
+
+def _utc(timestamp: str) -> str:
+    """ISO со смещением -> формат CURRENT_TIMESTAMP (UTC без смещения)."""
+    return datetime.fromisoformat(timestamp).astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _month(timestamp: str) -> str:
+    """Месяц архива — по d_local, то есть по UTC+3."""
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment.astimezone(timezone.utc) + timedelta(hours=3)).strftime("%Y-%m")
+
+
+# --- Строки по файлам: элемент iter_json -> список параметров SQL ---
+
+def _user_value_rows(item):
+    user_id, value = item
+    return [{"user_id": int(user_id), "value": value}]
+
+
+def _bonus_rows(item):
+    user_id, value = item
+    return [{"user_id": int(user_id), "value": int(bool(value))}]
+
+
+def _user_card_rows(item):
+    user_id, cards = item
+    return [{"user_id": int(user_id), "card_number": int(card)} for card in cards]
+
+
+def _referral_rows(item):
+    referrer_id, referred = item
+    return [{"referrer_id": int(referrer_id), "referred_id": int(referred_id)} for referred_id in referred]
+
+
+def _feedback_rows(item):
+    user_id, entry = item
+    return [{"user_id": int(user_id), "name": entry.get("name", ""),
+             "feedback": entry["feedback"], "timestamp": entry["timestamp"]}]
+
+
+def _user_request_rows(item):
+    user_id, entry = item
+    return [{"user_id": int(user_id), "request_text": entry["request"], "timestamp": _utc(entry["timestamp"])}]
+
+
+def _action_rows(entry):
+    return [{"user_id": int(entry["user_id"]), "username": entry.get("username", ""),
+             "name": entry.get("name", ""), "action": entry["action"],
+             "details": dumps(entry.get("details") or {}), "timestamp": entry["timestamp"]}]
+
+
+def _card_feedback_rows(timestamp: str):
+    def rows(item):
+        key, value = item
+        if key != "users":  # "total" — сводка по тем же ответам
+            return []
+        return [{"user_id": int(user_id), "username": entry.get("username", ""), "name": entry.get("name", ""),
+                 "card_number": str(response["card"]), "feedback": response["answer"],
+                 "details": dumps({"card_number": str(response["card"]), "feedback": response["answer"],
+                                   "source": "card_feedback.json"}),
+                 "timestamp": timestamp}
+                for user_id, entry in value.items() for response in entry["responses"]]
+    return rows
+
+
+SOURCES = (
+    # bonus_available первым: он пишется только новым пользователям, а следующие файлы их создают
+    ("bonus_available.json", _bonus_rows, BONUS_SQL),
+    ("user_names.json", _user_value_rows, USER_NAME_SQL),
+    ("reminder_times.json", _user_value_rows, _user_field_sql("reminder_time", "users.reminder_time IS NULL")),
+    ("last_request.json", _user_value_rows, _user_field_sql("last_request", "users.last_request IS NULL")),
+    ("user_cards.json", _user_card_rows, USER_CARD_SQL),
+    ("referrals.json", _referral_rows, REFERRAL_SQL),
+    ("feedback.json", _feedback_rows, FEEDBACK_SQL),
+    ("user_requests.json", _user_request_rows, USER_REQUEST_SQL),
+    ("user_actions.json", _action_rows, ACTION_SQL),
+)
+
+
+class _KnownFeedback:
+    """
+    Ответы card_feedback, уже записанные в actions и в архив, — счётчики по
+    (user_id, карта, ответ). Строка файла «уже есть», пока счётчик её ключа не
+    исчерпан: два одинаковых ответа в файле и один в базе дают одну новую строку.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, archive_dir: str = None):
+        rows = conn.execute(
+            "SELECT user_id, details, timestamp FROM actions WHERE action = 'card_feedback'").fetchall()
+        if archive_dir:
+            try:
+                rows += [(r["user_id"], r["details"], r["timestamp"])
+                         for r in read_archived(conn, archive_dir, "action = 'card_feedback'")]
+            except sqlite3.Error:
+                pass  # архива ещё не было
+        self.counts = {}
+        self.latest = None
+        for user_id, details, timestamp in rows:
+            try:
+                details = json.loads(details or "{}")
+                key = (user_id, str(details["card_number"]), details["feedback"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if self.latest is None or datetime.fromisoformat(timestamp) > datetime.fromisoformat(self.latest):
+                self.latest = timestamp
+
+    def __contains__(self, row) -> bool:
+        key = (row["user_id"], row["card_number"], row["feedback"])
+        if self.counts.get(key, 0) > 0:
+            self.counts[key] -= 1
+            return True
+        return False
+
+
+class _ArchivedActions:
+    """Ключи строк, уже перенесённых в месячные архивы: месяц читается при первой встрече."""
+
+    def __init__(self, conn: sqlite3.Connection, archive_dir: str):
+        self.archive_dir = archive_dir
+        try:
+            self.files = dict(conn.execute("SELECT month, file FROM actions_archive").fetchall())
+        except sqlite3.Error:
+            self.files = {}
+        self.keys = {}
+
+    def __contains__(self, row) -> bool:
+        if not self.files:
+            return False
+        month = _month(row["timestamp"])
+        if month not in self.files:
+            return False
+        if month not in self.keys:
+            path = os.path.join(self.archive_dir, self.files[month])
+            keys = set()
+            if os.path.exists(path):
+                arch = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    keys = set(arch.execute("SELECT user_id, timestamp, action FROM actions"))
+                finally:
+                    arch.close()
+            self.keys[month] = keys
+        return (row["user_id"], row["timestamp"], row["action"]) in self.keys[month]
+
+
+def import_file(conn: sqlite3.Connection, path: str, rows_from, sql: str,
+                batch_size: int = DEFAULT_BATCH, exclude=None) -> dict:
+    """
+    Импортирует один файл порциями по batch_size. Возвращает отчёт:
+    прочитано, записано (новые и дозаполненные строки), битых, секунд, строк в секунду.
+    """
+    report = {"file": os.path.basename(path), "read": 0, "written": 0, "bad": 0, "seconds": 0.0, "rows_per_sec": 0}
+    started = time.perf_counter()
+    pending = []
+
+    def flush():
+        before = conn.total_changes
+        with conn:
+            conn.executemany(sql, pending)
+        report["written"] += conn.total_changes - before
+        pending.clear()
+
+    with open(path, encoding="utf-8") as fp:
+        for item in iter_json(fp):
+            try:
+                rows = rows_from(item)
+                fresh = [row for row in rows if exclude is None or row not in exclude]
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                report["bad"] += 1
+                logger.warning(f"Legacy import of {report['file']}: skipping malformed entry {item!r}: {e}")
+                continue
+            report["read"] += len(rows)
+            pending.extend(fresh)
+            if len(pending) >= batch_size:
+                flush()
+    if pending:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = int(report["read"] / elapsed) if elapsed else report["read"]
+    return report
+
+
+def import_legacy(conn: sqlite3.Connection, data_dir: str, archive_dir: str = None,
+                  batch_size: int = DEFAULT_BATCH) -> list:
+    """Импортирует все известные файлы data_dir, которые есть на диске. Возвращает отчёты по файлам."""
+    reports = []
+    for name, rows_from, sql in SOURCES:
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            continue
+        exclude = _ArchivedActions(conn, archive_dir) if name == "user_actions.json" and archive_dir else None
+        report = import_file(conn, path, rows_from, sql, batch_size, exclude)
+        logger.info(f"Legacy import {name}: {report}")
+        reports.append(report)
+
+    path = os.path.join(data_dir, "card_feedback.json")
+    if os.path.exists(path):
+        known = _KnownFeedback(conn, archive_dir)
+        timestamp = known.latest or datetime.fromtimestamp(os.path.getmtime(path), MSK).isoformat()
+        report = import_file(conn, path, _card_feedback_rows(timestamp), CARD_FEEDBACK_SQL, batch_size, known)
+        logger.info(f"Legacy import card_feedback.json: {report}")
+        reports.append(report)
+    return reports
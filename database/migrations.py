@@ -0,0 +1,639 @@
+"""
+Версионные миграции схемы: один реестр шагов, номер версии — в PRAGMA user_version.
+
+Раньше схема проверялась при каждом запуске в три прохода: Database.__init__
+(create_tables, create_author_tables, _run_migrations с PRAGMA table_info по
+таблицам, create_indexes), блок инициализации user_requests в main.py и
+apply_metrics_migration, которая на каждом старте удаляла и заново создавала все
+VIEW и переписывала settings — причём дважды, при импорте main.py и в main().
+
+Теперь все изменения схемы — это упорядоченные шаги MIGRATIONS. Номер последнего
+применённого шага хранится в PRAGMA user_version, поэтому запуск с актуальной
+схемой — это одно чтение прагмы и больше ничего. Отстающая база догоняется по
+шагам.
+
+Атомарность:
+  * SQL-шаг, запись о нём в schema_migrations и user_version идут одной
+    транзакцией;
+  * шаг-функция — нет. Функции коммитят сами: через with conn, executescript и
+    порционные заполнения (шаг 10), поэтому обернуть их в транзакцию учёта нельзя.
+    Если процесс упадёт после функции, но до записи о ней, при следующем старте
+    шаг выполнится ещё раз поверх частично или полностью применённого. Поэтому
+    шаги-функции обязаны быть идемпотентными (старые базы к тому же пришли с
+    user_version = 0, но с частью таблиц и колонок, созданных до реестра);
+    test_migrations прогоняет каждую повторно на мигрированной базе.
+
+Правила для шагов:
+  * шаг, уже попавший в прод, не редактируется — меняется схема только новым шагом
+    в конце списка. Для контроля у каждого шага есть контрольная сумма: SQL, а у
+    функции — её исходник плюс deps, замороженные помощники из этого модуля
+    (TIME_COLUMNS, add_time_columns...). Расхождение с записанной в
+    schema_migrations видно в логе и в verify();
+  * чего контрольная сумма не видит: живой код других модулей, который зовут
+    шаги (db.create_tables, rollups.rebuild, user_stats.backfill...). Он меняется
+    законно вместе с приложением, и его правка не считается правкой шага. Если
+    шагу нужно зафиксированное поведение — SQL кладётся в этот модуль и в deps.
+"""
+import hashlib
+import inspect
+import logging
+import sqlite3
+import time
+
+from database import archive, reachability, rollups, user_stats
+
+logger = logging.getLogger(__name__)
+
+
+# --- Шаг 3: инфраструктура метрик (раньше — auto_migrate_on_startup.py) ---
+
+METRICS_SQL = """
+-- 1. Таблица исключенных пользователей (админы).
+-- Наполняется из config.NO_LOGS_USERS, см. auto_migrate_on_startup.sync_ignored_users.
+CREATE TABLE IF NOT EXISTS ignored_users (
+    user_id INTEGER PRIMARY KEY,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 2. Таблица настроек
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    description TEXT,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 2.1. Таблица логов обучения
+CREATE TABLE IF NOT EXISTS training_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    training_type TEXT NOT NULL,  -- 'card_conversation' или другой тип обучения
+    step TEXT NOT NULL,           -- 'started', 'completed', 'abandoned'
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    details TEXT,                 -- JSON с дополнительными данными
+    session_id TEXT              -- ID сессии для группировки
+);
+
+-- Индексы для быстрого поиска логов обучения
+CREATE INDEX IF NOT EXISTS idx_training_logs_user_id ON training_logs(user_id);
+CREATE INDEX IF NOT EXISTS idx_training_logs_training_type ON training_logs(training_type);
+CREATE INDEX IF NOT EXISTS idx_training_logs_step ON training_logs(step);
+CREATE INDEX IF NOT EXISTS idx_training_logs_timestamp ON training_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_training_logs_session_id ON training_logs(session_id);
+
+-- Добавляем настройки
+INSERT OR REPLACE INTO settings (key, value, description) VALUES
+    ('report_tz', '+03:00', 'Часовой пояс для отчетов (МСК)'),
+    ('training_logs_enabled', 'true', 'Включить логирование обучения'),
+    ('training_exclude_admins', 'true', 'Исключить админов из логов обучения');
+
+-- 3. VIEW базовых событий (с фильтрацией админов)
+DROP VIEW IF EXISTS v_events;
+CREATE VIEW v_events AS
+WITH tz AS (
+    SELECT value AS offset FROM settings WHERE key='report_tz'
+)
+SELECT
+    l.rowid AS event_id,
+    l.user_id,
+    l.scenario,
+    l.step AS event,
+    l.metadata,
+    datetime(l.timestamp, (SELECT offset FROM tz)) AS ts_local,
+    date(datetime(l.timestamp, (SELECT offset FROM tz))) AS d_local,
+    json_extract(l.metadata, '$.session_id') AS session_id
+FROM scenario_logs l
+LEFT JOIN ignored_users i ON i.user_id = l.user_id
+WHERE i.user_id IS NULL;
+
+-- 4. VIEW сессий
+DROP VIEW IF EXISTS v_sessions;
+CREATE VIEW v_sessions AS
+SELECT
+    scenario,
+    session_id,
+    -- Используем ПЕРВОЕ событие сессии (любое) для started_at/started_date
+    -- Это работает как со старыми данными (без scenario_started), так и с новыми
+    MIN(ts_local) AS started_at,
+    MIN(d_local) AS started_date,
+    MAX(CASE WHEN event = 'completed' THEN ts_local END) AS completed_at,
+    CASE WHEN MAX(CASE WHEN event = 'completed' THEN 1 ELSE 0 END) > 0
+         THEN 1 ELSE 0 END AS is_completed,
+    COUNT(*) AS total_events,
+    COUNT(*) AS step_count  -- Количество шагов в сессии
+FROM v_events
+WHERE session_id IS NOT NULL
+  -- Корзина, куда попадали события с очищенным состоянием (unknown_post_session):
+  -- это не сессия, а свалка из сотен событий разных людей.
+  AND session_id NOT LIKE 'unknown%'
+GROUP BY scenario, session_id
+-- До исправления session_id событие scenario_started писалось со своим uuid4,
+-- не связанным с остальным сценарием. Такие «сессии» состоят ровно из одного
+-- события старта и никогда не могут завершиться — они вдвое раздували знаменатель.
+-- Новые сессии пишутся в формате {user_id}_card_of_day_{дата} и под фильтр не попадают.
+HAVING NOT (
+    session_id LIKE '%-%'
+    AND SUM(CASE WHEN event = 'scenario_started' THEN 1 ELSE 0 END) = COUNT(*)
+);
+
+-- 5. VIEW DAU по дням
+DROP VIEW IF EXISTS v_dau_daily;
+CREATE VIEW v_dau_daily AS
+SELECT
+    d_local,
+    COUNT(DISTINCT user_id) AS dau
+FROM v_events
+GROUP BY d_local
+ORDER BY d_local DESC;
+
+-- 6. VIEW статистики сессий по дням
+DROP VIEW IF EXISTS v_sessions_daily;
+CREATE VIEW v_sessions_daily AS
+SELECT
+    scenario,
+    started_date AS d_local,
+    COUNT(*) AS started,
+    SUM(is_completed) AS completed,
+    ROUND(100.0 * SUM(is_completed) / COUNT(*), 1) AS completion_rate
+FROM v_sessions
+WHERE started_date IS NOT NULL
+GROUP BY scenario, started_date
+ORDER BY started_date DESC;
+
+-- 7. VIEW статистики колод по дням
+DROP VIEW IF EXISTS v_decks_daily;
+CREATE VIEW v_decks_daily AS
+SELECT
+    d_local,
+    json_extract(metadata, '$.deck') AS deck,
+    COUNT(*) AS draws,
+    COUNT(DISTINCT user_id) AS uniq_users
+FROM v_events
+WHERE event = 'card_drawn' AND json_extract(metadata, '$.deck') IS NOT NULL
+GROUP BY d_local, deck
+ORDER BY d_local DESC, draws DESC;
+
+-- 8. Индексы для производительности
+CREATE INDEX IF NOT EXISTS idx_scenario_logs_timestamp ON scenario_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_scenario_logs_user_scenario ON scenario_logs(user_id, scenario);
+CREATE INDEX IF NOT EXISTS idx_scenario_logs_step ON scenario_logs(step);
+"""
+
+
+# --- Шаги-функции ---
+
+def _baseline_schema(db):
+    """Схема, которую раньше Database проверял при каждом запуске."""
+    db.create_tables()
+    db.create_author_tables()
+    db._run_migrations()
+    db.create_indexes()
+
+
+def _user_requests_legacy_columns(db):
+    """Бывший блок инициализации user_requests из main.py: досоздаёт колонки старых баз."""
+    db._add_columns_if_not_exist('user_requests', {
+        'request_text': 'TEXT',
+        'session_id': 'TEXT',
+        'card_number': 'INTEGER',
+    })
+    with db.conn:
+        db.conn.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_user_id ON user_requests(user_id)")
+        db.conn.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_timestamp ON user_requests(timestamp)")
+        db.conn.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_session_id ON user_requests(session_id)")
+
+
+# --- Шаг 4: целочисленное время и локальная дата в таблицах событий ---
+
+# Таблица -> колонка со временем события. Форматы разные: в actions и
+# user_scenarios.started_at — ISO с +03:00, в scenario_logs, mailing_logs и
+# user_requests — UTC 'YYYY-MM-DD HH:MM:SS'. strftime('%s') понимает все, поэтому
+# сравнивать и группировать теперь нужно по ts_epoch/d_local, а не по строкам.
+TIME_COLUMNS = {
+    "actions": "timestamp",
+    "scenario_logs": "timestamp",
+    "user_scenarios": "started_at",
+    "mailing_logs": "sent_at",
+    "user_requests": "timestamp",
+}
+
+TIME_INDEXES = {
+    "actions": ["ts_epoch", "user_id, ts_epoch"],
+    "scenario_logs": ["d_local", "ts_epoch", "scenario, d_local", "user_id, d_local"],
+    "user_scenarios": ["d_local", "user_id, d_local"],
+    "mailing_logs": ["user_id, ts_epoch"],
+    "user_requests": ["ts_epoch"],
+}
+
+
+def time_column_ddl(table: str, source: str) -> dict:
+    """
+    Определения ts_epoch (секунды UTC) и d_local (дата по Москве, UTC+3 без перехода
+    на летнее время — как TIMEZONE в config).
+
+    Колонки VIRTUAL: ALTER TABLE ADD COLUMN в SQLite не умеет STORED. Значение
+    вычисляется при чтении строки, а в индексе лежит готовым — для фильтров по
+    диапазону этого и нужно. Строки без смещения в ISO считаются UTC.
+    """
+    return {
+        "ts_epoch": f"INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', {source}) AS INTEGER)) VIRTUAL",
+        "d_local": f"TEXT GENERATED ALWAYS AS (date({source}, '+3 hours')) VIRTUAL",
+    }
+
+
+def add_time_columns(conn: sqlite3.Connection, table: str, source: str):
+    """Досоздаёт ts_epoch/d_local и их индексы. Идемпотентна; таблицы может не быть."""
+    # table_info генерируемые колонки не показывает, нужен table_xinfo.
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+    if not existing:
+        return
+    for column, ddl in time_column_ddl(table, source).items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    for columns in TIME_INDEXES.get(table, []):
+        suffix = columns.replace(", ", "_")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table}({columns})")
+
+
+def _time_columns(db):
+    """ts_epoch и d_local для таблиц событий, см. TIME_COLUMNS."""
+    with db.conn:
+        for table, source in TIME_COLUMNS.items():
+            add_time_columns(db.conn, table, source)
+        # Индекс по одному step (шаг 3) планировщик выбирал ради GROUP BY step и
+        # из-за него проходил всю таблицу мимо (scenario, d_local). Отбирает он
+        # плохо — шагов десяток, — а мешает всем отчётам воронки.
+        db.conn.execute("DROP INDEX IF EXISTS idx_scenario_logs_step")
+
+
+# --- Шаг 5: v_events поверх d_local/ts_epoch ---
+
+# Старый v_events считал d_local выражением от timestamp со смещением из settings,
+# поэтому фильтр «WHERE d_local >= ...» по VIEW всегда был полным проходом
+# scenario_logs. Теперь VIEW отдаёт индексированную колонку таблицы как есть.
+# Смещение фиксированное (+3 часа, как во всём остальном коде); report_tz больше
+# не читается. Остальные VIEW построены на v_events и пересоздания не требуют.
+EVENTS_VIEW_SQL = """
+DROP VIEW IF EXISTS v_events;
+CREATE VIEW v_events AS
+SELECT
+    l.rowid AS event_id,
+    l.user_id,
+    l.scenario,
+    l.step AS event,
+    l.metadata,
+    datetime(l.ts_epoch, 'unixepoch', '+3 hours') AS ts_local,
+    l.d_local,
+    json_extract(l.metadata, '$.session_id') AS session_id
+FROM scenario_logs l
+LEFT JOIN ignored_users i ON i.user_id = l.user_id
+WHERE i.user_id IS NULL;
+"""
+
+
+# --- Шаг 6: дневные агрегаты дашборда ---
+
+def _daily_rollups(db):
+    """Таблицы database/rollups.py и первичное заполнение по всей истории."""
+    db.conn.executescript(rollups.SCHEMA_SQL)
+    rollups.rebuild(db.conn)
+
+
+# --- Шаг 7: когорты удержания ---
+
+def _user_cohorts(db):
+    """user_cohorts из database/rollups.py, заполняется пересборкой агрегатов."""
+    db.conn.executescript(rollups.SCHEMA_SQL)
+    rollups.rebuild(db.conn)
+
+
+# --- Шаг 8: счётчики личной статистики ---
+
+def _user_stats(db):
+    """user_stats из database/user_stats.py, заполняется по истории user_scenarios."""
+    db.conn.executescript(user_stats.SCHEMA_SQL)
+    user_stats.backfill(db.conn)
+
+
+# --- Шаг 10: scenario_logs.session_id ---
+
+SESSION_BACKFILL_BATCH = 5000
+
+
+def _scenario_logs_session_id(db):
+    """
+    session_id из metadata становится настоящей колонкой: воронка и VIEW считали
+    COUNT(DISTINCT json_extract(metadata, '$.session_id')) и разбирали JSON каждой
+    строки журнала. Новые строки заполняет log_scenario_step, старые — этот шаг
+    порциями по rowid (повторный запуск продолжает с незаполненных).
+
+    Агрегаты шагов 6–7 уже читают колонку; если она была пустой, их пересобираем.
+    """
+    conn = db.conn
+    existing = {row[1] for row in conn.execute("PRAGMA table_xinfo(scenario_logs)")}
+    if "session_id" not in existing:
+        with conn:
+            conn.execute("ALTER TABLE scenario_logs ADD COLUMN session_id TEXT")
+    top = conn.execute("SELECT MAX(rowid) FROM scenario_logs").fetchone()[0] or 0
+    filled = 0
+    for start in range(0, top, SESSION_BACKFILL_BATCH):
+        with conn:
+            filled += conn.execute("""
+                UPDATE scenario_logs SET session_id = json_extract(metadata, '$.session_id')
+                WHERE rowid > ? AND rowid <= ?
+                  AND session_id IS NULL AND json_valid(metadata)
+                  AND json_extract(metadata, '$.session_id') IS NOT NULL
+            """, (start, start + SESSION_BACKFILL_BATCH)).rowcount
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scenario_logs_scenario_session_id_step"
+                     " ON scenario_logs(scenario, session_id, step)")
+    if filled:
+        rollups.rebuild(conn)
+
+
+# --- Шаг 11: v_events на колонке session_id ---
+
+SESSION_EVENTS_VIEW_SQL = """
+DROP VIEW IF EXISTS v_events;
+CREATE VIEW v_events AS
+SELECT
+    l.rowid AS event_id,
+    l.user_id,
+    l.scenario,
+    l.step AS event,
+    l.metadata,
+    datetime(l.ts_epoch, 'unixepoch', '+3 hours') AS ts_local,
+    l.d_local,
+    l.session_id
+FROM scenario_logs l
+LEFT JOIN ignored_users i ON i.user_id = l.user_id
+WHERE i.user_id IS NULL;
+"""
+
+
+# --- Шаг 12: признак доступности пользователя ---
+
+def _user_reachability(db):
+    """user_reachability из database/reachability.py, заполняется по журналам отправок."""
+    db.conn.executescript(reachability.SCHEMA_SQL)
+    reachability.backfill(db.conn)
+
+
+# --- Шаг 13: счётчик шагов в строке сессии ---
+
+def _user_scenarios_step_counters(db):
+    """
+    user_scenarios.steps_count ведёт log_scenario_step (+ last_step — последний шаг
+    сессии), поэтому завершение больше не считает шаги по журналу. Старые значения
+    были числом всех шагов пользователя в сценарии за всё время — пересчитываем по
+    сессиям: у завершённых — шаги до completed_at, у остальных — все.
+
+    Индекс по scenario_logs.session_id нужен старту сессии, открытой раньше строки
+    («Карта дня»), и этому пересчёту. После пересчёта пересобирается user_stats:
+    total_steps складывается из steps_count.
+    """
+    conn = db.conn
+    existing = {row[1] for row in conn.execute("PRAGMA table_xinfo(user_scenarios)")}
+    with conn:
+        if "last_step" not in existing:
+            conn.execute("ALTER TABLE user_scenarios ADD COLUMN last_step TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_scenarios_session_id ON user_scenarios(session_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scenario_logs_session_id ON scenario_logs(session_id)")
+        conn.execute("DROP TABLE IF EXISTS temp.session_steps")
+        # Голая колонка step при MAX(rowid) берётся из той же строки — последний шаг.
+        conn.execute("""
+            CREATE TEMP TABLE session_steps AS
+            SELECT s.id, COUNT(*) AS steps, l.step AS last_step, MAX(l.rowid) AS last_rowid
+            FROM user_scenarios s
+            JOIN scenario_logs l ON l.session_id = s.session_id AND l.user_id = s.user_id
+            WHERE s.completed_at IS NULL
+               OR l.ts_epoch <= CAST(strftime('%s', s.completed_at) AS INTEGER)
+            GROUP BY s.id
+        """)
+        conn.execute("CREATE UNIQUE INDEX temp.idx_session_steps_id ON session_steps(id)")
+        conn.execute("""
+            UPDATE user_scenarios
+            SET steps_count = COALESCE((SELECT steps FROM temp.session_steps t WHERE t.id = user_scenarios.id), 0),
+                last_step = (SELECT last_step FROM temp.session_steps t WHERE t.id = user_scenarios.id)
+        """)
+        conn.execute("DROP TABLE temp.session_steps")
+    user_stats.backfill(conn)
+
+
+# --- Шаг 14: состояния FSM (database/fsm_storage.py) ---
+
+FSM_STORAGE_SQL = """
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key TEXT PRIMARY KEY,
+    user_id INTEGER,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage(updated_at);
+"""
+
+
+# --- Шаг 15: кэш проверок подписки (database/subscription_cache.py) ---
+
+SUBSCRIPTION_CHECKS_SQL = """
+CREATE TABLE IF NOT EXISTS subscription_checks (
+    user_id INTEGER PRIMARY KEY,
+    checked_on TEXT,              -- дата последней проверки подписки, NULL — ещё не проверяли
+    status TEXT,                  -- статус участника канала по get_chat_member
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subscription_checks_updated_at ON subscription_checks(updated_at);
+"""
+
+
+# --- Шаг 16: пересчёт total_steps ---
+
+def _user_stats_recount(db):
+    """
+    COMPLETE_SQL умножал сумму шагов на число завершённых строк, и завершение без
+    session_id сразу нескольких открытых сессий завышало total_steps. Счётчики
+    пересобираются по user_scenarios.
+    """
+    user_stats.backfill(db.conn)
+
+
+# --- Шаг 17: лишний индекс шага 10 ---
+
+# Шаг 10 создавал idx_scenario_logs_scenario_session_id_step под воронку, но ни один
+# запрос бота его не выбирает: воронка с ignored_users фильтрует по периоду и идёт
+# по idx_scenario_logs_scenario_d_local, поиск шагов сессии — по
+# idx_scenario_logs_session_id (шаг 13). Индекс только утяжелял каждую вставку в
+# журнал. Применённые шаги не правятся, поэтому он удаляется отдельным шагом.
+DROP_SCENARIO_SESSION_STEP_INDEX_SQL = """
+DROP INDEX IF EXISTS idx_scenario_logs_scenario_session_id_step;
+"""
+
+
+def _source(part) -> str:
+    if callable(part):
+        return inspect.getsource(part)
+    return part if isinstance(part, str) else repr(part)
+
+
+class Migration:
+    """
+    Шаг миграции: либо SQL-скрипт, либо функция func(db). deps — помощники
+    функции из этого модуля (функции, SQL, таблицы), входящие в контрольную сумму.
+    """
+
+    def __init__(self, version: int, name: str, sql: str = None, func=None, deps: tuple = ()):
+        if (sql is None) == (func is None):
+            raise ValueError(f"Migration {version} must have exactly one of sql/func")
+        self.version = version
+        self.name = name
+        self.sql = sql
+        self.func = func
+        self.deps = deps
+
+    @staticmethod
+    def _hash(body: str) -> str:
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def checksum(self) -> str:
+        if self.sql is not None:
+            return self._hash(self.sql)
+        return self._hash("".join(_source(part) for part in (self.func, *self.deps)))
+
+    @property
+    def accepted_checksums(self) -> set:
+        """
+        Суммы, с которыми запись о шаге считается верной. Шаги с deps, применённые
+        до их учёта, записаны с суммой одной функции — она тоже принимается.
+        """
+        sums = {self.checksum}
+        if self.deps:
+            sums.add(self._hash(inspect.getsource(self.func)))
+        return sums
+
+
+# Порядок важен, номера идут подряд. Новые шаги — только в конец.
+MIGRATIONS = [
+    Migration(1, "baseline_schema", func=_baseline_schema),
+    Migration(2, "user_requests_legacy_columns", func=_user_requests_legacy_columns),
+    Migration(3, "metrics_infrastructure", sql=METRICS_SQL),
+    Migration(4, "time_columns", func=_time_columns,
+              deps=(TIME_COLUMNS, TIME_INDEXES, time_column_ddl, add_time_columns)),
+    Migration(5, "events_view_on_time_columns", sql=EVENTS_VIEW_SQL),
+    Migration(6, "daily_rollups", func=_daily_rollups),
+    Migration(7, "user_cohorts", func=_user_cohorts),
+    Migration(8, "user_stats", func=_user_stats),
+    Migration(9, "actions_archive_manifest", sql=archive.MANIFEST_SQL),
+    Migration(10, "scenario_logs_session_id", func=_scenario_logs_session_id),
+    Migration(11, "events_view_on_session_id", sql=SESSION_EVENTS_VIEW_SQL),
+    Migration(12, "user_reachability", func=_user_reachability),
+    Migration(13, "user_scenarios_step_counters", func=_user_scenarios_step_counters),
+    Migration(14, "fsm_storage", sql=FSM_STORAGE_SQL),
+    Migration(15, "subscription_checks", sql=SUBSCRIPTION_CHECKS_SQL),
+    Migration(16, "user_stats_recount", func=_user_stats_recount),
+    Migration(17, "drop_scenario_session_step_index", sql=DROP_SCENARIO_SESSION_STEP_INDEX_SQL),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+_SCHEMA_MIGRATIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    duration_ms REAL
+)"""
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db) -> int:
+    """
+    Доводит схему до LATEST_VERSION. Возвращает число применённых шагов.
+    Если схема актуальна — одно чтение PRAGMA user_version.
+    """
+    conn = db.conn
+    version = current_version(conn)
+    if version == LATEST_VERSION:
+        return 0
+    if version > LATEST_VERSION:
+        logger.warning(f"Database schema version {version} is newer than code ({LATEST_VERSION}); migrations skipped")
+        return 0
+
+    started = time.perf_counter()
+    with conn:
+        conn.execute(_SCHEMA_MIGRATIONS_SQL)
+    _check_applied(conn, log_only=True)
+
+    applied = 0
+    for step in MIGRATIONS:
+        if step.version <= version:
+            continue
+        step_started = time.perf_counter()
+        logger.info(f"Applying migration {step.version}: {step.name}")
+        try:
+            if step.sql is not None:
+                # executescript сам завершает открытую транзакцию, поэтому BEGIN/COMMIT
+                # пишем в скрипт явно: шаг, запись о нём и user_version — атомарно.
+                conn.executescript(
+                    f"BEGIN;\n{step.sql}\n;"
+                    f"INSERT OR REPLACE INTO schema_migrations (version, name, checksum, duration_ms) "
+                    f"VALUES ({step.version}, '{step.name}', '{step.checksum}', NULL);\n"
+                    f"PRAGMA user_version = {step.version};\nCOMMIT;")
+            else:
+                # Не атомарно с записью ниже (см. docstring модуля): при сбое между
+                # ними шаг повторится, поэтому функция обязана быть идемпотентной.
+                step.func(db)
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO schema_migrations (version, name, checksum) VALUES (?, ?, ?)",
+                        (step.version, step.name, step.checksum))
+                    conn.execute(f"PRAGMA user_version = {step.version}")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.critical(f"Migration {step.version} ({step.name}) failed", exc_info=True)
+            raise
+        duration_ms = (time.perf_counter() - step_started) * 1000
+        with conn:
+            conn.execute("UPDATE schema_migrations SET duration_ms = ? WHERE version = ?", (round(duration_ms, 2), step.version))
+        applied += 1
+
+    logger.info(f"Schema migrated {version} -> {LATEST_VERSION}: {applied} steps in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return applied
+
+
+def _check_applied(conn: sqlite3.Connection, log_only: bool = False) -> list[str]:
+    """Сверяет контрольные суммы применённых шагов с кодом. Возвращает список расхождений."""
+    problems = []
+    known = {m.version: m for m in MIGRATIONS}
+    try:
+        rows = conn.execute("SELECT version, name, checksum FROM schema_migrations ORDER BY version").fetchall()
+    except sqlite3.Error:
+        return ["schema_migrations table is missing"]
+    for version, name, checksum in rows:
+        step = known.get(version)
+        if step is None:
+            problems.append(f"{version} ({name}): applied but unknown to the code")
+        elif checksum not in step.accepted_checksums:
+            problems.append(f"{version} ({name}): checksum {checksum} != {step.checksum}, step was edited after it was applied")
+    if log_only:
+        for problem in problems:
+            logger.warning(f"Migration check: {problem}")
+    return problems
+
+
+def verify(db) -> list[str]:
+    """Полная проверка для утилит и CI: версия и контрольные суммы."""
+    problems = _check_applied(db.conn)
+    version = current_version(db.conn)
+    if version != LATEST_VERSION:
+        problems.append(f"user_version is {version}, expected {LATEST_VERSION}")
+    return problems
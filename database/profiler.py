@@ -0,0 +1,257 @@
+"""
+Профилировщик запросов Database: какие методы и какие SQL-запросы медленные.
+
+Включается переменной окружения DB_PROFILE=1 (см. main.py), по умолчанию выключен.
+
+Как устроен:
+  * каждый публичный метод Database оборачивается таймером, и на время вызова
+    в потоке запоминается «текущий метод»;
+  * на соединения ставится sqlite3 set_trace_callback: SQLite сообщает текст каждого
+    выполняемого запроса, и профилировщик приписывает его текущему методу;
+  * длительность запроса — время до следующего запроса того же вызова или до выхода
+    из метода. Методы Database выполняют запрос и сразу же выбирают строки, так что
+    это и есть «выполнение + выборка»;
+  * строк «вернул» — размер результата метода (список, словарь, множество);
+  * всё складывается в кольцевой буфер в памяти; запросы дольше порога дополнительно
+    получают EXPLAIN QUERY PLAN и (если persist=True) пишутся в таблицу query_stats.
+
+Литералы в тексте запроса заменяются на «?»: в запросах бывают тексты пользователей
+(user_requests, рефлексии), им нечего делать в админке и в query_stats. План
+строится по исходному тексту до маскировки.
+
+Методы оборачиваются не на объекте, а через подкласс, который подставляется в
+db.__class__. Так обёртки достаются и представлениям Database, которые db.aio
+строит для своих потоков: их класс наследует класс исходного объекта.
+"""
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+import types
+from collections import deque
+from datetime import datetime
+
+from database import statement_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD_MS = 50.0
+DEFAULT_CAPACITY = 500
+
+# Служебные операторы не интересны ни в отчёте, ни для EXPLAIN.
+_SKIP_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA", "EXPLAIN")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Текст запроса без литералов и лишних пробелов — и для показа, и для группировки."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryProfiler:
+    """Сбор времени методов и запросов Database в кольцевой буфер."""
+
+    def __init__(self, threshold_ms: float = DEFAULT_THRESHOLD_MS, capacity: int = DEFAULT_CAPACITY,
+                 persist: bool = False):
+        self.threshold_ms = threshold_ms
+        self.persist = persist
+        self.calls = deque(maxlen=capacity)        # последние вызовы методов
+        self.slow = deque(maxlen=capacity)         # запросы дольше порога, с планом
+        self.methods: dict[str, dict] = {}         # агрегаты по методам
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._persist_ready = False
+
+    # --- Подключение ---
+
+    def attach(self, conn: sqlite3.Connection):
+        """Ставит трассировку на соединение. Соединений у Database несколько (db.aio)."""
+        conn.set_trace_callback(functools.partial(self._on_statement, conn))
+
+    def install(self, db):
+        """Включает профилирование у экземпляра Database."""
+        cls = type(db)
+        if not getattr(cls, "_profiled", False):
+            db.__class__ = _profiled_class(cls)
+        db.profiler = self
+        self.attach(db.conn)
+        if self.persist:
+            self._ensure_table(db.conn)
+        logger.info(f"Query profiler enabled: threshold={self.threshold_ms}ms, persist={self.persist}")
+        return self
+
+    def _ensure_table(self, conn):
+        try:
+            self._local.internal = True
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS query_stats (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recorded_at TEXT NOT NULL,
+                        method TEXT,
+                        statement TEXT NOT NULL,
+                        duration_ms REAL NOT NULL,
+                        rows INTEGER,
+                        plan TEXT
+                    )""")
+            self._persist_ready = True
+        except sqlite3.Error as e:
+            logger.error(f"Failed to create query_stats table: {e}", exc_info=True)
+        finally:
+            self._local.internal = False
+
+    # --- Сбор ---
+
+    def _frames(self) -> list:
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def _on_statement(self, conn, sql: str):
+        if getattr(self._local, "internal", False):
+            return
+        statement_counter.on_statement(sql)  # трассировка у соединения одна, счёт апдейта ведём отсюда
+        frames = self._frames()
+        if not frames:
+            return  # запрос вне методов Database (db.conn напрямую из модулей) — не наш
+        now = time.perf_counter()
+        statements = frames[-1]["statements"]
+        if statements:
+            statements[-1]["ms"] = (now - statements[-1]["start"]) * 1000
+        statements.append({"sql": sql, "start": now, "ms": None, "conn": conn})
+
+    def enter(self, method: str):
+        frames = self._frames()
+        if frames:
+            # Вложенный вызов: время открытого запроса родителя заканчивается здесь,
+            # иначе в него засчиталось бы всё время вложенного метода.
+            parent = frames[-1]["statements"]
+            if parent and parent[-1]["ms"] is None:
+                parent[-1]["ms"] = (time.perf_counter() - parent[-1]["start"]) * 1000
+        frames.append({"method": method, "start": time.perf_counter(), "statements": []})
+
+    def exit(self, result):
+        frames = self._frames()
+        frame = frames.pop()
+        end = time.perf_counter()
+        duration_ms = (end - frame["start"]) * 1000
+        statements = frame["statements"]
+        if statements and statements[-1]["ms"] is None:
+            statements[-1]["ms"] = (end - statements[-1]["start"]) * 1000
+        rows = len(result) if isinstance(result, (list, tuple, dict, set)) else None
+
+        slow_found = []
+        for st in statements:
+            if st["ms"] >= self.threshold_ms and not st["sql"].lstrip().upper().startswith(_SKIP_PREFIXES):
+                slow_found.append({
+                    "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "method": frame["method"],
+                    "sql": normalize_sql(st["sql"])[:1000],
+                    "ms": round(st["ms"], 2),
+                    "rows": rows if st is statements[-1] else None,
+                    "plan": self._explain(st["conn"], st["sql"]),
+                })
+
+        with self._lock:
+            agg = self.methods.setdefault(frame["method"], {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "statements": 0})
+            agg["calls"] += 1
+            agg["total_ms"] += duration_ms
+            agg["max_ms"] = max(agg["max_ms"], duration_ms)
+            agg["statements"] += len(statements)
+            self.calls.append({"method": frame["method"], "ms": round(duration_ms, 2),
+                               "statements": len(statements), "rows": rows})
+            self.slow.extend(slow_found)
+
+        # Пишем только из внешнего вызова и вне транзакции, чтобы не вклиниться в чужую.
+        if slow_found and self.persist and self._persist_ready and not frames:
+            self._store(statements[-1]["conn"], slow_found)
+
+    def _explain(self, conn, sql: str) -> str | None:
+        self._local.internal = True
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            return "\n".join(str(row[-1]) for row in rows)
+        except sqlite3.Error:
+            return None  # не каждое выражение объяснимо (DDL, несколько операторов)
+        finally:
+            self._local.internal = False
+
+    def _store(self, conn, records):
+        if conn.in_transaction:
+            return
+        self._local.internal = True
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO query_stats (recorded_at, method, statement, duration_ms, rows, plan) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(r["at"], r["method"], r["sql"], r["ms"], r["rows"], r["plan"]) for r in records])
+        except sqlite3.Error as e:
+            # Например, соединение читателя открыто только на чтение — останется буфер в памяти.
+            logger.debug(f"query_stats write skipped: {e}")
+        finally:
+            self._local.internal = False
+
+    # --- Отчёт ---
+
+    def top_methods(self, limit: int = 10) -> list[dict]:
+        with self._lock:
+            items = [{"method": name, **agg, "avg_ms": agg["total_ms"] / agg["calls"]}
+                     for name, agg in self.methods.items()]
+        items.sort(key=lambda item: item["total_ms"], reverse=True)
+        return items[:limit]
+
+    def slowest(self, limit: int = 10) -> list[dict]:
+        with self._lock:
+            items = list(self.slow)
+        items.sort(key=lambda item: item["ms"], reverse=True)
+        return items[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.slow.clear()
+            self.methods.clear()
+
+
+def _wrap(name, func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        profiler = self.__dict__.get("profiler")
+        if profiler is None:
+            return func(self, *args, **kwargs)
+        profiler.enter(name)
+        result = None
+        try:
+            result = func(self, *args, **kwargs)
+            return result
+        finally:
+            profiler.exit(result)
+    return wrapper
+
+
+_profiled_classes: dict = {}
+
+
+def _profiled_class(cls):
+    """Подкласс Database, у которого все публичные методы обёрнуты таймером."""
+    if cls in _profiled_classes:
+        return _profiled_classes[cls]
+    namespace = {"_profiled": True}
+    for name in dir(cls):
+        if name.startswith("_"):
+            continue
+        attr = getattr(cls, name)
+        # staticmethod/classmethod и константы не трогаем: у них нет self.
+        if isinstance(cls.__dict__.get(name, attr), types.FunctionType):
+            namespace[name] = _wrap(name, attr)
+    profiled = type(f"Profiled{cls.__name__}", (cls,), namespace)
+    _profiled_classes[cls] = profiled
+    return profiled
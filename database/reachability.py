@@ -0,0 +1,97 @@
+"""
+Признак доступности пользователя (user_reachability) для отбора получателей рассылки.
+
+Раньше get_unreachable_user_ids на каждый вызов склеивал UNION ALL из всего
+mailing_logs и всех reminder_sent в actions, искал LIKE '%Forbidden%' в тексте
+ошибок и для каждой строки коррелированным подзапросом находил последний сигнал
+пользователя. Стоимость росла с журналами, а напоминания пишутся каждый день.
+
+Теперь на пользователя одна строка с последним сигналом: её обновляют в момент
+отправки NotificationService._log_reminder и PostManager.send_post_to_user,
+а чтение — выборка по частичному индексу WHERE reachable = 0.
+
+Правила прежние: недоступен, если рассылка получила статус 'blocked' или в
+ошибке есть «Forbidden»; любой другой исход отправки (в том числе сетевой сбой)
+считается признаком доступности. Побеждает самый свежий сигнал — сравниваем
+секунды UTC, а не строки; сигнал старше уже записанного строку не трогает.
+"""
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS user_reachability (
+    user_id INTEGER PRIMARY KEY,
+    last_signal_ts INTEGER NOT NULL,
+    reachable INTEGER NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_user_reachability_unreachable
+    ON user_reachability(reachable) WHERE reachable = 0;
+"""
+
+UPSERT_SQL = """
+INSERT INTO user_reachability (user_id, last_signal_ts, reachable, last_error)
+VALUES (:user_id, :ts, :reachable, :error)
+ON CONFLICT(user_id) DO UPDATE SET
+    last_signal_ts = excluded.last_signal_ts,
+    reachable = excluded.reachable,
+    last_error = excluded.last_error
+WHERE excluded.last_signal_ts >= user_reachability.last_signal_ts
+"""
+
+# Те же признаки, что и у прежнего запроса по журналам; при равном времени
+# блокировка важнее успешной отправки.
+BACKFILL_SQL = """
+WITH signals AS (
+    SELECT user_id,
+           ts_epoch AS ts,
+           CASE WHEN status = 'blocked'
+                  OR COALESCE(error_message, '') LIKE '%Forbidden%'
+                THEN 0 ELSE 1 END AS ok,
+           error_message AS error
+    FROM mailing_logs
+    WHERE ts_epoch IS NOT NULL
+    UNION ALL
+    SELECT user_id,
+           ts_epoch AS ts,
+           CASE WHEN details LIKE '%Forbidden%' THEN 0 ELSE 1 END AS ok,
+           CASE WHEN json_valid(details) THEN json_extract(details, '$.error') END AS error
+    FROM actions
+    WHERE action = 'reminder_sent' AND ts_epoch IS NOT NULL
+),
+ranked AS (
+    SELECT user_id, ts, ok, error,
+           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY ts DESC, ok) AS rn
+    FROM signals
+    WHERE user_id IS NOT NULL
+)
+INSERT INTO user_reachability (user_id, last_signal_ts, reachable, last_error)
+SELECT user_id, ts, ok, error FROM ranked WHERE rn = 1
+"""
+
+
+def is_blocked(status: str = None, error: str = None) -> bool:
+    """Исход отправки означает блокировку бота или удалённый аккаунт."""
+    return status == "blocked" or "forbidden" in (error or "").lower()
+
+
+def record(conn: sqlite3.Connection, user_id: int, status: str = None, error: str = None,
+           ts: int = None):
+    """Пишет сигнал отправки; вызывать внутри транзакции вызывающего."""
+    conn.execute(UPSERT_SQL, {
+        "user_id": user_id,
+        "ts": int(time.time()) if ts is None else ts,
+        "reachable": 0 if is_blocked(status, error) else 1,
+        "error": str(error)[:200] if error else None,
+    })
+
+
+def backfill(conn: sqlite3.Connection) -> int:
+    """Заполняет user_reachability заново по mailing_logs и напоминаниям. Возвращает число строк."""
+    with conn:
+        conn.execute("DELETE FROM user_reachability")
+        conn.execute(BACKFILL_SQL)
+    return conn.execute("SELECT COUNT(*) FROM user_reachability").fetchone()[0]
@@ -0,0 +1,222 @@
+"""
+Дневные агрегаты scenario_logs для дашборда админки.
+
+Раньше get_dau_metrics, get_scenario_stats, get_card_funnel_metrics и
+get_deck_popularity_metrics на каждое нажатие кнопки пересчитывали всю историю
+scenario_logs через v_events/v_sessions: GROUP BY по миллионам событий, чтобы
+показать несколько чисел за неделю.
+
+Теперь агрегаты по дням лежат в таблицах, и дашборд читает O(дней) строк:
+  * daily_active_users(d_local, user_id)            — кто был активен в день;
+  * daily_scenario_steps(d_local, scenario, step, sessions) — воронка по шагам;
+  * daily_scenario_sessions(d_local, scenario, sessions, completed, events)
+                                                    — старты/завершения и глубина;
+  * daily_deck_draws(d_local, deck, draws, users)   — популярность колод;
+  * user_cohorts(user_id, first_day, activity)      — когорты удержания.
+
+Обновляет их фоновая задача (run_refresh_loop, см. main.py) по высокой отметке
+rowid в rollup_state: берутся только дни, в которые с прошлого раза пришли
+новые события, и эти дни пересчитываются целиком по индексу d_local. Считать
+«дельтами» нельзя — уникальные сессии и пользователи не складываются, — а
+пересчёт одного-двух свежих дней стоит как запрос за сегодня.
+
+Как и VIEW, агрегаты не учитывают ignored_users. Если список меняется,
+агрегаты пересобираются целиком (rebuild, вызывается из main.py после
+sync_ignored_users). Сессия, перешедшая через полночь, считается в обоих днях.
+
+Когорты. first_day — первый день пользователя в scenario_logs, activity — битовая
+маска: бит k означает, что человек был активен на k-й день после first_day. Бит
+ставится один раз и дальше не меняется, поэтому когорты обновляются настоящими
+дельтами. Матрица удержания D0–D30 — это SUM((activity >> k) & 1) по когортам,
+один проход по user_cohorts вместо самосоединений scenario_logs. В маске 63 бита:
+активность позже 62-го дня не отслеживается. Если событие пришло задним числом
+раньше first_day, маска сдвигается вместе с first_day.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_SEC = 60
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS daily_active_users (
+    d_local TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (d_local, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_scenario_steps (
+    d_local TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    step TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    PRIMARY KEY (d_local, scenario, step)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_scenario_sessions (
+    d_local TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    PRIMARY KEY (d_local, scenario)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_deck_draws (
+    d_local TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    draws INTEGER NOT NULL,
+    users INTEGER NOT NULL,
+    PRIMARY KEY (d_local, deck)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_cohorts (
+    user_id INTEGER PRIMARY KEY,
+    first_day TEXT NOT NULL,
+    activity INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_cohorts_first_day ON user_cohorts(first_day);
+
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    last_rowid INTEGER NOT NULL,
+    refreshed_at TEXT
+);
+"""
+
+TABLES = ("daily_active_users", "daily_scenario_steps", "daily_scenario_sessions", "daily_deck_draws")
+
+# Отбор событий пересчитываемых дней: :days — JSON-список дат, :top — отметка rowid,
+# до которой агрегаты будут считаться актуальными.
+_EVENTS = """
+    FROM scenario_logs l
+    WHERE l.d_local IN (SELECT value FROM json_each(:days))
+      AND l.rowid <= :top
+      AND NOT EXISTS (SELECT 1 FROM ignored_users i WHERE i.user_id = l.user_id)
+"""
+
+_RECOMPUTE = (
+    f"""INSERT INTO daily_active_users (d_local, user_id)
+        SELECT DISTINCT l.d_local, l.user_id {_EVENTS}""",
+
+    f"""INSERT INTO daily_scenario_steps (d_local, scenario, step, sessions)
+        SELECT l.d_local, l.scenario, l.step, COUNT(DISTINCT l.session_id)
+        {_EVENTS}
+        GROUP BY l.d_local, l.scenario, l.step""",
+
+    # Те же правила, что у v_sessions: без «свалки» unknown% и без одиночных
+    # scenario_started со старым uuid4 вместо session_id.
+    f"""INSERT INTO daily_scenario_sessions (d_local, scenario, sessions, completed, events)
+        SELECT d_local, scenario, COUNT(*), SUM(is_completed), SUM(events)
+        FROM (
+            SELECT l.d_local, l.scenario, l.session_id,
+                   MAX(l.step = 'completed') AS is_completed, COUNT(*) AS events
+            {_EVENTS}
+              AND l.session_id IS NOT NULL
+              AND l.session_id NOT LIKE 'unknown%'
+            GROUP BY l.d_local, l.scenario, l.session_id
+            HAVING NOT (session_id LIKE '%-%' AND SUM(l.step = 'scenario_started') = COUNT(*))
+        )
+        GROUP BY d_local, scenario""",
+
+    # Колоду card_drawn пишет в deck_name, а v_decks_daily искал deck и потому
+    # всегда был пуст. Берём любое из двух.
+    f"""INSERT INTO daily_deck_draws (d_local, deck, draws, users)
+        SELECT d_local, deck, COUNT(*), COUNT(DISTINCT user_id)
+        FROM (
+            SELECT l.d_local, l.user_id,
+                   COALESCE(json_extract(l.metadata, '$.deck'), json_extract(l.metadata, '$.deck_name')) AS deck
+            {_EVENTS}
+              AND l.step = 'card_drawn'
+        )
+        WHERE deck IS NOT NULL
+        GROUP BY d_local, deck""",
+)
+
+MAX_COHORT_DAY = 62
+
+# Новые события (rowid в (:last, :top]) без ignored_users.
+_NEW_EVENTS = """
+    FROM scenario_logs l
+    WHERE l.rowid > :last AND l.rowid <= :top
+      AND l.d_local IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM ignored_users i WHERE i.user_id = l.user_id)
+"""
+
+_COHORTS = (
+    f"""INSERT INTO user_cohorts (user_id, first_day, activity)
+        SELECT l.user_id, MIN(l.d_local), 0 {_NEW_EVENTS}
+        GROUP BY l.user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            activity = CASE WHEN excluded.first_day < first_day
+                            THEN activity << CAST(julianday(first_day) - julianday(excluded.first_day) AS INTEGER)
+                            ELSE activity END,
+            first_day = MIN(first_day, excluded.first_day)""",
+
+    # Дни одного пользователя различны, поэтому сумма различных степеней двойки —
+    # то же, что их побитовое ИЛИ (агрегата BIT_OR в SQLite нет).
+    f"""UPDATE user_cohorts
+        SET activity = activity | COALESCE((
+            SELECT SUM(DISTINCT 1 << CAST(julianday(l.d_local) - julianday(user_cohorts.first_day) AS INTEGER))
+            {_NEW_EVENTS}
+              AND l.user_id = user_cohorts.user_id
+              AND julianday(l.d_local) - julianday(user_cohorts.first_day) BETWEEN 0 AND {MAX_COHORT_DAY}), 0)
+        WHERE user_id IN (SELECT l.user_id {_NEW_EVENTS})""",
+)
+
+
+def refresh(conn: sqlite3.Connection) -> int:
+    """
+    Пересчитывает дни, в которые появились события после отметки. Возвращает
+    число новых событий (0 — агрегаты и так актуальны).
+    """
+    row = conn.execute("SELECT last_rowid FROM rollup_state WHERE name = 'scenario_logs'").fetchone()
+    last = row[0] if row else 0
+    top = conn.execute("SELECT MAX(rowid) FROM scenario_logs").fetchone()[0] or 0
+    if top <= last:
+        return 0
+
+    with conn:
+        days = [r[0] for r in conn.execute(
+            "SELECT DISTINCT d_local FROM scenario_logs WHERE rowid > ? AND rowid <= ? AND d_local IS NOT NULL",
+            (last, top))]
+        if days:
+            params = {"days": json.dumps(days), "top": top}
+            for table in TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE d_local IN (SELECT value FROM json_each(?))", (params["days"],))
+            for sql in _RECOMPUTE:
+                conn.execute(sql, params)
+        for sql in _COHORTS:
+            conn.execute(sql, {"last": last, "top": top})
+        conn.execute("""
+            INSERT INTO rollup_state (name, last_rowid, refreshed_at) VALUES ('scenario_logs', ?, datetime('now'))
+            ON CONFLICT(name) DO UPDATE SET last_rowid = excluded.last_rowid, refreshed_at = excluded.refreshed_at
+        """, (top,))
+    return top - last
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """Пересобирает агрегаты с нуля: после смены ignored_users или для проверки."""
+    with conn:
+        for table in TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("DELETE FROM user_cohorts")
+        conn.execute("DELETE FROM rollup_state WHERE name = 'scenario_logs'")
+    return refresh(conn)
+
+
+async def run_refresh_loop(db, interval_sec: float = DEFAULT_REFRESH_SEC):
+    """Фоновая задача main.py: раз в interval_sec дописывает свежие дни."""
+    from database.async_db import call_db
+
+    while True:
+        try:
+            await call_db(db, "refresh_rollups")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Rollup refresh failed: {e}", exc_info=True)
+        await asyncio.sleep(interval_sec)
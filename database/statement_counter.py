@@ -0,0 +1,27 @@
+"""
+Подсчёт SQL-запросов в пределах одного апдейта (метрики апдейтов, modules/update_metrics.py).
+
+Middleware метрик кладёт в current запись апдейта, а на соединения Database
+ставится sqlite3 set_trace_callback, который прибавляет единицу к её счётчику
+statements. Запись живёт в contextvars, поэтому запросы из потоков db.aio тоже
+попадают в свой апдейт: AsyncDatabase переносит контекст в поток явно. Вне
+апдейта (рассылки, напоминания, фоновые задачи) записи нет, и счёт не ведётся.
+
+Трассировка у соединения одна. Если включён профилировщик (database/profiler.py),
+он ставит свою и сам зовёт on_statement.
+"""
+import sqlite3
+from contextvars import ContextVar
+
+# Запись текущего апдейта: любой объект с целочисленным полем statements
+current: ContextVar = ContextVar("update_record", default=None)
+
+
+def on_statement(sql: str):
+    record = current.get()
+    if record is not None:
+        record.statements += 1
+
+
+def attach(conn: sqlite3.Connection):
+    conn.set_trace_callback(on_statement)
@@ -0,0 +1,146 @@
+"""
+Кэш SubscriptionMiddleware: проверки подписки на канал и флаг «завершил первую карту».
+
+Раньше middleware на каждый апдейт каждого пользователя делал SELECT COUNT(*) по
+user_scenarios (has_completed_scenario_first_time), а дату последней проверки
+подписки держал в словаре на уровне класса: он рос на запись с каждым человеком
+и пропадал при перезапуске — после каждого рестарта все активные пользователи
+заново шли в bot.get_chat_member.
+
+Теперь:
+  * флаг первой карты — в памяти. «Да» не меняется никогда, «нет» сбрасывается
+    complete_user_scenario в момент завершения карты дня, поэтому ответ из кэша
+    всегда актуален, а в базу идёт только первый вопрос о человеке;
+  * проверки подписки лежат в шарде текущего дня: при смене даты шард
+    выбрасывается целиком, отдельной чистки не нужно;
+  * оба словаря ограничены maxsize, вытесняются давно не заходившие — для них
+    это один лишний запрос (FIRST_CARD_LOOKUP_SQL), а не ошибка;
+  * таблица subscription_checks (шаг миграции 15) — строка на каждого, кто
+    завершил первую карту, с датой и статусом последней проверки. При открытии
+    базы самые свежие maxsize строк загружаются обратно, так что рестарт не
+    вызывает волну запросов к Telegram.
+
+Кэш потокобезопасен: complete_user_scenario может идти в потоке db.aio.
+"""
+import threading
+from collections import OrderedDict
+
+# Сценарий, после первого завершения которого показывается приглашение в канал
+FIRST_CARD_SCENARIO = "card_of_day"
+DEFAULT_MAXSIZE = 20000
+
+# Человек завершил первую карту: строка заводится без проверки подписки
+FIRST_CARD_SQL = "INSERT OR IGNORE INTO subscription_checks (user_id, updated_at) VALUES (?, ?)"
+CHECK_SQL = """
+INSERT INTO subscription_checks (user_id, checked_on, status, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    checked_on = excluded.checked_on, status = excluded.status, updated_at = excluded.updated_at
+"""
+LOAD_SQL = "SELECT user_id, checked_on FROM subscription_checks ORDER BY updated_at DESC LIMIT ?"
+# Промах кэша: сначала своя таблица, потом завершённые сессии карты дня. Сессии
+# пишутся как card_of_day_<колода>, поэтому кроме точного имени берётся диапазон
+# по префиксу 'card_of_day_' (после '_' идёт '`') — он, в отличие от LIKE, идёт по
+# индексу (user_id, scenario).
+FIRST_CARD_LOOKUP_SQL = """
+SELECT EXISTS (SELECT 1 FROM subscription_checks WHERE user_id = :user_id)
+    OR EXISTS (SELECT 1 FROM user_scenarios
+               WHERE user_id = :user_id AND status = 'completed'
+                 AND (scenario = 'card_of_day' OR (scenario >= 'card_of_day_' AND scenario < 'card_of_day`')))
+"""
+
+
+class SubscriptionCache:
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self.maxsize = max(int(maxsize), 0)
+        self.day = None  # дата шарда проверок
+        self._checked: OrderedDict = OrderedDict()     # user_id -> статус проверки за self.day
+        self._first_card: OrderedDict = OrderedDict()  # user_id -> завершал ли первую карту
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loaded = 0
+
+    def _put(self, store: OrderedDict, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.maxsize:
+            store.popitem(last=False)
+            self.evictions += 1
+
+    def _roll(self, day):
+        if day != self.day:
+            self.day = day
+            self._checked.clear()
+
+    # --- Флаг первой карты ---
+
+    def first_card(self, user_id: int):
+        """True/False из кэша или None, если о человеке ещё не спрашивали."""
+        with self._lock:
+            value = self._first_card.get(user_id)
+            if value is None:
+                self.misses += 1
+                return None
+            self._first_card.move_to_end(user_id)
+            self.hits += 1
+            return value
+
+    def set_first_card(self, user_id: int, value: bool):
+        """«Нет», прочитанное до завершения карты, не затирает уже записанное «да»."""
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            if value or not self._first_card.get(user_id):
+                self._put(self._first_card, user_id, bool(value))
+
+    # --- Проверки подписки ---
+
+    def checked(self, user_id: int, day) -> bool:
+        """Проверяли ли подписку человека в день day."""
+        with self._lock:
+            self._roll(day)
+            if user_id in self._checked:
+                self._checked.move_to_end(user_id)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def mark_checked(self, user_id: int, day, status: str = None):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._roll(day)
+            self._put(self._checked, user_id, status)
+
+    # --- Загрузка и статистика ---
+
+    def load(self, conn, day) -> int:
+        """Поднимает из subscription_checks самые свежие maxsize строк. Возвращает их число."""
+        rows = conn.execute(LOAD_SQL, (self.maxsize,)).fetchall()
+        today = day.isoformat()
+        with self._lock:
+            self._roll(day)
+            # Строки идут от свежих к старым, а в конце OrderedDict должны быть самые свежие
+            for user_id, checked_on in reversed(rows):
+                self._put(self._first_card, user_id, True)
+                if checked_on == today:
+                    self._put(self._checked, user_id, None)
+        self.loaded = len(rows)
+        return self.loaded
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "checked_today": len(self._checked),
+            "first_card_known": len(self._first_card),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "loaded": self.loaded,
+        }
@@ -0,0 +1,113 @@
+"""
+Счётчики личной статистики пользователя (user_stats) для /user_profile.
+
+Раньше get_user_advanced_stats делал девять запросов к user_scenarios, в том числе
+два WITH RECURSIVE для серий дней: рекурсия на каждом шаге искала следующий день
+подзапросом, и стоимость росла квадратично с историей пользователя.
+
+Теперь на пользователя одна строка, которую start_user_scenario и
+complete_user_scenario обновляют одним UPSERT/UPDATE:
+  * total_sessions, completed_sessions, total_steps (сумма steps_count завершённых);
+  * first_day, last_day, unique_days — дни по Москве;
+  * current_streak — серия дней подряд, заканчивающаяся last_day, max_streak;
+  * hours[24], weekdays[7] — гистограммы стартов (JSON-массивы, воскресенье = 0).
+
+Час и день недели берутся по московскому времени. Старые запросы брали их из
+started_at через strftime, то есть по UTC, и «утро» съезжало на три часа.
+Старт «задним числом» (раньше last_day) серию не трогает, только счётчики; новый
+день внутри уже известного диапазона при этом в unique_days не попадёт — для
+O(1) хранить все дни нельзя, а старты с прошедшей датой на практике не приходят.
+"""
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    total_sessions INTEGER NOT NULL DEFAULT 0,
+    completed_sessions INTEGER NOT NULL DEFAULT 0,
+    total_steps INTEGER NOT NULL DEFAULT 0,
+    unique_days INTEGER NOT NULL DEFAULT 0,
+    first_day TEXT,
+    last_day TEXT,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    max_streak INTEGER NOT NULL DEFAULT 0,
+    hours TEXT NOT NULL DEFAULT '{json.dumps([0] * 24)}',
+    weekdays TEXT NOT NULL DEFAULT '{json.dumps([0] * 7)}'
+);
+"""
+
+# Серия после старта в день :day: тот же день — без изменений, следующий — +1,
+# разрыв — заново с единицы, день раньше last_day — без изменений.
+_STREAK = """CASE WHEN last_day IS NULL OR :day > date(last_day, '+1 day') THEN 1
+                  WHEN :day = date(last_day, '+1 day') THEN current_streak + 1
+                  ELSE current_streak END"""
+
+START_SQL = f"""
+INSERT INTO user_stats (user_id, total_sessions, unique_days, first_day, last_day,
+                        current_streak, max_streak, hours, weekdays)
+VALUES (:user_id, 1, 1, :day, :day, 1, 1,
+        json_set('{json.dumps([0] * 24)}', :hour_path, 1),
+        json_set('{json.dumps([0] * 7)}', :weekday_path, 1))
+ON CONFLICT(user_id) DO UPDATE SET
+    total_sessions = total_sessions + 1,
+    unique_days = unique_days + (last_day IS NULL OR :day > last_day OR :day < first_day),
+    current_streak = {_STREAK},
+    max_streak = MAX(max_streak, {_STREAK}),
+    first_day = MIN(COALESCE(first_day, :day), :day),
+    last_day = MAX(COALESCE(last_day, :day), :day),
+    hours = json_set(hours, :hour_path, json_extract(hours, :hour_path) + 1),
+    weekdays = json_set(weekdays, :weekday_path, json_extract(weekdays, :weekday_path) + 1)
+"""
+
+# :steps — уже сумма steps_count по всем завершаемым строкам, :sessions — их число
+COMPLETE_SQL = """
+UPDATE user_stats
+SET completed_sessions = completed_sessions + :sessions,
+    total_steps = total_steps + :steps
+WHERE user_id = :user_id
+"""
+
+
+def start_params(user_id: int, started_at: datetime) -> dict:
+    """Параметры START_SQL; started_at — aware datetime в московском времени."""
+    return {
+        "user_id": user_id,
+        "day": started_at.date().isoformat(),
+        "hour_path": f"$[{started_at.hour}]",
+        "weekday_path": f"$[{started_at.isoweekday() % 7}]",
+    }
+
+
+def backfill(conn: sqlite3.Connection) -> int:
+    """
+    Заполняет user_stats по истории user_scenarios: проигрывает старты в порядке
+    времени тем же START_SQL, потом добавляет завершённые. Возвращает число стартов.
+    """
+    with conn:
+        conn.execute("DELETE FROM user_stats")
+        starts = conn.execute("""
+            SELECT user_id,
+                   d_local AS day,
+                   '$[' || CAST(strftime('%H', ts_epoch, 'unixepoch', '+3 hours') AS INTEGER) || ']' AS hour_path,
+                   '$[' || strftime('%w', ts_epoch, 'unixepoch', '+3 hours') || ']' AS weekday_path
+            FROM user_scenarios
+            WHERE d_local IS NOT NULL
+            ORDER BY ts_epoch, id
+        """).fetchall()
+        conn.executemany(START_SQL, [dict(zip(("user_id", "day", "hour_path", "weekday_path"), row))
+                                     for row in starts])
+        # Агрегат одним проходом, а не коррелированный подзапрос на каждого пользователя:
+        # без статистики планировщик берёт для него индекс по status, и выходит квадрат.
+        completed = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(steps_count), 0), user_id
+            FROM user_scenarios
+            WHERE status = 'completed'
+            GROUP BY user_id
+        """).fetchall()
+        conn.executemany("UPDATE user_stats SET completed_sessions = ?, total_steps = ? WHERE user_id = ?", completed)
+    return len(starts)
@@ -137,7 +137,6 @@ from aiogram.fsm.context import FSMContext
 # --- ДОБАВЛЯЕМ ИМПОРТ State ---
 from aiogram.fsm.state import State, StatesGroup
 # --- КОНЕЦ ИЗМЕНЕНИЯ ---
-from aiogram.fsm.storage.memory import MemoryStorage
 from functools import partial
 # Импорт pytz с обработкой ошибок
 try:
@@ -155,10 +154,18 @@ except ImportError:
     print("Using production configuration (config.py)")
 # База данных и Сервисы
 from database.db import Database
+from database.async_db import AsyncDatabase, call_db
+from database.profiler import QueryProfiler
+from database.rollups import run_refresh_loop
+from database.archive import run_archive_loop
+from database.backup import run_backup_loop
+from database.fsm_storage import SQLiteStorage
+from modules.update_metrics import UpdateMetrics, ApiCallCounter, run_summary_loop
+from modules.admin.dashboard import keep_dashboard_warm
 from modules.logging_service import LoggingService
 from modules.notification_service import NotificationService
 # Убираем импорт State отсюда, т.к. он теперь выше
-from modules.user_management import UserState, UserManager
+from modules.user_management import UserState, UserManager, scenario_for_state
 from modules.ai_service import build_user_profile
 
 # Модуль Карты Дня
@@ -199,7 +206,8 @@ from modules.admin import (
     make_admin_handler,
     make_admin_callback_handler,
     show_admin_main_menu,
-    make_admin_user_profile_handler
+    make_admin_user_profile_handler,
+    make_perf_handler
 )
 
 # --- Стандартные импорты ---
@@ -236,8 +244,6 @@ logger.info(f"Logging level set to {logging.getLevelName(_log_level)} (LOG_LEVEL
 
 # --- Инициализация ---
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
 # Используем локальную БД для разработки
 if 'DB_PATH' in globals():
     db_path = DB_PATH
@@ -248,78 +254,56 @@ else:
 logger.info(f"Initializing database at: {db_path}")
 print(f"Initializing database at: {db_path}")
 
-# 🔄 Применяем миграции базы данных ПЕРЕД созданием объекта Database
-logger.info("🔄 Applying database migrations...")
-print("🔄 Applying database migrations...")
-try:
-    from auto_migrate_on_startup import apply_metrics_migration
-    apply_metrics_migration(db_path=db_path)
-    logger.info("✅ Database migrations applied successfully")
-    print("✅ Database migrations applied successfully")
-except Exception as migration_error:
-    logger.warning(f"⚠️ Database migration warning: {migration_error}")
-    print(f"⚠️ Database migration warning: {migration_error}")
-
 try:
-    db = Database(path=db_path)
+    db = Database(
+        path=db_path,
+        user_cache_size=int(os.getenv("USER_CACHE_SIZE", "2048")),
+        user_cache_ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+        dashboard_ttl=float(os.getenv("DASHBOARD_TTL", "300")),
+        archive_dir=os.getenv("DB_ARCHIVE_DIR") or None,
+        subscription_cache_size=int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "20000")),
+    )
     db.conn.execute("SELECT 1"); logger.info(f"Database connection established successfully: {db.conn}")
+    # Схема уже доведена миграциями в Database(); здесь только сверка ignored_users с конфигом
+    from auto_migrate_on_startup import sync_ignored_users
+    if sync_ignored_users(db.conn):
+        db.rebuild_rollups()
     db.bot = bot
-    
-    # Инициализация таблицы user_requests
-    try:
-        cursor = db.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_requests'")
-        table_exists = cursor.fetchone() is not None
-        
-        if not table_exists:
-            logger.info("Creating user_requests table...")
-            db.conn.execute("""
-                CREATE TABLE user_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    request_text TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    session_id TEXT,
-                    card_number INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """)
-            
-            # Создаем индексы
-            db.conn.execute("CREATE INDEX idx_user_requests_user_id ON user_requests(user_id)")
-            db.conn.execute("CREATE INDEX idx_user_requests_timestamp ON user_requests(timestamp)")
-            db.conn.execute("CREATE INDEX idx_user_requests_session_id ON user_requests(session_id)")
-            
-            db.conn.commit()
-            logger.info("user_requests table created successfully")
-        else:
-            # Проверяем структуру
-            cursor = db.conn.execute("PRAGMA table_info(user_requests)")
-            columns = cursor.fetchall()
-            column_names = [col[1] for col in columns]
-            
-            # Добавляем недостающие колонки
-            if 'request_text' not in column_names:
-                db.conn.execute("ALTER TABLE user_requests ADD COLUMN request_text TEXT")
-                logger.info("Added request_text column")
-            
-            if 'session_id' not in column_names:
-                db.conn.execute("ALTER TABLE user_requests ADD COLUMN session_id TEXT")
-                logger.info("Added session_id column")
-            
-            if 'card_number' not in column_names:
-                db.conn.execute("ALTER TABLE user_requests ADD COLUMN card_number INTEGER")
-                logger.info("Added card_number column")
-            
-            db.conn.commit()
-            logger.info("user_requests table structure verified")
-            
-    except Exception as init_err:
-        logger.error(f"Error initializing user_requests table: {init_err}")
-        print(f"Warning: user_requests table initialization failed: {init_err}")
-        
+    # Профилировщик ставится до db.aio, чтобы трассировка попала и на соединения его потоков
+    if os.getenv("DB_PROFILE") == "1":
+        QueryProfiler(
+            threshold_ms=float(os.getenv("DB_PROFILE_THRESHOLD_MS", "50")),
+            persist=os.getenv("DB_PROFILE_PERSIST") == "1",
+        ).install(db)
+    # Тяжёлые запросы уходят из event loop в потоки через db.aio (см. database/async_db.py)
+    AsyncDatabase(db, readers=int(os.getenv("DB_READERS", "3")))
+    # actions и scenario_logs пишутся пачками раз в DB_FLUSH_MS (см. database/event_buffer.py)
+    db.enable_write_behind(
+        interval_ms=int(os.getenv("DB_FLUSH_MS", "200")),
+        max_rows=int(os.getenv("DB_FLUSH_ROWS", "200")),
+    )
+
 except (sqlite3.Error, Exception) as e:
     logger.exception(f"CRITICAL: Database initialization failed at {db_path}: {e}")
     print(f"CRITICAL: Database initialization failed at {db_path}: {e}"); raise SystemExit(f"Database failed: {e}")
+async def abandon_expired_session(user_id, state, data):
+    """Запись FSM выброшена за простой: незавершённая сессия сценария закрывается как брошенная."""
+    scenario = scenario_for_state(state)
+    session_id = data.get("session_id")
+    if scenario and isinstance(session_id, str):
+        await call_db(db, "abandon_user_scenario", user_id, scenario, session_id)
+
+
+# Состояния FSM переживают перезапуск: SQLite-хранилище с отложенной записью (database/fsm_storage.py).
+# Записи без активности дольше FSM_TTL_HOURS выбрасываются, проверка раз в FSM_SWEEP_SEC.
+storage = SQLiteStorage(
+    db.path,
+    interval_ms=int(os.getenv("FSM_FLUSH_MS", "500")),
+    ttl_sec=float(os.getenv("FSM_TTL_HOURS", "168")) * 3600,
+    sweep_sec=float(os.getenv("FSM_SWEEP_SEC", "600")),
+    on_expire=abandon_expired_session,
+)
+dp = Dispatcher(storage=storage)
 # уже имеется import os earlier
 LOG_DIR = os.getenv("LOG_DIR", "logs")
 logging_service = LoggingService(log_dir=LOG_DIR)
@@ -339,12 +323,11 @@ class SubscriptionMiddleware:
     причём срабатывание нигде не логировалось, и оценить урон было нечем.
     Теперь приглашение показывается не чаще раза в сутки и пишется в actions
     как subscription_invite_shown.
-    """
 
-    # user_id -> дата последней проверки подписки. Отмечается независимо от результата,
-    # поэтому к Telegram обращаемся не чаще раза в сутки на человека. В памяти:
-    # после рестарта проверим снова, это не страшно.
-    _checked_on: dict[int, object] = {}
+    Флаг первой карты и отметки о проверках берутся из db.subscriptions
+    (database/subscription_cache.py): на обычном апдейте ни запроса к базе,
+    ни обращения к Telegram. Отметки переживают перезапуск.
+    """
 
     async def __call__(self, handler, event, data):
         if isinstance(event, (types.Message, types.CallbackQuery)):
@@ -376,15 +359,17 @@ class SubscriptionMiddleware:
                     return await handler(event, data)
 
                 today = datetime.now(TIMEZONE).date() if TIMEZONE else date.today()
-                if self._checked_on.get(user_id) == today:
+                if db.subscriptions.checked(user_id, today):
                     return await handler(event, data)
 
                 # Отмечаем до запроса, а не после: тогда даже при сетевой ошибке
                 # повторных попыток сегодня не будет, и для подписанных пользователей
-                # запрос не повторится на каждом сообщении.
-                self._checked_on[user_id] = today
+                # запрос не повторится на каждом сообщении. В таблицу отметка уходит
+                # уже со статусом; после сетевой ошибки — только в памяти.
+                db.subscriptions.mark_checked(user_id, today)
 
                 user_status = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
+                await call_db(db, "save_subscription_check", user_id, today, user_status.status)
                 allowed_statuses = ["member", "administrator", "creator"]
                 if user_status.status not in allowed_statuses:
                     from modules.texts.common import COMMON_TEXTS
@@ -1460,9 +1445,8 @@ def make_users_handler(db, logger_service):
             username = user_data.get("username", "Нет никнейма")
             last_action_time = "Нет действий"
             last_action_timestamp_iso_or_dt = "1970-01-01T00:00:00+00:00"
-            user_actions = db.get_actions(uid)
-            if user_actions:
-                last_action = user_actions[-1]
+            last_action = next(db.iter_actions(uid, columns=("timestamp",), newest_first=True, page_size=1), None)
+            if last_action:
                 raw_timestamp = last_action.get("timestamp")
                 try:
                     last_action_dt = None
@@ -1534,7 +1518,9 @@ def make_logs_handler(db, logger_service):
             target_date = datetime.now(TIMEZONE).date() if TIMEZONE else datetime.now().date()
             target_date_str = target_date.strftime("%Y-%m-%d")
         await logger_service.log_action(user_id, "logs_command", {"date": target_date_str})
-        logs = db.get_actions()
+        day_start = datetime.combine(target_date, time.min)
+        day_start = TIMEZONE.localize(day_start) if TIMEZONE else day_start
+        logs = db.iter_actions(since=day_start, until=day_start + timedelta(days=1))
         filtered_logs = []
         excluded_users = set(NO_LOGS_USERS) if NO_LOGS_USERS else set()
         for log in logs:
@@ -1783,6 +1769,7 @@ def register_handlers(dp: Dispatcher, db: Database, logging_service: LoggingServ
     process_mailings_handler = make_process_mailings_handler(db, logging_service)
     admin_handler = make_admin_handler(db, logging_service)
     admin_callback_handler = make_admin_callback_handler(db, logging_service)
+    perf_handler = make_perf_handler(db, logging_service)
 
     dp.message.register(start_handler, Command("start"))
     dp.message.register(share_handler, Command("share"))
@@ -1803,6 +1790,7 @@ def register_handlers(dp: Dispatcher, db: Database, logging_service: LoggingServ
     dp.message.register(send_post_handler, Command("send_post"))
     dp.message.register(process_mailings_handler, Command("process_mailings"))
     dp.message.register(admin_handler, Command("admin"))
+    dp.message.register(perf_handler, Command("perf"))
     
     # Регистрируем callback-обработчики для админ-панели
     dp.callback_query.register(admin_callback_handler, F.data.startswith("admin_"))
@@ -2012,18 +2000,6 @@ def register_handlers(dp: Dispatcher, db: Database, logging_service: LoggingServ
 async def main():
     logger.info("Starting bot...")
     
-    # 🔄 Применяем миграции базы данных
-    logger.info("🔄 Applying database migrations...")
-    from auto_migrate_on_startup import apply_metrics_migration
-    try:
-        # Используем тот же путь к БД, что и для основного соединения
-        migration_db_path = db_path if 'db_path' in globals() else os.path.join(DATA_DIR, "bot.db")
-        logger.info(f"Applying migrations to: {migration_db_path}")
-        apply_metrics_migration(db_path=migration_db_path)
-        logger.info("✅ Database migrations applied successfully")
-    except Exception as e:
-        logger.warning(f"⚠️ Database migration warning: {e}")
-    
     # ОБНОВЛЕНО: Полный список команд (как раньше), чтобы они снова отображались в меню Telegram
     commands = [
         types.BotCommand(command="start", description="🏠 Главное меню"),
@@ -2043,6 +2019,7 @@ async def main():
         types.BotCommand(command="list_posts", description="📋 Список постов (админ)"),
         types.BotCommand(command="send_post", description="📤 Отправить пост (админ)"),
         types.BotCommand(command="process_mailings", description="🔄 Обработать рассылки (админ)"),
+        types.BotCommand(command="perf", description="⏱ Производительность (админ)"),
     ]
 
     try:
@@ -2089,6 +2066,20 @@ async def main():
         logger.error(f"Error initializing dispatcher data: {init_err}")
         print(f"Warning: Dispatcher data initialization failed: {init_err}")
     
+    # Метрики апдейтов (modules/update_metrics.py): время хендлеров, запросы к базе и
+    # вызовы Telegram API на апдейт. Outer-middleware регистрируется после FSM, чтобы
+    # видеть состояние, с которым пришёл апдейт.
+    update_metrics = UpdateMetrics(window=int(os.getenv("PERF_WINDOW", "500")))
+    update_metrics.add_source("fsm", storage.stats)
+    update_metrics.add_source("users", db.get_user_cache_stats)
+    update_metrics.add_source("subscriptions", db.get_subscription_cache_stats)
+    update_metrics.add_source("events", db.get_event_buffer_stats)
+    db.update_metrics = update_metrics
+    dp.update.outer_middleware(update_metrics)
+    dp.message.middleware(update_metrics.mark_handler)
+    dp.callback_query.middleware(update_metrics.mark_handler)
+    bot.session.middleware(ApiCallCounter())
+
     # Регистрируем middleware для проверки подписки
     subscription_middleware = SubscriptionMiddleware()
     dp.message.middleware(subscription_middleware)
@@ -2107,6 +2098,22 @@ async def main():
     
     reminder_task = asyncio.create_task(notifier.check_reminders())
     logger.info("Reminder check task scheduled.")
+    # Дневные агрегаты дашборда дописываются раз в DB_ROLLUP_SEC (см. database/rollups.py)
+    rollup_task = asyncio.create_task(run_refresh_loop(db, float(os.getenv("DB_ROLLUP_SEC", "60"))))
+    # Снимки дашборда пересчитываются чуть раньше истечения DASHBOARD_TTL
+    warm_task = asyncio.create_task(keep_dashboard_warm(db, float(os.getenv("DASHBOARD_REFRESH_SEC", "240"))))
+    # actions старше ACTIONS_ARCHIVE_DAYS раз в сутки уходят в месячные архивы (0 — не архивировать)
+    archive_days = int(os.getenv("ACTIONS_ARCHIVE_DAYS", "180"))
+    archive_task = asyncio.create_task(run_archive_loop(db, archive_days)) if archive_days > 0 else None
+    # Проверенные снимки базы раз в DB_BACKUP_HOURS в DB_BACKUP_DIR, хранятся последние DB_BACKUP_KEEP (0 — без копий)
+    backup_hours = float(os.getenv("DB_BACKUP_HOURS", "24"))
+    backup_dir = os.getenv("DB_BACKUP_DIR") or os.path.join(os.path.dirname(db.path), "backups")
+    backup_task = asyncio.create_task(run_backup_loop(
+        db, backup_dir, backup_hours * 3600, int(os.getenv("DB_BACKUP_KEEP", "7")))) if backup_hours > 0 else None
+    storage.start()
+    # Сводка метрик апдейтов в лог раз в PERF_LOG_MIN минут (0 — без сводки)
+    perf_log_min = float(os.getenv("PERF_LOG_MIN", "15"))
+    perf_task = asyncio.create_task(run_summary_loop(update_metrics, perf_log_min * 60)) if perf_log_min > 0 else None
     logger.info("Starting polling...")
     print("Bot is starting polling...")
     try:
@@ -2149,7 +2156,70 @@ async def main():
             logger.info("Reminder task cancelled successfully.")
         except Exception as reminder_err:
             logger.error(f"Error cancelling reminder task: {reminder_err}")
+
+        rollup_task.cancel()
+        try:
+            await rollup_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as rollup_err:
+            logger.error(f"Error cancelling rollup task: {rollup_err}")
+
+        warm_task.cancel()
+        try:
+            await warm_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as warm_err:
+            logger.error(f"Error cancelling dashboard warm-up task: {warm_err}")
+
+        if archive_task:
+            archive_task.cancel()
+            try:
+                await archive_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as archive_err:
+                logger.error(f"Error cancelling archive task: {archive_err}")
+
+        if backup_task:
+            backup_task.cancel()
+            try:
+                await backup_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as backup_err:
+                logger.error(f"Error cancelling backup task: {backup_err}")
+
+        if perf_task:
+            perf_task.cancel()
+            try:
+                await perf_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as perf_err:
+                logger.error(f"Error cancelling perf summary task: {perf_err}")
+            update_metrics.log_summary()
             
+        try:
+            await storage.close()
+        except Exception as storage_err:
+            logger.error(f"Error closing FSM storage: {storage_err}")
+
+        # Дописываем накопленные события до закрытия соединений, пока база точно доступна.
+        if db and db.events:
+            try:
+                db.events.stop()
+                db.events = None
+            except Exception as events_err:
+                logger.error(f"Error flushing event buffer: {events_err}")
+
+        if db and db.aio:
+            try:
+                db.aio.close()
+            except Exception as aio_close_err:
+                logger.error(f"Error closing async database facade: {aio_close_err}")
+
         if db and db.conn:
             try:
                 db.close()
@@ -50,6 +50,15 @@ from modules.admin.training_logs import (
 from modules.admin.author_test_stats import (
     show_admin_author_test_stats
 )
+from modules.admin.slow_queries import (
+    show_admin_slow_queries
+)
+from modules.admin.perf import (
+    show_admin_perf, make_perf_handler
+)
+from modules.admin.cohorts import (
+    show_admin_cohorts
+)
 
 __all__ = [
     # Core
@@ -91,6 +100,16 @@ __all__ = [
         'show_admin_training_users',
 
         # Author test
-        'show_admin_author_test_stats'
+        'show_admin_author_test_stats',
+
+        # Slow queries
+        'show_admin_slow_queries',
+
+        # Perf
+        'show_admin_perf',
+        'make_perf_handler',
+
+        # Cohorts
+        'show_admin_cohorts'
 ]
 
@@ -0,0 +1,81 @@
+"""
+Когорты удержания: по дням первого визита, сколько людей возвращалось на D1…D30.
+
+Данные — user_cohorts (database/rollups.py): матрица считается одним проходом по
+когортам, без обращения к scenario_logs, поэтому раздел можно открывать сколько
+угодно часто.
+"""
+import logging
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from database.async_db import call_db
+from database.db import Database
+from modules.logging_service import LoggingService
+
+logger = logging.getLogger(__name__)
+
+COHORT_DAYS = 21                  # сколько последних дневных когорт показывать
+COLUMNS = (1, 3, 7, 14, 30)       # какие дни матрицы выводить
+
+
+def _cell(retained, size) -> str:
+    if retained is None:
+        return "    ·"
+    return f"{retained / size * 100:4.0f}%" if size else "   0%"
+
+
+async def show_admin_cohorts(message: types.Message, db: Database, logger_service: LoggingService, user_id: int):
+    """Показывает матрицу удержания по дневным когортам."""
+    try:
+        from config import ADMIN_IDS
+        if str(user_id) not in ADMIN_IDS:
+            await message.edit_text("🚫 ДОСТУП ЗАПРЕЩЕН! У вас нет прав администратора.", parse_mode="HTML")
+            logger.warning(f"BLOCKED: User {user_id} attempted to access cohorts")
+            return
+    except ImportError as e:
+        logger.error(f"CRITICAL: Failed to import ADMIN_IDS: {e}")
+        await message.edit_text("🚫 КРИТИЧЕСКАЯ ОШИБКА БЕЗОПАСНОСТИ", parse_mode="HTML")
+        return
+
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_cohorts")],
+        [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")]
+    ])
+    try:
+        matrix = await call_db(db, "get_cohort_retention_matrix", COHORT_DAYS, max(COLUMNS))
+
+        text = "🧬 <b>КОГОРТЫ УДЕРЖАНИЯ</b>\n<i>доля когорты, активная на N-й день после первого визита</i>\n\n"
+        if not matrix:
+            text += "Когорт за последние дни нет."
+        else:
+            header = "дата   кол." + "".join(f"{'D' + str(k):>6}" for k in COLUMNS)
+            lines = [header]
+            totals = {k: [0, 0] for k in COLUMNS}   # k -> [вернулись, из скольких]
+            for cohort in matrix:
+                size = cohort["size"]
+                cells = []
+                for k in COLUMNS:
+                    retained = cohort["retained"][k]
+                    cells.append(f"{_cell(retained, size):>6}")
+                    if retained is not None:
+                        totals[k][0] += retained
+                        totals[k][1] += size
+                lines.append(f"{cohort['first_day'][5:]} {size:>5}" + "".join(cells))
+            lines.append("всего      " + "".join(
+                f"{_cell(totals[k][0], totals[k][1]) if totals[k][1] else '    ·':>6}" for k in COLUMNS))
+            text += "<pre>" + "\n".join(lines) + "</pre>\n<i>· — день ещё не наступил</i>"
+
+        try:
+            await message.edit_text(text[:4090], reply_markup=keyboard, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        await logger_service.log_action(user_id, "admin_cohorts_viewed", {})
+
+    except Exception as e:
+        logger.error(f"Error showing cohorts: {e}", exc_info=True)
+        try:
+            await message.edit_text("❌ Ошибка при загрузке когорт", reply_markup=keyboard)
+        except TelegramBadRequest:
+            pass
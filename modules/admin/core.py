@@ -9,7 +9,7 @@ from modules.logging_service import LoggingService
 
 logger = logging.getLogger(__name__)
 
-ADMIN_MENU_VERSION = "2026-01-17T19:10-admin-author-test-details-v2"
+ADMIN_MENU_VERSION = "2026-10-17T18:00-admin-perf"
 
 
 ADMIN_MENU_TEXT = (
@@ -27,6 +27,7 @@ def build_admin_menu_keyboard() -> types.InlineKeyboardMarkup:
     return types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="🔍 Главный дашборд", callback_data="admin_dashboard")],
         [types.InlineKeyboardButton(text="📈 Метрики удержания", callback_data="admin_retention")],
+        [types.InlineKeyboardButton(text="🧬 Когорты удержания", callback_data="admin_cohorts")],
         [types.InlineKeyboardButton(text="🔄 Воронка 'Карта дня'", callback_data="admin_funnel")],
         [types.InlineKeyboardButton(text="💎 Метрики ценности", callback_data="admin_value")],
         [types.InlineKeyboardButton(text="🃏 Статистика колод", callback_data="admin_decks")],
@@ -36,7 +37,9 @@ def build_admin_menu_keyboard() -> types.InlineKeyboardMarkup:
         [types.InlineKeyboardButton(text="📋 Детальные логи", callback_data="admin_logs")],
         [types.InlineKeyboardButton(text="📝 Управление постами", callback_data="admin_posts")],
         [types.InlineKeyboardButton(text="🛍️ Маркетплейсы", callback_data="admin_marketplaces")],
-        [types.InlineKeyboardButton(text="📚 Логи обучения", callback_data="admin_training_logs")]
+        [types.InlineKeyboardButton(text="📚 Логи обучения", callback_data="admin_training_logs")],
+        [types.InlineKeyboardButton(text="🐢 Медленные запросы", callback_data="admin_slow_queries")],
+        [types.InlineKeyboardButton(text="⏱ Производительность", callback_data="admin_perf")]
     ])
 
 
@@ -127,11 +130,27 @@ def make_admin_callback_handler(db: Database, logger_service: LoggingService):
             show_admin_training_logs, show_admin_training_stats, show_admin_training_users
         )
         from modules.admin.author_test_stats import show_admin_author_test_stats
+        from modules.admin.slow_queries import show_admin_slow_queries
+        from modules.admin.perf import show_admin_perf
+        from modules.admin.cohorts import show_admin_cohorts
         
         action = callback.data
         
         # Роутинг callback'ов
-        if action == "admin_dashboard":
+        if action.startswith("admin_refresh_"):
+            # «Обновить» на экранах дашборда: пересчитать снимок, не дожидаясь TTL
+            view, _, days = action[len("admin_refresh_"):].partition("_")
+            days = int(days) if days.isdigit() else 7
+            if view == "dashboard":
+                await show_admin_dashboard(callback.message, db, logger_service, user_id, days, force=True)
+            elif view == "retention":
+                await show_admin_retention(callback.message, db, logger_service, user_id, force=True)
+            elif view == "funnel":
+                await show_admin_funnel(callback.message, db, logger_service, user_id, days, force=True)
+            elif view == "value":
+                await show_admin_value(callback.message, db, logger_service, user_id, days, force=True)
+        
+        elif action == "admin_dashboard":
             await show_admin_dashboard(callback.message, db, logger_service, user_id, 7)
         elif action.startswith("admin_dashboard_"):
             try:
@@ -236,6 +255,23 @@ def make_admin_callback_handler(db: Database, logger_service: LoggingService):
 
         elif action == "admin_author_test":
             await show_admin_author_test_stats(callback.message, db, logger_service, user_id)
+
+        elif action == "admin_cohorts":
+            await show_admin_cohorts(callback.message, db, logger_service, user_id)
+
+        elif action == "admin_slow_queries":
+            await show_admin_slow_queries(callback.message, db, logger_service, user_id)
+        elif action == "admin_slow_queries_reset":
+            if getattr(db, "profiler", None) is not None:
+                db.profiler.reset()
+            await show_admin_slow_queries(callback.message, db, logger_service, user_id)
+
+        elif action == "admin_perf":
+            await show_admin_perf(callback.message, db, logger_service, user_id)
+        elif action == "admin_perf_reset":
+            if getattr(db, "update_metrics", None) is not None:
+                db.update_metrics.reset()
+            await show_admin_perf(callback.message, db, logger_service, user_id)
         
         elif action == "admin_back" or action == "admin_main":
             await show_admin_main_menu(callback.message, db, logger_service, user_id)
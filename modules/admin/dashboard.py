@@ -2,10 +2,12 @@
 Модуль дашбордов и метрик для админской панели.
 Содержит функции отображения различных метрик и статистики.
 """
+import asyncio
 import logging
 from aiogram import types
 from aiogram.exceptions import TelegramBadRequest
 from database.db import Database
+from database.async_db import call_db
 from modules.logging_service import LoggingService
 
 try:
@@ -15,8 +17,35 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Периоды, которые фоновая задача держит тёплыми: ровно те, что предлагают кнопки.
+HOT_WINDOWS = (1, 7, 30)
+DEFAULT_WARM_SEC = 240
 
-async def show_admin_dashboard(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7):
+
+def _as_of_line(summary) -> str:
+    """Подпись «данные на …» для экранов, собранных из снимков метрик."""
+    as_of = summary.get('as_of')
+    return f"\n\n🕒 <i>данные на {as_of.strftime('%H:%M:%S')}</i>" if as_of else ""
+
+
+async def keep_dashboard_warm(db: Database, interval_sec: float = DEFAULT_WARM_SEC):
+    """
+    Фоновая задача main.py: пересчитывает снимки HOT_WINDOWS раньше, чем истечёт
+    их TTL, чтобы админ не ждал расчёта при открытии дашборда.
+    """
+    while True:
+        for days in HOT_WINDOWS:
+            try:
+                await call_db(db, "get_admin_dashboard_summary", days, True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Dashboard warm-up failed for {days} days: {e}", exc_info=True)
+        await asyncio.sleep(interval_sec)
+
+
+async def show_admin_dashboard(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7,
+                               force: bool = False):
     """Показывает главный дашборд с ключевыми метриками."""
     # ЖЕСТКАЯ ПРОВЕРКА ПРАВ АДМИНИСТРАТОРА
     try:
@@ -32,7 +61,7 @@ async def show_admin_dashboard(message: types.Message, db: Database, logger_serv
     
     try:
         # Получаем сводку метрик (оптимизировано - все данные в одном запросе)
-        summary = db.get_admin_dashboard_summary(days)
+        summary = await call_db(db, "get_admin_dashboard_summary", days, force)
         
         if not summary:
             text = "❌ Ошибка при получении данных дашборда"
@@ -79,6 +108,7 @@ async def show_admin_dashboard(message: types.Message, db: Database, logger_serv
 🃏 <b>Колоды:</b>
 • 🌿 Природа: {summary['deck_popularity']['decks'].get('nature', {}).get('percentage', 0)}%
 • 💌 Весточка: {summary['deck_popularity']['decks'].get('message', {}).get('percentage', 0)}%"""
+        text += _as_of_line(summary)
         
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
             [
@@ -86,7 +116,7 @@ async def show_admin_dashboard(message: types.Message, db: Database, logger_serv
                 types.InlineKeyboardButton(text="7 дней", callback_data="admin_dashboard_7"),
                 types.InlineKeyboardButton(text="30 дней", callback_data="admin_dashboard_30")
             ],
-            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_dashboard_{days}")],
+            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_refresh_dashboard_{days}")],
             [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")]
         ])
         
@@ -110,7 +140,8 @@ async def show_admin_dashboard(message: types.Message, db: Database, logger_serv
                 raise
 
 
-async def show_admin_retention(message: types.Message, db: Database, logger_service: LoggingService, user_id: int):
+async def show_admin_retention(message: types.Message, db: Database, logger_service: LoggingService, user_id: int,
+                               force: bool = False):
     """Показывает метрики удержания."""
     # ЖЕСТКАЯ ПРОВЕРКА ПРАВ АДМИНИСТРАТОРА
     try:
@@ -126,7 +157,7 @@ async def show_admin_retention(message: types.Message, db: Database, logger_serv
     
     try:
         # Получаем все метрики одним запросом (оптимизировано)
-        summary = db.get_admin_dashboard_summary(7)
+        summary = await call_db(db, "get_admin_dashboard_summary", 7, force)
         retention = summary['retention']
         dau = summary['dau']
         
@@ -144,9 +175,10 @@ async def show_admin_retention(message: types.Message, db: Database, logger_serv
 • Вчера: {dau['dau_yesterday']}
 • Среднее за 7 дней: {dau['dau_7']}
 • Среднее за 30 дней: {dau['dau_30']}"""
+        text += _as_of_line(summary)
         
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_retention")],
+            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh_retention")],
             [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")]
         ])
         
@@ -170,7 +202,8 @@ async def show_admin_retention(message: types.Message, db: Database, logger_serv
                 raise
 
 
-async def show_admin_funnel(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7):
+async def show_admin_funnel(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7,
+                            force: bool = False):
     """Показывает воронку сценария 'Карта дня'."""
     # ЖЕСТКАЯ ПРОВЕРКА ПРАВ АДМИНИСТРАТОРА
     try:
@@ -186,7 +219,7 @@ async def show_admin_funnel(message: types.Message, db: Database, logger_service
     
     try:
         # Получаем все метрики одним запросом (оптимизировано)
-        summary = db.get_admin_dashboard_summary(days)
+        summary = await call_db(db, "get_admin_dashboard_summary", days, force)
         funnel = summary['funnel']
         
         period_text = {
@@ -207,12 +240,13 @@ async def show_admin_funnel(message: types.Message, db: Database, logger_service
 4️⃣ Написали ассоциацию: {funnel['step4']['count']} ({funnel['step4']['pct']}%)
 5️⃣ Выбрали углубляющий диалог: {funnel['step5']['count']} ({funnel['step5']['pct']}%)
 6️⃣ Завершили сценарий: {funnel['step6']['count']} ({funnel['step6']['pct']}%)"""
+        text += _as_of_line(summary)
         
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text="📅 Сегодня", callback_data="admin_funnel_1")],
             [types.InlineKeyboardButton(text="📅 7 дней", callback_data="admin_funnel_7")],
             [types.InlineKeyboardButton(text="📅 30 дней", callback_data="admin_funnel_30")],
-            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_funnel_{days}")],
+            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_refresh_funnel_{days}")],
             [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")]
         ])
         
@@ -236,7 +270,8 @@ async def show_admin_funnel(message: types.Message, db: Database, logger_service
                 raise
 
 
-async def show_admin_value(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7):
+async def show_admin_value(message: types.Message, db: Database, logger_service: LoggingService, user_id: int, days: int = 7,
+                           force: bool = False):
     """Показывает метрики ценности."""
     # ЖЕСТКАЯ ПРОВЕРКА ПРАВ АДМИНИСТРАТОРА
     try:
@@ -252,7 +287,7 @@ async def show_admin_value(message: types.Message, db: Database, logger_service:
     
     try:
         # Получаем все метрики одним запросом (оптимизировано)
-        summary = db.get_admin_dashboard_summary(days)
+        summary = await call_db(db, "get_admin_dashboard_summary", days, force)
         value = summary['value']
         
         # Определяем период для отображения
@@ -269,6 +304,7 @@ async def show_admin_value(message: types.Message, db: Database, logger_service:
 • Позитивные отзывы: {value['feedback_score']}%
 • Всего отзывов: {value['total_feedback']}
 • Цель: ≥50%"""
+        text += _as_of_line(summary)
         
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
             [
@@ -276,7 +312,7 @@ async def show_admin_value(message: types.Message, db: Database, logger_service:
                 types.InlineKeyboardButton(text="7 дней", callback_data="admin_value_7"),
                 types.InlineKeyboardButton(text="30 дней", callback_data="admin_value_30")
             ],
-            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_value_{days}")],
+            [types.InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_refresh_value_{days}")],
             [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")]
         ])
         
@@ -316,7 +352,7 @@ async def show_admin_decks(message: types.Message, db: Database, logger_service:
     
     try:
         # Получаем метрики популярности колод
-        deck_metrics = db.get_deck_popularity_metrics(days)
+        deck_metrics = await call_db(db, "get_deck_popularity_metrics", days)
         
         if not deck_metrics or not deck_metrics.get('decks'):
             text = "❌ Нет данных о колодах за указанный период"
@@ -401,7 +437,7 @@ async def show_admin_reflections(message: types.Message, db: Database, logger_se
     
     try:
         # Получаем метрики вечерней рефлексии
-        metrics = db.get_evening_reflection_metrics(days)
+        metrics = await call_db(db, "get_evening_reflection_metrics", days)
         
         if not metrics:
             text = "❌ Нет данных о рефлексиях за указанный период"
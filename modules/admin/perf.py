@@ -0,0 +1,102 @@
+"""
+Производительность обработки апдейтов: самые медленные хендлеры, состояния и кнопки
+по данным метрик апдейтов (modules/update_metrics.py), плюс состояние кэшей и хранилищ.
+
+Открывается кнопкой в админке и командой /perf.
+"""
+import html
+import logging
+import os
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from database.db import Database
+from modules.logging_service import LoggingService
+
+logger = logging.getLogger(__name__)
+
+TOP_HANDLERS = 8
+TOP_KEYS = 5
+
+
+def _line(item: dict) -> str:
+    return (f"• <code>{html.escape(item['key'])}</code> — p50 {item['p50']:.0f} / p95 {item['p95']:.0f} / "
+            f"p99 {item['p99']:.0f} мс, n={item['count']}, SQL {item['avg_statements']}, API {item['avg_api_calls']}"
+            + (f", ошибок {item['errors']}" if item["errors"] else "") + "\n")
+
+
+def build_perf_text(db: Database) -> str:
+    metrics = getattr(db, "update_metrics", None)
+    if metrics is None:
+        return "⏱ <b>ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n\nМетрики апдейтов не подключены."
+
+    text = (f"⏱ <b>ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n<i>апдейтов: {metrics.updates}, окно — последние "
+            f"{metrics.window} на ключ; SQL и API — среднее на апдейт</i>\n\n")
+    sections = (("handler", "🐢 Хендлеры по p95", TOP_HANDLERS),
+                ("state", "🧭 Состояния FSM", TOP_KEYS),
+                ("callback", "🔘 Кнопки (префикс callback_data)", TOP_KEYS))
+    for group, title, limit in sections:
+        items = metrics.top(group, limit)
+        if items:
+            text += f"<b>{title}:</b>\n" + "".join(_line(item) for item in items) + "\n"
+    if not metrics.updates:
+        text += "Апдейтов ещё не было.\n\n"
+
+    sources = metrics.source_stats()
+    if sources:
+        text += "📦 <b>Кэши и хранилища:</b>\n"
+        for name, stats in sources.items():
+            shown = ", ".join(f"{key}={value}" for key, value in stats.items() if not isinstance(value, (dict, list)))
+            text += f"• <b>{html.escape(name)}</b>: {html.escape(shown)}\n"
+    backup = getattr(db, "last_backup", None)
+    if backup:
+        text += (f"• <b>backup</b>: {html.escape(os.path.basename(backup.get('file') or '—'))}, "
+                 f"{backup.get('duration_ms', 0):.0f} мс, integrity={html.escape(str(backup.get('integrity')))}\n")
+    return text
+
+
+async def show_admin_perf(message: types.Message, db: Database, logger_service: LoggingService, user_id: int,
+                          edit: bool = True):
+    """Показывает сводку метрик апдейтов. edit=False — новым сообщением (команда /perf)."""
+    try:
+        from config import ADMIN_IDS
+        if str(user_id) not in ADMIN_IDS:
+            await (message.edit_text if edit else message.answer)("🚫 ДОСТУП ЗАПРЕЩЕН! У вас нет прав администратора.")
+            logger.warning(f"BLOCKED: User {user_id} attempted to access perf metrics")
+            return
+    except ImportError as e:
+        logger.error(f"CRITICAL: Failed to import ADMIN_IDS: {e}")
+        await (message.edit_text if edit else message.answer)("🚫 КРИТИЧЕСКАЯ ОШИБКА БЕЗОПАСНОСТИ")
+        return
+
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_perf")],
+        [types.InlineKeyboardButton(text="🧹 Сбросить статистику", callback_data="admin_perf_reset")],
+        [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")]
+    ])
+    try:
+        text = build_perf_text(db)[:4090]
+        if edit:
+            try:
+                await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+        else:
+            await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+        await logger_service.log_action(user_id, "admin_perf_viewed", {})
+
+    except Exception as e:
+        logger.error(f"Error showing perf metrics: {e}", exc_info=True)
+        try:
+            await (message.edit_text if edit else message.answer)("❌ Ошибка при загрузке метрик")
+        except TelegramBadRequest:
+            pass
+
+
+def make_perf_handler(db: Database, logger_service: LoggingService):
+    """Создает обработчик для команды /perf."""
+    async def perf_handler(message: types.Message):
+        await show_admin_perf(message, db, logger_service, message.from_user.id, edit=False)
+
+    return perf_handler
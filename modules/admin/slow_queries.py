@@ -0,0 +1,115 @@
+"""
+Медленные запросы к базе: что тормозит, по данным профилировщика (database/profiler.py).
+
+Профилировщик включается переменной окружения DB_PROFILE=1. Без неё раздел только
+подсказывает, как его включить: обёртки и трассировка стоят времени, держать их
+постоянно незачем.
+
+Экран собирается целыми строками под лимит сообщения Telegram. Раньше готовый HTML
+обрезался срезом text[:4090]: срез мог прийтись на середину <code>…</code> или
+сущности &lt;, Telegram отвечал «can't parse entities», и вместо отчёта админ
+видел ошибку. Теперь строка, которая не влезает, не добавляется, а в конце
+раздела пишется «…и ещё N».
+"""
+import html
+import logging
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from database.db import Database
+from modules.logging_service import LoggingService
+
+logger = logging.getLogger(__name__)
+
+TOP_METHODS = 8
+TOP_STATEMENTS = 5
+SQL_PREVIEW = 180
+MESSAGE_LIMIT = 4096
+
+
+def _append_rows(text: str, rows: list[str]) -> str:
+    """Дописывает строки раздела целиком, пока сообщение влезает в лимит; остаток — «…и ещё N»."""
+    for n, row in enumerate(rows):
+        left_after = len(rows) - n - 1
+        reserve = len(f"<i>…и ещё {left_after}</i>\n") if left_after else 0
+        if len(text) + len(row) + reserve > MESSAGE_LIMIT:
+            return text + f"<i>…и ещё {len(rows) - n}</i>\n"
+        text += row
+    return text
+
+
+async def show_admin_slow_queries(message: types.Message, db: Database, logger_service: LoggingService, user_id: int):
+    """Показывает самые дорогие методы Database и самые медленные запросы с планами."""
+    try:
+        from config import ADMIN_IDS
+        if str(user_id) not in ADMIN_IDS:
+            await message.edit_text("🚫 ДОСТУП ЗАПРЕЩЕН! У вас нет прав администратора.", parse_mode="HTML")
+            logger.warning(f"BLOCKED: User {user_id} attempted to access slow queries")
+            return
+    except ImportError as e:
+        logger.error(f"CRITICAL: Failed to import ADMIN_IDS: {e}")
+        await message.edit_text("🚫 КРИТИЧЕСКАЯ ОШИБКА БЕЗОПАСНОСТИ", parse_mode="HTML")
+        return
+
+    try:
+        profiler = getattr(db, "profiler", None)
+        if profiler is None:
+            text = ("🐢 <b>МЕДЛЕННЫЕ ЗАПРОСЫ</b>\n\n"
+                    "Профилировщик выключен.\n"
+                    "<i>Включается переменной окружения DB_PROFILE=1 (порог — DB_PROFILE_THRESHOLD_MS, "
+                    "запись в query_stats — DB_PROFILE_PERSIST=1) и перезапуском бота.</i>")
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")]
+            ])
+        else:
+            text = f"🐢 <b>МЕДЛЕННЫЕ ЗАПРОСЫ</b>\n<i>порог {profiler.threshold_ms:.0f} мс, с момента запуска или сброса</i>\n\n"
+
+            methods = profiler.top_methods(TOP_METHODS)
+            if methods:
+                text += "⏱ <b>Методы по суммарному времени:</b>\n"
+                text = _append_rows(text, [
+                    f"• <code>{m['method']}</code> — {m['total_ms']:.0f} мс всего, "
+                    f"{m['calls']} выз., ср. {m['avg_ms']:.1f}, макс. {m['max_ms']:.0f}\n"
+                    for m in methods])
+            else:
+                text += "Вызовов ещё не было.\n"
+
+            slowest = profiler.slowest(TOP_STATEMENTS)
+            if slowest:
+                text += "\n🔎 <b>Самые медленные запросы:</b>\n"
+                rows = []
+                for st in slowest:
+                    sql = st["sql"] if len(st["sql"]) <= SQL_PREVIEW else st["sql"][:SQL_PREVIEW] + "…"
+                    row = f"\n<b>{st['ms']:.0f} мс</b> · <code>{st['method']}</code> · {st['at']}"
+                    if st["rows"] is not None:
+                        row += f" · строк: {st['rows']}"
+                    row += f"\n<code>{html.escape(sql)}</code>\n"
+                    if st["plan"]:
+                        row += f"<i>план:</i> <code>{html.escape(st['plan'][:300])}</code>\n"
+                    rows.append(row)
+                text = _append_rows(text, rows)
+            else:
+                text += "\nЗапросов дольше порога не было. 👍"
+
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_slow_queries")],
+                [types.InlineKeyboardButton(text="🧹 Сбросить статистику", callback_data="admin_slow_queries_reset")],
+                [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")]
+            ])
+
+        try:
+            await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        await logger_service.log_action(user_id, "admin_slow_queries_viewed", {})
+
+    except Exception as e:
+        logger.error(f"Error showing slow queries: {e}", exc_info=True)
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")]
+        ])
+        try:
+            await message.edit_text("❌ Ошибка при загрузке медленных запросов", reply_markup=keyboard)
+        except TelegramBadRequest:
+            pass
@@ -11,6 +11,7 @@ from aiogram import types
 from aiogram.exceptions import TelegramBadRequest
 
 from database.db import Database
+from database.async_db import call_db, run_db_read
 from modules.logging_service import LoggingService
 from modules.constants import BOT_INITIATED_ACTIONS
 
@@ -180,7 +181,8 @@ async def show_admin_user_segments(message: types.Message, db: Database, logger_
         return
 
     try:
-        s = get_user_segments(db)
+        # Самый тяжёлый отчёт админки: считаем в потоке-читателе, чтобы не стопорить бота.
+        s = await run_db_read(db, get_user_segments)
         seg = s["segments"]
         total = s["total"] or 1
 
@@ -192,7 +194,7 @@ async def show_admin_user_segments(message: types.Message, db: Database, logger_
 
         # Сколько из сегмента реально получит рассылку. Считаем один раз на весь
         # отчёт, чтобы не дёргать базу на каждый сегмент.
-        unreachable = db.get_unreachable_user_ids()
+        unreachable = await call_db(db, "get_unreachable_user_ids")
 
         def mailable(name: str) -> str:
             ids = [r["user_id"] for r in seg[name]]
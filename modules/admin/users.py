@@ -208,12 +208,9 @@ async def show_admin_users_list(message: types.Message, db: Database, logger_ser
                 # Получаем последнее действие ЧЕЛОВЕКА: отправку напоминания и показ
                 # приглашения инициирует бот, и без фильтра у всех адресатов утренней
                 # рассылки «последним действием» становится одно и то же время.
-                user_actions = [
-                    a for a in db.get_actions(uid)
-                    if a.get("action") not in BOT_INITIATED_ACTIONS
-                ]
-                if user_actions:
-                    last_action = user_actions[-1]
+                last_action = next(db.iter_actions(uid, columns=("timestamp",), exclude_actions=BOT_INITIATED_ACTIONS,
+                                                   newest_first=True, page_size=1), None)
+                if last_action:
                     raw_timestamp = last_action.get("timestamp")
                     try:
                         if isinstance(raw_timestamp, datetime):
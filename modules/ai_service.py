@@ -703,7 +703,9 @@ async def build_user_profile(user_id, db: Database):
     logger.info(f"Rebuilding profile for user {user_id} (Cache expired or profile missing/invalid)")
     base_profile_data = profile_data if profile_data else {"user_id": user_id}
 
-    actions = db.get_actions(user_id)
+    # Поток без id/username/name; details разбирается только у строк с ответами и ресурсом
+    actions = db.iter_actions(user_id, columns=("action", "details", "timestamp"))
+    has_actions = False
     reflection_texts_list = db.get_all_reflection_texts(user_id)
     last_recharge_method = db.get_last_recharge_method(user_id)
     last_reflection_date_obj = db.get_last_reflection_date(user_id)
@@ -716,15 +718,19 @@ async def build_user_profile(user_id, db: Database):
     last_initial_resource = base_profile_data.get("initial_resource")
     last_final_resource = base_profile_data.get("final_resource")
 
+    relevant_response_actions = [
+        "initial_response_provided", "grok_response_provided",
+        "initial_response", "first_grok_response",
+        "second_grok_response", "third_grok_response"
+    ]
     for action in actions:
-        details = action.get("details", {})
+        has_actions = True
         action_type = action.get("action", "")
+        if action_type in relevant_response_actions or action_type in ("initial_resource_selected", "final_resource_selected"):
+            details = action.get("details", {})
+        else:
+            details = {}
 
-        relevant_response_actions = [
-            "initial_response_provided", "grok_response_provided",
-            "initial_response", "first_grok_response",
-            "second_grok_response", "third_grok_response"
-        ]
         if action_type in relevant_response_actions and "response" in details:
             response_text = details["response"]
             if isinstance(response_text, str):
@@ -762,7 +768,7 @@ async def build_user_profile(user_id, db: Database):
         else:
              logger.warning(f"Skipping action due to invalid timestamp type: {type(raw_timestamp)} in action: {action.get('action')}")
 
-    if not actions and not reflection_count and not total_cards_drawn and not base_profile_data.get("last_updated"):
+    if not has_actions and not reflection_count and not total_cards_drawn and not base_profile_data.get("last_updated"):
         logger.info(f"No actions or other data for user {user_id}. Creating empty profile.")
         empty_profile = {
             "user_id": user_id, "mood": "unknown", "mood_trend": [], "themes": ["не определено"],
@@ -1491,12 +1497,12 @@ async def get_integrated_reflection_summary(user_id: int, reflection_data: dict,
     
     # Получаем ответы пользователя на карту дня (если были)
     card_responses = []
-    actions = db.get_actions(user_id)
+    actions = db.iter_actions(user_id, actions=("initial_response_provided", "grok_response_provided"),
+                              columns=("details",))
     for action in actions:
-        if action.get("action") in ["initial_response_provided", "grok_response_provided"]:
-            response = action.get("details", {}).get("response", "")
-            if response and isinstance(response, str):
-                card_responses.append(response)
+        response = action.get("details", {}).get("response", "")
+        if response and isinstance(response, str):
+            card_responses.append(response)
     
     card_responses_text = ""
     if card_responses:
@@ -50,5 +50,6 @@ class LoggingService:
 
     def get_logs_for_today(self):
         today = datetime.now(TIMEZONE).date()
-        logs = self.db.get_actions()
+        since = datetime.combine(today, datetime.min.time())
+        logs = self.db.get_actions(since=TIMEZONE.localize(since) if TIMEZONE else since)
         return [log for log in logs if datetime.fromisoformat(log["timestamp"]).astimezone(TIMEZONE).date() == today]
@@ -14,6 +14,7 @@ from aiogram.exceptions import (
 
 # Импортируем функцию для получения меню
 from modules.card_of_the_day import get_main_menu
+from database.async_db import call_db
 
 # Сколько ещё пытаться достучаться после сетевого сбоя. 11.08.2026 сеть контейнера
 # лежала час подряд (10:00:31–11:01:51) и унесла две пачки напоминаний целиком —
@@ -57,7 +58,7 @@ class NotificationService:
         # незачем, к моменту подъёма напоминание всё равно уже неактуально.
         self._pending = {}
 
-    def _log_reminder(self, user_id: int, kind: str, ok: bool, error: str = None,
+    async def _log_reminder(self, user_id: int, kind: str, ok: bool, error: str = None,
                       attempts: int = 1, delayed_minutes: int = 0):
         """
         Пишет итог отправки напоминания в actions.
@@ -69,7 +70,10 @@ class NotificationService:
         адресата делал бы лишний запрос к Telegram API.
 
         Запись делается один раз, по итогу всех попыток, иначе одно напоминание
-        считалось бы в статистике несколько раз.
+        считалось бы в статистике несколько раз. Тем же итогом обновляется признак
+        доступности пользователя для рассылок (database/reachability.py). Его upsert
+        коммитится сразу, поэтому идёт через call_db в поток записи db.aio, как в
+        PostManager, а не синхронно в event loop на каждого адресата.
         """
         try:
             details = {"kind": kind, "status": "sent" if ok else "failed"}
@@ -83,6 +87,7 @@ class NotificationService:
                 user_id, "", "", "reminder_sent", details,
                 datetime.now(TIMEZONE).isoformat(),
             )
+            await call_db(self.db, "record_reachability", user_id, details["status"], details.get("error"))
         except Exception as e:
             self.logger.warning(f"Failed to log reminder for user {user_id}: {e}")
 
@@ -108,7 +113,7 @@ class NotificationService:
         error = await self._try_send(user_id, text)
         if error is None:
             self.logger.info(f"{kind.capitalize()} reminder sent to user {user_id} at {now}")
-            self._log_reminder(user_id, kind, True)
+            await self._log_reminder(user_id, kind, True)
             return
 
         if _is_temporary(error):
@@ -124,7 +129,7 @@ class NotificationService:
             return
 
         self.logger.error(f"Failed to send {kind.upper()} reminder to user {user_id}: {error}")
-        self._log_reminder(user_id, kind, False, error)
+        await self._log_reminder(user_id, kind, False, error)
 
     async def _flush_pending(self, now: datetime):
         """
@@ -138,7 +143,7 @@ class NotificationService:
 
             # Пока напоминание ждало сети, человек мог сам вытянуть карту. Звать его
             # за тем, что он уже сделал, не нужно — молча снимаем с очереди.
-            if kind == "morning" and not self.db.is_card_available(user_id, day):
+            if kind == "morning" and not await call_db(self.db, "is_card_available", user_id, day):
                 self.logger.info(
                     f"Morning reminder to user {user_id} dropped: card already drawn")
                 del self._pending[key]
@@ -152,16 +157,16 @@ class NotificationService:
                 self.logger.info(
                     f"{kind.capitalize()} reminder delivered to user {user_id} "
                     f"after {item['attempts']} attempts ({delayed} min late)")
-                self._log_reminder(user_id, kind, True,
-                                   attempts=item["attempts"], delayed_minutes=delayed)
+                await self._log_reminder(user_id, kind, True,
+                                         attempts=item["attempts"], delayed_minutes=delayed)
                 del self._pending[key]
                 continue
 
             if not _is_temporary(error):
                 # Сеть вернулась, но человек недоступен: блокировка или удалённый аккаунт.
                 self.logger.error(f"Failed to send {kind.upper()} reminder to user {user_id}: {error}")
-                self._log_reminder(user_id, kind, False, error,
-                                   attempts=item["attempts"], delayed_minutes=delayed)
+                await self._log_reminder(user_id, kind, False, error,
+                                         attempts=item["attempts"], delayed_minutes=delayed)
                 del self._pending[key]
                 continue
 
@@ -170,8 +175,8 @@ class NotificationService:
                 self.logger.error(
                     f"Giving up on {kind.upper()} reminder to user {user_id} "
                     f"after {item['attempts']} attempts over {delayed} min: {error}")
-                self._log_reminder(user_id, kind, False, error,
-                                   attempts=item["attempts"], delayed_minutes=delayed)
+                await self._log_reminder(user_id, kind, False, error,
+                                         attempts=item["attempts"], delayed_minutes=delayed)
                 del self._pending[key]
 
     async def _process_minute(self, moment: datetime):
@@ -184,7 +189,9 @@ class NotificationService:
         """
         current_time_str = moment.strftime("%H:%M")
         today = moment.date()
-        reminders_data = self.db.get_reminder_times() # {user_id: {'morning': t1, 'evening': t2}}
+        # {user_id: {'morning': t1, 'evening': t2}}. Запрос идёт в потоке (db.aio), чтобы
+        # проход по напоминаниям не стопорил ответы пользователям.
+        reminders_data = await call_db(self.db, "get_reminder_times")
 
         for user_id, times in reminders_data.items():
             morning_time = times.get('morning')
@@ -192,10 +199,10 @@ class NotificationService:
             if morning_time != current_time_str and evening_time != current_time_str:
                 continue
 
-            name = (self.db.get_user(user_id) or {}).get("name", "")
+            name = (await call_db(self.db, "get_user", user_id) or {}).get("name", "")
 
             # Проверка утреннего напоминания (Карта Дня)
-            if morning_time == current_time_str and self.db.is_card_available(user_id, today):
+            if morning_time == current_time_str and await call_db(self.db, "is_card_available", user_id, today):
                 text = f"{name}, привет! Пришло время вытянуть свою карту дня. ✨ Изменить настройки напоминаний: /remind, /remind_off" if name else "Привет! Пришло время вытянуть свою карту дня. ✨ Изменить настройки напоминаний: /remind, /remind_off"
                 # Отправляем с клавиатурой, чтобы сразу можно было нажать
                 await self._send_reminder(user_id, "morning", text, moment)
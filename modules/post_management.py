@@ -10,6 +10,8 @@ from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.enums import ParseMode
 import logging
 
+from database.async_db import call_db
+
 logger = logging.getLogger(__name__)
 
 # Московское время
@@ -119,7 +121,8 @@ class PostManager:
             
             # Логируем успешную отправку
             if mailing_id:
-                self.db.log_mailing_result(mailing_id, user_id, 'sent')
+                await call_db(self.db, "log_mailing_result", mailing_id, user_id, 'sent')
+            await call_db(self.db, "record_reachability", user_id, 'sent')
             
             return True
             
@@ -131,14 +134,16 @@ class PostManager:
                 status = 'failed'
             
             if mailing_id:
-                self.db.log_mailing_result(mailing_id, user_id, status, error_msg)
+                await call_db(self.db, "log_mailing_result", mailing_id, user_id, status, error_msg)
+            await call_db(self.db, "record_reachability", user_id, status, error_msg)
             
             logger.error(f"Failed to send post to user {user_id}: {e}")
             return False
             
         except Exception as e:
             if mailing_id:
-                self.db.log_mailing_result(mailing_id, user_id, 'failed', str(e))
+                await call_db(self.db, "log_mailing_result", mailing_id, user_id, 'failed', str(e))
+            await call_db(self.db, "record_reachability", user_id, 'failed', str(e))
             logger.error(f"Unexpected error sending post to user {user_id}: {e}")
             return False
     
@@ -151,17 +156,17 @@ class PostManager:
         }
         
         # Обновляем статус на "в процессе"
-        self.db.update_mailing_status(mailing_id, 'in_progress')
+        await call_db(self.db, "update_mailing_status", mailing_id, 'in_progress')
         
         # Определяем список получателей
         if mailing['send_to_all']:
-            users = self.db.get_all_users()
+            users = await call_db(self.db, "get_all_users")
             target_user_ids = users  # get_all_users() уже возвращает список user_id
         else:
             target_user_ids = mailing.get('target_user_ids', [])
         
         if not target_user_ids:
-            self.db.update_mailing_status(mailing_id, 'failed')
+            await call_db(self.db, "update_mailing_status", mailing_id, 'failed')
             return {'sent': 0, 'failed': 0, 'total': 0}
         
         # Отправляем сообщения
@@ -180,7 +185,7 @@ class PostManager:
         
         # Обновляем статус и счетчики
         status = 'completed' if failed_count == 0 else 'completed'
-        self.db.update_mailing_status(mailing_id, status, sent_count, failed_count)
+        await call_db(self.db, "update_mailing_status", mailing_id, status, sent_count, failed_count)
         
         return {
             'sent': sent_count,
@@ -190,7 +195,7 @@ class PostManager:
     
     async def process_pending_mailings(self) -> Dict[str, int]:
         """Обрабатывает все ожидающие рассылки."""
-        pending_mailings = self.db.get_pending_mailings()
+        pending_mailings = await call_db(self.db, "get_pending_mailings")
         
         if not pending_mailings:
             return {'processed': 0, 'total_sent': 0, 'total_failed': 0}
@@ -0,0 +1,206 @@
+# код/update_metrics.py
+"""
+Метрики апдейтов: сколько идёт обработка от получения до ответа и чего она стоит.
+
+Раньше было неизвестно, сколько занимает хендлер целиком и сколько SQL-запросов
+тянет один апдейт: профилировщик (database/profiler.py) видит только методы
+Database, и то по DB_PROFILE=1.
+
+Теперь на каждый апдейт заводится UpdateRecord:
+  * UpdateMetrics — outer-middleware на dp.update: засекает время от входа до
+    выхода из всей цепочки (фильтры, middleware, хендлер) и берёт состояние FSM,
+    в котором апдейт пришёл;
+  * mark_handler — внутренний middleware на message и callback_query: записывает,
+    какой хендлер сработал;
+  * запросы к базе считает трассировка соединений (database/statement_counter.py),
+    вызовы Telegram API — ApiCallCounter на сессии бота.
+
+Время складывается в скользящие окна последних window значений по трём разрезам:
+хендлер, состояние FSM и префикс callback_data (числа из него выброшены, чтобы
+admin_users_page_3 и admin_users_page_4 были одним ключом). p50/p95/p99 считаются
+по окну при чтении. Сводка — в админке (/perf) и в логе раз в PERF_LOG_MIN минут.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+from aiogram import types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from database import statement_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 500
+DEFAULT_SUMMARY_SEC = 900
+MAX_KEYS = 200  # ключей на разрез; остальное — в OTHER_KEY
+OTHER_KEY = "(прочие)"
+NO_HANDLER = "(без хендлера)"
+NO_STATE = "(без состояния)"
+
+_NUMBER_SEGMENT = re.compile(r"(?<=[_:])-?\d+(?=[_:]|$)")
+_TRAILING_NUMBERS = re.compile(r"([_:]#)+$")
+
+
+def callback_prefix(data: str) -> str:
+    """callback_data без чисел: deck_choice_nature как есть, author_ans:3:1 → author_ans."""
+    prefix = _TRAILING_NUMBERS.sub("", _NUMBER_SEGMENT.sub("#", data))
+    return prefix[:48]
+
+
+def handler_name(callback) -> str:
+    """Имя хендлера, в том числе завёрнутого в functools.partial."""
+    func = getattr(callback, "func", callback)
+    return getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+
+
+class UpdateRecord:
+    __slots__ = ("handler", "statements", "api_calls")
+
+    def __init__(self):
+        self.handler = NO_HANDLER
+        self.statements = 0
+        self.api_calls = 0
+
+
+class Window:
+    """Скользящее окно длительностей одного ключа и суммы запросов за всё время."""
+    __slots__ = ("durations", "count", "total_ms", "statements", "api_calls", "errors")
+
+    def __init__(self, size: int):
+        self.durations = deque(maxlen=size)
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = 0
+        self.api_calls = 0
+        self.errors = 0
+
+    def add(self, ms: float, record: UpdateRecord, failed: bool):
+        self.durations.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        self.statements += record.statements
+        self.api_calls += record.api_calls
+        self.errors += failed
+
+    def summary(self) -> dict:
+        ordered = sorted(self.durations)
+
+        def pct(q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+            "max": round(ordered[-1], 1) if ordered else 0.0,
+            "avg_statements": round(self.statements / self.count, 1) if self.count else 0.0,
+            "avg_api_calls": round(self.api_calls / self.count, 1) if self.count else 0.0,
+            "errors": self.errors,
+        }
+
+
+class ApiCallCounter(BaseRequestMiddleware):
+    """Middleware сессии бота: считает вызовы Telegram API текущего апдейта."""
+
+    async def __call__(self, make_request, bot, method):
+        record = statement_counter.current.get()
+        if record is not None:
+            record.api_calls += 1
+        return await make_request(bot, method)
+
+
+class UpdateMetrics:
+    """Outer-middleware на dp.update и хранилище окон по разрезам."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = window
+        self.groups = {"handler": {}, "state": {}, "callback": {}}
+        self.sources = {}  # имя -> функция без аргументов, отдающая dict для сводки
+        self.updates = 0
+        self.started_at = time.time()
+
+    def add_source(self, name: str, stats):
+        """Подключает к сводке статистику компонента (кэши, хранилище FSM, буфер событий)."""
+        self.sources[name] = stats
+
+    def _add(self, group: str, key: str, ms: float, record: UpdateRecord, failed: bool):
+        windows = self.groups[group]
+        window = windows.get(key)
+        if window is None:
+            if len(windows) >= MAX_KEYS:
+                key = OTHER_KEY
+                window = windows.get(key)
+            if window is None:
+                window = windows[key] = Window(self.window)
+        window.add(ms, record, failed)
+
+    async def __call__(self, handler, event, data):
+        record = UpdateRecord()
+        token = statement_counter.current.set(record)
+        state = data.get("raw_state")
+        callback = event.callback_query.data if isinstance(event, types.Update) and event.callback_query else None
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            statement_counter.current.reset(token)
+            self.updates += 1
+            self._add("handler", record.handler, ms, record, failed)
+            self._add("state", state or NO_STATE, ms, record, failed)
+            if callback:
+                self._add("callback", callback_prefix(callback), ms, record, failed)
+
+    async def mark_handler(self, handler, event, data):
+        """Внутренний middleware: до хендлера известно, какой из них выбран."""
+        record = statement_counter.current.get()
+        handler_object = data.get("handler")
+        if record is not None and handler_object is not None:
+            record.handler = handler_name(handler_object.callback)
+        return await handler(event, data)
+
+    # --- Отчёт ---
+
+    def top(self, group: str, limit: int = 10, key: str = "p95") -> list[dict]:
+        """Ключи разреза, отсортированные по перцентилю key (по умолчанию p95)."""
+        items = [{"key": name, **window.summary()} for name, window in list(self.groups[group].items())]
+        items.sort(key=lambda item: item[key], reverse=True)
+        return items[:limit]
+
+    def source_stats(self) -> dict:
+        stats = {}
+        for name, source in self.sources.items():
+            try:
+                stats[name] = source()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return stats
+
+    def reset(self):
+        for windows in self.groups.values():
+            windows.clear()
+        self.updates = 0
+        self.started_at = time.time()
+
+    def log_summary(self, limit: int = 5):
+        slowest = ", ".join(f"{item['key']} p50={item['p50']} p95={item['p95']} p99={item['p99']} ms"
+                            f" (n={item['count']}, sql={item['avg_statements']}, api={item['avg_api_calls']})"
+                            for item in self.top("handler", limit))
+        logger.info(f"Update metrics: {self.updates} updates; slowest handlers: {slowest or 'none'}")
+        for name, stats in self.source_stats().items():
+            logger.info(f"Update metrics [{name}]: {stats}")
+
+
+async def run_summary_loop(metrics: UpdateMetrics, interval_sec: float = DEFAULT_SUMMARY_SEC):
+    """Фоновая задача main.py: сводка метрик в лог раз в interval_sec."""
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            metrics.log_summary()
+        except Exception as e:
+            logger.error(f"Update metrics summary failed: {e}", exc_info=True)
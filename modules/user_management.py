@@ -67,6 +67,31 @@ class LearnCardsFSM(StatesGroup):
     training_done = State()  # Завершение
 
 
+# Состояния, в которых идёт сессия user_scenarios. Когда запись FSM выбрасывается
+# за простой (database/fsm_storage.py), по её состоянию понятно, какой сценарий
+# закрыть как брошенный: session_id сессии лежит в data.
+SCENARIO_STATES = {
+    "card_of_day": (
+        UserState.waiting_for_deck_choice, UserState.waiting_for_initial_resource,
+        UserState.waiting_for_request_type_choice, UserState.waiting_for_request_text_input,
+        UserState.waiting_for_initial_response, UserState.waiting_for_emotion_choice,
+        UserState.waiting_for_custom_response, UserState.waiting_for_exploration_choice,
+        UserState.waiting_for_first_grok_response, UserState.waiting_for_second_grok_response,
+        UserState.waiting_for_third_grok_response, UserState.waiting_for_final_resource,
+        UserState.waiting_for_recharge_method, UserState.waiting_for_recharge_method_choice,
+    ),
+    "evening_reflection": (
+        UserState.waiting_for_good_moments, UserState.waiting_for_gratitude, UserState.waiting_for_hard_moments,
+    ),
+}
+_SCENARIO_BY_STATE = {state.state: scenario for scenario, states in SCENARIO_STATES.items() for state in states}
+
+
+def scenario_for_state(state: str | None) -> str | None:
+    """Сценарий user_scenarios по строке состояния FSM или None, если состояние не из сессии."""
+    return _SCENARIO_BY_STATE.get(state)
+
+
 class UserManager:
     # --- Код UserManager остается БЕЗ ИЗМЕНЕНИЙ ---
     def __init__(self, db):
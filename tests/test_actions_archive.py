@@ -0,0 +1,175 @@
+"""
+Тест архива actions по месяцам (database/archive.py).
+
+Запуск:  python tests/test_actions_archive.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * старые строки уходят в файлы по месяцам, свежие остаются в actions;
+  * get_actions после архивации отдаёт ровно то же, что и до неё;
+  * iter_actions постранично отдаёт те же строки при любом размере страницы,
+    в обе стороны, включая строки с нераспознанным временем;
+  * запрос за сегодня в архив не заглядывает;
+  * повторный перенос и перенос после сбоя между коммитами ничего не дублируют;
+  * месяц переезжает порциями, и манифест после каждой порции сходится с файлом;
+  * новая база сразу на incremental auto_vacuum и отдаёт свободные страницы;
+  * старую базу compact не трогает (никакого VACUUM на живой базе), её переводит
+    enable_incremental_vacuum.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database, TIMEZONE  # noqa: E402
+from database import archive  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def ids(actions):
+    return [a["id"] for a in actions]
+
+
+def scenario_batches(tmp):
+    print("Перенос порциями")
+    db = Database(os.path.join(tmp, "batches.db"), archive_dir=os.path.join(tmp, "batches"))
+    ts = datetime.now(TIMEZONE) - timedelta(days=200)
+    for n in range(7):
+        db.save_action(n, "user", "Имя", "reminder_sent", {}, (ts + timedelta(minutes=n)).isoformat())
+    db.flush_events()
+    month = ts.strftime("%Y-%m")
+    seen = []
+
+    def manifest():
+        return db.conn.execute("SELECT rows FROM actions_archive WHERE month = ?", (month,)).fetchone()
+
+    # Порция по 3 строки: удаление идёт в трёх отдельных транзакциях
+    db.conn.set_trace_callback(lambda sql: seen.append(sql) if sql.startswith("DELETE FROM actions") else None)
+    try:
+        moved = archive.archive_actions(db.conn, db.archive_dir, 90, batch_rows=3)
+    finally:
+        db.conn.set_trace_callback(None)
+    check("перенесены все строки", moved, 7)
+    check("три порции — три удаления", len(seen), 3)
+    check("манифест сходится с файлом", manifest()[0], 7)
+    arch = sqlite3.connect(os.path.join(db.archive_dir, archive.archive_file(month)))
+    check("в файле месяца 7 строк", arch.execute("SELECT COUNT(*) FROM actions").fetchone()[0], 7)
+    arch.close()
+    db.close()
+
+
+def scenario_legacy_vacuum(tmp):
+    path = os.path.join(tmp, "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?)", [("x" * 2000,)] * 200)
+    conn.commit()
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    check("старая база без auto_vacuum", conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+    check("compact пропускает старую базу", archive.compact(conn), 0)
+    check("и ничего не переписывает", (conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+                                       conn.execute("PRAGMA freelist_count").fetchone()[0]), (0, free))
+    check("перевод выполнен", archive.enable_incremental_vacuum(conn), True)
+    check("после перевода INCREMENTAL", conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+    check("повторный перевод не нужен", archive.enable_incremental_vacuum(conn), False)
+    conn.close()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "archive.db"))
+    now = datetime.now(TIMEZONE)
+    old = [now - timedelta(days=days) for days in (200, 199, 170, 120)]
+    fresh = [now - timedelta(days=10), now]
+    for user_id in (1, 2):
+        for ts in old + fresh:
+            db.save_action(user_id, "user", "Имя", "reminder_sent", {"pad": "x" * 2000}, ts.isoformat())
+
+    before_all = ids(db.get_actions())
+    before_user = db.get_actions(1)
+    months = {ts.strftime("%Y-%m") for ts in old}
+
+    print("Перенос в архив")
+    check("перенесены строки старше 90 дней", db.archive_actions(90), 2 * len(old))
+    check("в actions остались свежие",
+          db.conn.execute("SELECT COUNT(*) FROM actions").fetchone()[0], 2 * len(fresh))
+    check("по файлу на месяц", sorted(os.listdir(db.archive_dir)),
+          sorted(archive.archive_file(m) for m in months))
+    check("манифест", db.conn.execute("SELECT SUM(rows) FROM actions_archive").fetchone()[0], 2 * len(old))
+
+    print("Прозрачное чтение")
+    check("get_actions() как до архивации", ids(db.get_actions()), before_all)
+    check("get_actions(user) как до архивации", db.get_actions(1), before_user)
+    day_start = TIMEZONE.localize(datetime.combine(now.date(), datetime.min.time()))
+    check("сегодня — без архива",
+          archive.read_archived(db.conn, db.archive_dir, since_epoch=int(day_start.timestamp())), [])
+    check("логи за сегодня", len(db.get_actions(since=day_start)), 2)
+    window = db.get_actions(2, since=now - timedelta(days=180), until=now - timedelta(days=100))
+    check("период внутри архива", len(window), 2)
+
+    print("Повторный перенос и сбой")
+    check("повтор ничего не переносит", db.archive_actions(90), 0)
+    # Сбой между коммитами: строка уже в архиве, но не удалена из actions
+    row = db.conn.execute(f"SELECT {archive.COLUMNS} FROM actions ORDER BY id LIMIT 1").fetchone()
+    month = db.conn.execute("SELECT substr(d_local, 1, 7) FROM actions WHERE id = ?", (row["id"],)).fetchone()[0]
+    arch = sqlite3.connect(os.path.join(db.archive_dir, archive.archive_file(month)))
+    arch.executescript(archive.ARCHIVE_SCHEMA_SQL)
+    with arch:
+        arch.execute(f"INSERT INTO actions ({archive.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", tuple(row))
+    arch.close()
+    db.archive_actions(-1)
+    check("после сбоя и полного переноса — без дублей", ids(db.get_actions()), before_all)
+
+    print("Освобождение места")
+    check("auto_vacuum=INCREMENTAL", db.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+    check("свободных страниц не осталось", db.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+    scenario_legacy_vacuum(tmp)
+
+    print("Постраничное чтение")
+    # Нераспознанное время: ts_epoch = NULL, такие строки идут первыми
+    for _ in range(3):
+        db.save_action(1, "user", "Имя", "broken_ts", {}, "вчера")
+    db.save_action(1, "user", "Имя", "card_drawn_direct", {"deck": "nature"}, now.isoformat())
+    everything = ids(db.iter_actions(page_size=1000))
+    check("все строки, архив и основная база", len(everything), len(before_all) + 4)
+    for size in (1, 2, 3):
+        check(f"страницы по {size}", ids(db.iter_actions(page_size=size)), everything)
+        check(f"от новых к старым по {size}", ids(db.iter_actions(newest_first=True, page_size=size)),
+              everything[::-1])
+    check("только выбранные колонки", list(next(db.iter_actions(columns=("action", "timestamp")))),
+          ["action", "timestamp"])
+    check("фильтр по типам", [a["action"] for a in db.iter_actions(1, actions=["card_drawn_direct"], page_size=1)],
+          ["card_drawn_direct"])
+    check("последнее действие человека",
+          next(db.iter_actions(1, exclude_actions=["reminder_sent"], newest_first=True, page_size=1))["action"],
+          "card_drawn_direct")
+    check("после id", ids(db.iter_actions(after_id=everything[-3], page_size=1)),
+          [i for i in everything if i > everything[-3]])
+
+    db.close()
+    scenario_batches(tmp)
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
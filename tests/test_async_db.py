@@ -0,0 +1,148 @@
+"""
+Тест асинхронного фасада базы (database/async_db.py).
+
+Запуск:  python tests/test_async_db.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * запрос через db.aio не выполняется в потоке event loop — ради этого всё и делалось;
+  * чтение идёт с read-only соединения, запись — в единственном потоке-писателе;
+  * get_user для нового пользователя создаёт запись (он пишет, хоть и называется get_);
+  * пока идёт долгий запрос, event loop продолжает обслуживать другие задачи;
+  * call_db без фасада работает синхронно, как раньше (так устроены подставные базы в тестах);
+  * представления потоков видят текущие db.events и кэши: раньше они были copy.copy
+    и после db.events = None при остановке продолжали писать в остановленный буфер.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database.async_db import AsyncDatabase, call_db, run_db_read  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def thread_of(db):
+    return threading.current_thread().name
+
+
+def slow_read(db, seconds):
+    time.sleep(seconds)
+    return db.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def write_on_reader(db):
+    try:
+        db.conn.execute("INSERT INTO users (user_id, name) VALUES (999, 'x')")
+        return "записано"
+    except Exception:
+        return "отказ"
+
+
+async def scenario(db, adb):
+    print("Потоки")
+    loop_thread = threading.current_thread().name
+    reader = await adb.run_read(thread_of)
+    writer = await adb.run_write(thread_of)
+    check("чтение не в потоке event loop", reader != loop_thread, True)
+    check("чтение в пуле читателей", reader.startswith("db-read"), True)
+    check("запись в потоке-писателе", writer.startswith("db-write"), True)
+
+    print("Чтение и запись")
+    user = await adb.get_user(101)
+    check("get_user создал нового пользователя", user["user_id"], 101)
+    check("запись видна основному соединению", db.get_user(101)["user_id"], 101)
+    await adb.update_user(101, {"name": "Аня"})
+    check("чтение с пула видит запись писателя", (await adb.get_all_users()).count(101), 1)
+    check("на read-only соединении запись невозможна", await adb.run_read(write_on_reader), "отказ")
+
+    print("Event loop не блокируется")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    t = asyncio.create_task(ticker())
+    count = await run_db_read(db, slow_read, 0.3)
+    t.cancel()
+    check("долгий запрос вернул результат", count >= 1, True)
+    check("пока шёл запрос, loop работал", ticks >= 10, True)
+
+    print("call_db")
+    check("call_db через фасад", (await call_db(db, "get_user", 101))["name"], "Аня")
+
+
+async def scenario_shared_state(db, adb):
+    print("Общее состояние представлений")
+    await adb.get_user(102)  # потоки и их представления уже созданы
+    buf = db.enable_write_behind(interval_ms=60_000)
+    check("буфер, включённый позже, виден писателю", await adb.run_write(lambda view: view.events is buf), True)
+    await adb.save_action(102, "u", "n", "buffered", {}, "2026-01-01T00:00:00+03:00")
+    check("действие ушло в буфер", buf.depth, 1)
+
+    buf.stop()
+    db.events = None  # как при остановке в main.py
+    check("после остановки писатель видит events = None", await adb.run_write(lambda view: view.events), None)
+    await adb.save_action(102, "u", "n", "direct", {}, "2026-01-01T00:00:01+03:00")
+    check("и пишет сразу в базу, а не в остановленный буфер",
+          db.conn.execute("SELECT COUNT(*) FROM actions WHERE user_id = 102").fetchone()[0], 2)
+    check("в остановленный буфер ничего не попало", buf.depth, 0)
+
+    db.user_cache = type(db.user_cache)(maxsize=10, ttl=60)
+    await adb.get_user(102)
+    check("заменённый кэш заполняется из потоков", len(db.user_cache), 1)
+    await adb.run_write(lambda view: setattr(view, "last_backup", {"ok": True}))
+    check("запись атрибута в потоке попадает на общий объект", db.last_backup, {"ok": True})
+
+
+async def fallback():
+    class Plain:
+        def get_answer(self):
+            return threading.current_thread().name
+
+    check("без фасада — синхронно в текущем потоке",
+          await call_db(Plain(), "get_answer"), threading.current_thread().name)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "bot.db"))
+    adb = AsyncDatabase(db, readers=2)
+    try:
+        check("фасад доступен как db.aio", db.aio is adb, True)
+        asyncio.run(scenario(db, adb))
+        asyncio.run(scenario_shared_state(db, adb))
+        asyncio.run(fallback())
+    finally:
+        adb.close()
+        check("после close фасад снят", db.aio, None)
+        db.close()
+
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Тест резервных копий через backup API (database/backup.py).
+
+Запуск:  python tests/test_backup.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * снимок — целая база со всеми строками, включая те, что ещё лежат в WAL;
+  * копия идёт шагами, а запись из другого соединения во время копии не ломает
+    её и не ждёт блокировку дольше одного шага;
+  * ожидание блокировки записи оценивается по шагам копии, без отдельного потока,
+    который сам отнимал блокировку у бота каждые 50 мс;
+  * в каталоге остаются только проверенные снимки, не больше keep штук;
+  * расписание считается от последнего снимка, рестарт бота копию не повторяет.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database import backup  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "bot.db")
+    backup_dir = os.path.join(tmp, "backups")
+    db = Database(path)
+    with db.conn:
+        db.conn.executemany("INSERT INTO actions (user_id, action, details, timestamp) VALUES (?, 'x', ?, '2026-01-01')",
+                            [(i, "x" * 500) for i in range(4000)])
+
+    print("Снимок")
+    report = backup.backup(path, backup_dir, step_pages=64, step_sleep=0)
+    check("снимок принят", report["integrity"], "ok")
+    check("копия шла шагами", report["steps"] > 1, True)
+    snap = sqlite3.connect(report["file"])
+    check("все строки на месте, включая WAL", snap.execute("SELECT COUNT(*) FROM actions").fetchone()[0], 4000)
+    snap.close()
+    check("временных файлов не осталось", [n for n in os.listdir(backup_dir) if ".part" in n], [])
+
+    print("Запись во время копии")
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA busy_timeout=5000")
+        while not stop.is_set():
+            started = time.perf_counter()
+            with conn:
+                conn.execute("INSERT INTO actions (user_id, action, timestamp) VALUES (0, 'w', '2026-01-02')")
+            written.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.002)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(1.1)  # новое имя снимка: время в имени с точностью до секунды
+    report = backup.backup(path, backup_dir, step_pages=16, step_sleep=0.02, max_restarts=2)
+    stop.set()
+    thread.join()
+    check("снимок под записью принят", report["integrity"], "ok")
+    check("перезапуски копии замечены", report["restarts"] > 0, True)
+    check("после перезапусков — один шаг", report["single_step"], True)
+    check("в WAL копия писателей не держит", (report["journal_mode"], report["lock_wait_max_ms"]), ("wal", 0.0))
+    check("писатель не ждал дольше секунды", max(written) < 1000, True)
+
+    print("Ротация и расписание")
+    for _ in range(2):
+        time.sleep(1.1)
+        report = backup.backup(path, backup_dir, keep=2)
+    prefix = backup.snapshot_prefix(path)
+    check("хранятся последние keep", len(backup.list_snapshots(backup_dir, prefix)), 2)
+    check("новейший снимок на месте", os.path.basename(report["file"]) == backup.list_snapshots(backup_dir, prefix)[-1], True)
+    check("сразу после снимка новый не нужен", backup.seconds_until_due(backup_dir, prefix, 3600) > 3500, True)
+    check("в пустом каталоге — сразу", backup.seconds_until_due(os.path.join(tmp, "none"), prefix, 3600), 0.0)
+
+    print("База с журналом отката")
+    legacy = os.path.join(tmp, "legacy.db")
+    conn = sqlite3.connect(legacy)
+    conn.execute("CREATE TABLE t (x TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?)", [("x" * 500,) for _ in range(2000)])
+    conn.commit()
+    conn.close()
+    report = backup.backup(legacy, os.path.join(tmp, "legacy-backups"), step_pages=32, step_sleep=0)
+    check("режим журнала в отчёте", report["journal_mode"], "delete")
+    check("ожидание писателя — не дольше самого долгого шага",
+          report["lock_wait_max_ms"] == report["max_step_ms"] > 0, True)
+    check("а всего — не больше суммы шагов", report["lock_wait_total_ms"] >= report["lock_wait_max_ms"], True)
+
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
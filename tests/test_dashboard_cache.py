@@ -0,0 +1,151 @@
+"""
+Тест снимков метрик админки (Database.dashboard_cache, get_admin_dashboard_summary).
+
+Запуск:  python tests/test_dashboard_cache.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * повторное открытие дашборда и переключение вкладок берут снимок, а не
+    пересчитывают метрики;
+  * снимок живёт dashboard_ttl секунд, потом метрика считается заново;
+  * кнопка «Обновить» (callback admin_refresh_*) пересчитывает снимок сразу,
+    а обычный переход по вкладке — нет;
+  * dashboard_ttl=0 выключает кэш совсем: замерам нужен честный расчёт на
+    каждый вызов.
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN = 777
+os.environ["ADMIN_ID"] = str(ADMIN)  # до импорта config
+
+from database.db import Database  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def count_calls(db, method):
+    """Подменяет метод метрики у экземпляра и возвращает список его вызовов."""
+    calls = []
+    original = getattr(db, method)
+
+    def counted(*args):
+        calls.append(args)
+        return original(*args)
+
+    setattr(db, method, counted)
+    return calls
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+    async def answer(self, text, **kwargs):
+        self.texts.append(text)
+
+
+class FakeLoggingService:
+    async def log_action(self, user_id, action, details=None):
+        pass
+
+
+def callback(data):
+    async def answer(*args, **kwargs):
+        pass
+
+    return SimpleNamespace(data=data, from_user=SimpleNamespace(id=ADMIN), message=FakeMessage(), answer=answer)
+
+
+def scenario_ttl(tmp):
+    print("Срок жизни снимка")
+    db = Database(os.path.join(tmp, "ttl.db"), dashboard_ttl=0.2)
+    calls = count_calls(db, "get_dau_metrics")
+    first = db.get_admin_dashboard_summary(7)
+    second = db.get_admin_dashboard_summary(7)
+    check("второй вызов — из снимка", len(calls), 1)
+    check("время снимка то же", second["as_of"], first["as_of"])
+    db.get_admin_dashboard_summary(30)
+    check("другой период — свой снимок", calls, [(7,), (30,)])
+    time.sleep(0.25)
+    third = db.get_admin_dashboard_summary(7)
+    check("после ttl — пересчёт", len(calls), 3)
+    check("и новое время снимка", third["as_of"] > first["as_of"], True)
+    db.get_admin_dashboard_summary(7, force=True)
+    check("force — пересчёт до истечения ttl", len(calls), 4)
+    db.close()
+
+
+async def scenario_refresh(tmp):
+    print("Кнопка «Обновить»")
+    from modules.admin.core import make_admin_callback_handler
+
+    db = Database(os.path.join(tmp, "refresh.db"), dashboard_ttl=300)
+    calls = count_calls(db, "get_retention_metrics")
+    handler = make_admin_callback_handler(db, FakeLoggingService())
+
+    await handler(callback("admin_dashboard_7"))
+    await handler(callback("admin_funnel_7"))
+    await handler(callback("admin_value_7"))
+    check("вкладки с тем же периодом — один расчёт", len(calls), 1)
+    await handler(callback("admin_retention"))
+    check("удержание — тоже из снимка", len(calls), 1)
+
+    refreshed = callback("admin_refresh_dashboard_7")
+    await handler(refreshed)
+    check("admin_refresh_dashboard — пересчёт", len(calls), 2)
+    check("экран показан", "ГЛАВНЫЙ ДАШБОРД" in refreshed.message.texts[-1], True)
+    for data in ("admin_refresh_retention", "admin_refresh_funnel_7", "admin_refresh_value_7"):
+        await handler(callback(data))
+    check("каждая кнопка «Обновить» — пересчёт", len(calls), 5)
+    await handler(callback("admin_dashboard_7"))
+    check("после обновления вкладка — снова из снимка", len(calls), 5)
+    db.close()
+
+
+def scenario_disabled(tmp):
+    print("dashboard_ttl=0")
+    db = Database(os.path.join(tmp, "nocache.db"), dashboard_ttl=0)
+    calls = count_calls(db, "get_dau_metrics")
+    for _ in range(3):
+        db.get_admin_dashboard_summary(7)
+    check("каждый вызов считает заново", len(calls), 3)
+    check("кэш пуст", len(db.dashboard_cache), 0)
+    db.close()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    scenario_ttl(tmp)
+    asyncio.run(scenario_refresh(tmp))
+    scenario_disabled(tmp)
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
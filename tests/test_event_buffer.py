@@ -0,0 +1,181 @@
+"""
+Тест групповой записи событий (database/event_buffer.py).
+
+Запуск:  python tests/test_event_buffer.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * события, записанные через буфер, доходят до базы все и в исходном порядке;
+  * время шага сценария — момент вызова, а не момент сброса, и в формате CURRENT_TIMESTAMP;
+  * завершение сценария видит только что залогированные шаги (steps_count не теряется);
+  * пачка пишется одной транзакцией — ради этого всё и затевалось;
+  * при закрытии базы очередь дописывается, ничего не пропадает;
+  * сбой записи не теряет события: они уходят со следующей попыткой;
+  * строка, которую база не примет никогда (IntegrityError), отбрасывается со
+    счётчиком rejected, а не возвращается в очередь: раньше она валила каждый
+    следующий сброс и запирала очередь навсегда;
+  * flush() ждёт пачку, которую уже пишет фоновый поток: иначе сессия
+    завершалась раньше счётчика шагов и шаги терялись насовсем.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database.event_buffer import EventBuffer  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def scenario_batching(path):
+    db = Database(path)
+    # Интервал большой: сбрасывать будем только явно, чтобы тест не зависел от таймингов.
+    buf = db.enable_write_behind(interval_ms=60_000, max_rows=10_000)
+
+    sid = db.start_user_scenario(1, "card_of_day")
+    for i in range(12):
+        db.save_action(1, "u", "Аня", f"step_{i}", {"i": i}, None)
+        db.log_scenario_step(1, "card_of_day", f"step_{i}", {"i": i, "session_id": sid})
+
+    check("до сброса в базе ничего нет", count(path, "actions"), 0)
+    # 12 действий, 12 шагов и 12 обновлений счётчика шагов сессии
+    check("очередь накопила все события", buf.depth, 36)
+
+    actions = db.get_actions(1)
+    check("get_actions видит свежие события", len(actions), 12)
+    check("порядок сохранён", [a["action"] for a in actions][:3], ["step_0", "step_1", "step_2"])
+    check("все 36 записей ушли одной транзакцией", (buf.flushes, buf.flushed_rows), (1, 36))
+
+    ts = db.conn.execute("SELECT timestamp FROM scenario_logs LIMIT 1").fetchone()[0]
+    check("время шага в формате CURRENT_TIMESTAMP", len(ts) == 19 and ts[10] == " ", True)
+
+    db.log_scenario_step(1, "card_of_day", "completed", {"session_id": sid})
+    db.complete_user_scenario(1, "card_of_day", sid)
+    steps, last_step = db.conn.execute(
+        "SELECT steps_count, last_step FROM user_scenarios WHERE session_id = ?", (sid,)).fetchone()
+    check("complete_user_scenario посчитал и незаписанный шаг", steps, 13)
+    check("последний шаг сессии", last_step, "completed")
+
+    db.save_action(1, "u", "Аня", "last_one", None, None)
+    db.close()
+    check("при закрытии очередь дописана", count(path, "actions"), 13)
+
+
+class SlowConnection:
+    """Соединение, у которого executemany заметно долгий: пачка «в полёте» видна снаружи."""
+
+    def __init__(self, conn, delay=0.3):
+        self.conn = conn
+        self.delay = delay
+        self.writing = threading.Event()
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self.conn.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        self.writing.set()
+        time.sleep(self.delay)
+        return self.conn.executemany(sql, rows)
+
+
+def scenario_concurrent_flush(path):
+    db = Database(path)
+    buf = db.enable_write_behind(interval_ms=60_000, max_rows=10_000)
+    slow = buf.conn = SlowConnection(buf.conn)
+
+    sid = db.start_user_scenario(2, "card_of_day")
+    for step in ("scenario_started", "card_drawn", "completed"):
+        db.log_scenario_step(2, "card_of_day", step, {"session_id": sid})
+
+    background = threading.Thread(target=buf.flush)
+    background.start()
+    slow.writing.wait(5)
+    check("очередь уже вынута фоновым сбросом", buf.depth, 0)
+    db.complete_user_scenario(2, "card_of_day", sid)
+    background.join()
+
+    row = db.conn.execute(
+        "SELECT status, steps_count, last_step FROM user_scenarios WHERE session_id = ?", (sid,)).fetchone()
+    check("завершение дождалось пачки в полёте", tuple(row), ("completed", 3, "completed"))
+    total_steps = db.conn.execute("SELECT total_steps FROM user_stats WHERE user_id = 2").fetchone()[0]
+    check("шаги дошли до user_stats", total_steps, 3)
+    buf.conn = slow.conn
+    db.close()
+
+
+def scenario_retry():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    buf = EventBuffer(conn, interval_ms=60_000)
+    buf.add("actions", (1, "u", "n", "a", None, "2026-01-01T00:00:00+03:00"))
+    written = buf.flush()  # таблицы ещё нет — запись падает
+    check("неудачный сброс ничего не записал", written, 0)
+    check("события остались в очереди", buf.depth, 1)
+    conn.execute("CREATE TABLE actions (user_id, username, name, action, details, timestamp)")
+    check("со второй попытки событие дошло", buf.flush(), 1)
+    check("счётчик неудач", buf.stats()["failed_flushes"], 1)
+
+
+def scenario_rejected_row():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("CREATE TABLE actions (user_id, username, name, action TEXT NOT NULL, details, timestamp)")
+    buf = EventBuffer(conn, interval_ms=60_000)
+    buf.add("actions", (1, "u", "n", "first", None, "2026-01-01T00:00:00+03:00"))
+    buf.add("actions", (1, "u", "n", None, None, "2026-01-01T00:00:01+03:00"))  # NOT NULL
+    buf.add("actions", (1, "u", "n", "third", None, "2026-01-01T00:00:02+03:00"))
+    check("записаны обе хорошие строки", buf.flush(), 2)
+    check("плохая строка не вернулась в очередь", buf.depth, 0)
+    rows = [r[0] for r in conn.execute("SELECT action FROM actions ORDER BY rowid")]
+    check("порядок сохранён", rows, ["first", "third"])
+    buf.add("actions", (1, "u", "n", "later", None, "2026-01-01T00:00:03+03:00"))
+    check("следующий сброс идёт обычной пачкой", buf.flush(), 1)
+    stats = buf.stats()
+    check("счётчик отброшенных строк", stats["rejected"], 1)
+    check("это не неудачный сброс", stats["failed_flushes"], 0)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    print("Пачки и свежесть чтения")
+    scenario_batching(os.path.join(tmp, "bot.db"))
+    print("Сброс во время фоновой записи")
+    scenario_concurrent_flush(os.path.join(tmp, "concurrent.db"))
+    print("Повтор после сбоя")
+    scenario_retry()
+    print("Строка, которую база не принимает")
+    scenario_rejected_row()
+
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
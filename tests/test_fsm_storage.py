@@ -0,0 +1,175 @@
+"""
+Тест SQLite-хранилища состояний FSM (database/fsm_storage.py).
+
+Запуск:  python tests/test_fsm_storage.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * состояние и data переживают перезапуск — ради этого хранилище и заведено;
+  * несколько изменений между сбросами дают одну строку, а не по строке на вызов;
+  * state.clear() удаляет запись и из памяти, и из базы; чтение без записи
+    ничего не заводит (MemoryStorage заводил запись на каждого);
+  * запись, которую не трогали дольше ttl, выбрасывается при работе; простоявшая
+    дольше ttl за время остановки загружается и уходит первой чисткой через
+    on_expire, а не удаляется молча;
+  * data, которую не сериализовать в JSON, не роняет хендлер;
+  * чистка (sweep) сообщает о выброшенных записях on_expire, и main.py закрывает
+    по ним незавершённую сессию user_scenarios как abandoned; ошибка колбэка
+    считается и не мешает чистке;
+  * stats() раскладывает живые записи по группам состояний и считает объём data.
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from database.db import Database  # noqa: E402
+from database.fsm_storage import SQLiteStorage  # noqa: E402
+from modules.user_management import UserState, scenario_for_state  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def rows(storage):
+    return storage.conn.execute("SELECT COUNT(*) FROM fsm_storage").fetchone()[0]
+
+
+async def sweep_checks(db):
+    expired_calls = []
+
+    async def on_expire(user_id, state, data):
+        expired_calls.append((user_id, state, data.get("session_id")))
+        scenario = scenario_for_state(state)
+        if user_id == 13:
+            raise RuntimeError("колбэк упал")
+        if scenario:
+            db.abandon_user_scenario(user_id, scenario, data["session_id"])
+
+    storage = SQLiteStorage(db.path, on_expire=on_expire)
+    session_id = db.start_user_scenario(11, "card_of_day_nature", session_id="11_card_of_day_sweep")
+    await FSMContext(storage, key(11)).set_state(UserState.waiting_for_initial_response)
+    await FSMContext(storage, key(11)).update_data(session_id=session_id, user_request="длинный текст " * 10)
+    await FSMContext(storage, key(12)).set_state(UserState.waiting_for_gratitude)
+    await FSMContext(storage, key(13)).set_state(UserState.waiting_for_good_moments)
+    await FSMContext(storage, key(14)).update_data(learn_step=2)
+    await storage.flush()
+
+    stats = storage.stats()
+    check("группы состояний", stats["groups"], {"UserState": 3, "(без состояния)": 1})
+    check("объём data равен JSON в базе", stats["data_bytes"],
+          storage.conn.execute("SELECT SUM(LENGTH(CAST(data AS BLOB))) FROM fsm_storage").fetchone()[0])
+
+    for name in ("fsm:11:11:default", "fsm:13:13:default"):
+        storage.records[name].touched -= storage.ttl + 1
+    check("sweep выбросил две", await storage.sweep(), 2)
+    check("on_expire получил пользователя, состояние и data", sorted(expired_calls), [
+        (11, "UserState:waiting_for_initial_response", session_id),
+        (13, "UserState:waiting_for_good_moments", None),
+    ])
+    check("ошибка колбэка посчитана", storage.stats()["expire_errors"], 1)
+    check("сессия закрыта как брошенная",
+          db.conn.execute("SELECT status FROM user_scenarios WHERE session_id = ?", (session_id,)).fetchone()[0],
+          "abandoned")
+    check("вне сценария — не сценарий", scenario_for_state("LearnCardsFSM:entry_poll_q1"), None)
+    await storage.close()
+
+
+async def main_async(path):
+    storage = SQLiteStorage(path)
+    state = FSMContext(storage, key(1))
+
+    print("Запись и перезапуск")
+    await state.set_state("UserState:waiting_for_request_text_input")
+    await state.update_data(session_id="1_card_of_day_x")
+    await state.update_data(user_request="Что мне сейчас важно?")
+    await state.update_data(card_number=7)
+    check("одна строка за сброс", await storage.flush(), 1)
+    check("повторный сброс пуст", await storage.flush(), 0)
+    await storage.close()
+
+    storage = SQLiteStorage(path)
+    state = FSMContext(storage, key(1))
+    check("состояние после перезапуска", await state.get_state(), "UserState:waiting_for_request_text_input")
+    check("data после перезапуска", await state.get_data(),
+          {"session_id": "1_card_of_day_x", "user_request": "Что мне сейчас важно?", "card_number": 7})
+    check("кириллица без экранирования",
+          "важно" in storage.conn.execute("SELECT data FROM fsm_storage").fetchone()[0], True)
+
+    print("Очистка")
+    check("чтение чужого ключа ничего не заводит", (await storage.get_state(key(2)), len(storage.records)), (None, 1))
+    await state.clear()
+    check("пустая запись убрана из памяти", len(storage.records), 0)
+    await storage.flush()
+    check("и из базы", rows(storage), 0)
+
+    print("Простой дольше ttl")
+    await FSMContext(storage, key(3)).set_state("EveningState:waiting_for_good_moments")
+    await FSMContext(storage, key(4)).set_state("EveningState:waiting_for_gratitude")
+    await storage.flush()
+    storage.records["fsm:3:3:default"].touched -= storage.ttl + 1
+    expired = storage.expire_idle()
+    check("выброшена только старая", [name for name, _ in expired], ["fsm:3:3:default"])
+    await storage.flush()
+    check("строка удалена", rows(storage), 1)
+    with storage.conn:
+        storage.conn.execute("UPDATE fsm_storage SET updated_at = ?", (int(time.time() - storage.ttl - 1),))
+    await storage.close()
+    expired_calls = []
+
+    async def on_expire(user_id, state, data):
+        expired_calls.append((user_id, state))
+
+    storage = SQLiteStorage(path, on_expire=on_expire)
+    check("при загрузке старые не удалены молча", (len(storage.records), rows(storage)), (1, 1))
+    storage.start()
+    await asyncio.sleep(storage.interval * 3)
+    check("первая чистка после старта сообщила on_expire", expired_calls,
+          [(4, "EveningState:waiting_for_gratitude")])
+    check("и удалила строку", (len(storage.records), rows(storage)), (0, 0))
+
+    print("Несериализуемые данные")
+    state = FSMContext(storage, key(5))
+    await state.update_data(callback=object())
+    check("в памяти остались", "callback" in await state.get_data(), True)
+    check("сброс не падает", await storage.flush(), 0)
+    await storage.close()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "bot.db"))
+    asyncio.run(main_async(db.path))
+    print("Чистка простоя")
+    asyncio.run(sweep_checks(db))
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Тест импорта старых data/*.json (database/legacy_import.py, json_codec.iter_json).
+
+Запуск:  python tests/test_legacy_import.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * потоковый разбор даёт то же, что json.load, при любом размере куска чтения;
+  * импорт переносит все строки, а повторный ничего не дублирует — в том числе
+    строки actions, которые уже уехали в месячный архив;
+  * живые данные главнее исторических: заполненные поля не перезаписываются;
+  * битая запись пропускается со счётчиком, остальной файл импортируется;
+  * из card_feedback.json переносятся ответы, которых нет среди card_feedback
+    из user_actions.json, — раньше файл пропускался и 70 из 85 ответов терялись.
+"""
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database.json_codec import iter_json  # noqa: E402
+from database.legacy_import import import_legacy  # noqa: E402
+
+DATA = os.path.join(ROOT, "data")
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def written(reports):
+    return {r["file"]: r["written"] for r in reports}
+
+
+def main():
+    print("Потоковый разбор")
+    for name in ("user_actions.json", "card_feedback.json", "user_cards.json"):
+        with open(os.path.join(DATA, name), encoding="utf-8") as fp:
+            whole = json.load(fp)
+        expected = whole if isinstance(whole, list) else list(whole.items())
+        with open(os.path.join(DATA, name), encoding="utf-8") as fp:
+            check(f"{name} кусками по 7 символов", list(iter_json(fp, chunk_size=7)), expected)
+    check("число на границе куска", list(iter_json(io.StringIO("[12345, 6]"), chunk_size=3)), [12345, 6])
+
+    tmp = tempfile.mkdtemp()
+    data = os.path.join(tmp, "data")
+    shutil.copytree(DATA, data)
+    with open(os.path.join(data, "user_actions.json"), encoding="utf-8") as fp:
+        actions = json.load(fp)
+    actions.insert(1, {"user_id": 1, "action": "broken"})  # без timestamp
+    with open(os.path.join(data, "user_actions.json"), "w", encoding="utf-8") as fp:
+        json.dump(actions, fp, ensure_ascii=False, indent=2)
+
+    db = Database(os.path.join(tmp, "bot.db"))
+    db.conn.execute("INSERT INTO users (user_id, name, username, reminder_time) VALUES (239719200, 'Живое имя', '', '07:30')")
+    db.conn.commit()
+
+    print("Импорт")
+    first = import_legacy(db.conn, data, db.archive_dir, batch_size=10)
+    report = {r["file"]: r for r in first}
+    check("actions перенесены", db.conn.execute(
+        "SELECT COUNT(*) FROM actions WHERE json_extract(details, '$.source') IS NULL").fetchone()[0], len(actions) - 1)
+    check("битая запись пропущена со счётчиком", report["user_actions.json"]["bad"], 1)
+    check("карты пользователей", db.conn.execute("SELECT COUNT(*) FROM user_cards").fetchone()[0],
+          sum(len(cards) for cards in json.load(open(os.path.join(data, "user_cards.json"))).values()))
+    check("живые поля не перезаписаны",
+          tuple(db.conn.execute("SELECT name, reminder_time FROM users WHERE user_id = 239719200").fetchone()),
+          ("Живое имя", "07:30"))
+    check("пустые поля дозаполнены",
+          db.conn.execute("SELECT reminder_time FROM users WHERE user_id = 1264280911").fetchone()[0], "11:00")
+    check("скорость посчитана", all(r["rows_per_sec"] > 0 for r in first), True)
+
+    with open(os.path.join(data, "card_feedback.json"), encoding="utf-8") as fp:
+        responses = sum(len(u["responses"]) for u in json.load(fp)["users"].values())
+    legacy_feedback = sum(1 for a in actions if a.get("action") == "card_feedback")
+    feedback = db.conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT timestamp) FROM actions WHERE action = 'card_feedback'").fetchone()
+    check("card_feedback.json: дописаны только недостающие ответы",
+          report["card_feedback.json"]["written"], responses - legacy_feedback)
+    check("ответов card_feedback столько же, сколько в файле", feedback[0], responses)
+    latest = max((a["timestamp"] for a in actions if a.get("action") == "card_feedback"))
+    check("время — последний известный card_feedback",
+          db.conn.execute("SELECT COUNT(*) FROM actions WHERE action = 'card_feedback' AND timestamp = ?",
+                          (latest,)).fetchone()[0], responses - legacy_feedback + 1)
+
+    print("Повторный импорт")
+    check("ничего не дублируется", set(written(import_legacy(db.conn, data, db.archive_dir)).values()), {0})
+    db.archive_actions(-1)
+    check("строки в архиве", db.conn.execute("SELECT COUNT(*) FROM actions").fetchone()[0], 0)
+    again = written(import_legacy(db.conn, data, db.archive_dir))
+    check("архивные строки не возвращаются в actions", again["user_actions.json"], 0)
+    check("и ответы card_feedback сверяются с архивом", again["card_feedback.json"], 0)
+
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
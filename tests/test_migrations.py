@@ -0,0 +1,240 @@
+"""
+Тест реестра миграций схемы (database/migrations.py).
+
+Запуск:  python tests/test_migrations.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * новая база доводится до последней версии, VIEW метрик на месте;
+  * запуск с актуальной схемой не делает ничего, кроме чтения PRAGMA user_version
+    (плюс прагмы самого соединения) — ради этого всё и делалось;
+  * старая база без номера версии, но с таблицами и данными, проходит миграции
+    без ошибок и без потери данных;
+  * правка уже применённого шага видна в verify(), в том числе правка его
+    помощников из deps; запись с суммой до учёта deps принимается;
+  * каждый шаг-функция переживает повторный запуск на мигрированной базе — так
+    будет после сбоя между функцией и записью о ней;
+  * scenario_logs.session_id заполняется из metadata, и агрегаты пересобираются;
+  * steps_count ведётся по сессии, а старые значения пересчитываются по журналу.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database import migrations  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def open_traced(path):
+    """Открывает Database, записывая все выполненные на соединении запросы."""
+    statements = []
+    real_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    sqlite3.connect = connect
+    try:
+        db = Database(path)
+    finally:
+        sqlite3.connect = real_connect
+    db.conn.set_trace_callback(None)
+    return db, statements
+
+
+def scenario_fresh_and_warm(path):
+    db = Database(path)
+    check("новая база на последней версии", migrations.current_version(db.conn), migrations.LATEST_VERSION)
+    check("VIEW метрик созданы", db.conn.execute("SELECT COUNT(*) FROM v_sessions").fetchone()[0], 0)
+    check("verify без замечаний", migrations.verify(db), [])
+    db.close()
+
+    db, statements = open_traced(path)
+    # Загрузка кэша подписок — не работа со схемой
+    schema_work = [s for s in statements
+                   if not s.startswith(("PRAGMA journal_mode", "PRAGMA busy_timeout",
+                                         "SELECT user_id, checked_on FROM subscription_checks"))]
+    check("тёплый старт — одно чтение user_version", schema_work, ["PRAGMA user_version"])
+    db.close()
+
+
+def scenario_legacy(path):
+    db = Database(path)
+    db.update_user(42, {"name": "Старожил"})
+    db.close()
+    # База «до реестра»: таблицы и данные есть, номера версии нет.
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute("DROP TABLE schema_migrations")
+    conn.execute("DROP VIEW v_sessions")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    check("старая база догнала версию", migrations.current_version(db.conn), migrations.LATEST_VERSION)
+    check("данные не потерялись", db.get_user(42)["name"], "Старожил")
+    check("VIEW пересоздан", db.conn.execute("SELECT COUNT(*) FROM v_sessions").fetchone()[0], 0)
+
+    db.conn.execute("UPDATE schema_migrations SET checksum = 'edited' WHERE version = 1")
+    db.conn.commit()
+    problems = migrations.verify(db)
+    check("правка применённого шага замечена", len(problems) == 1 and "checksum" in problems[0], True)
+    db.close()
+
+
+def scenario_rerun_and_deps(path):
+    db = Database(path)
+    with db.conn:
+        db.conn.execute("INSERT INTO scenario_logs (user_id, scenario, step, metadata, timestamp)"
+                        " VALUES (1, 'card_of_day', 'started', '{\"session_id\": \"s1\"}', '2026-09-01 10:00:00')")
+    objects = "SELECT type, name, sql FROM sqlite_master ORDER BY type, name"
+    schema = db.conn.execute(objects).fetchall()
+    # Сбой шага-функции после его работы, но до записи о нём: migrate повторяет шаг
+    # и докатывает все следующие — в том числе шаг 17, который убирает индекс шага 10.
+    rerun = []
+    for step in migrations.MIGRATIONS:
+        if step.func is not None:
+            db.conn.execute(f"PRAGMA user_version = {step.version - 1}")
+            migrations.migrate(db)
+            if db.conn.execute(objects).fetchall() == schema:
+                rerun.append(step.version)
+    check("повтор с любого шага-функции не меняет схему",
+          rerun, [m.version for m in migrations.MIGRATIONS if m.func is not None])
+    check("и не дублирует данные", db.conn.execute("SELECT COUNT(*) FROM scenario_logs").fetchone()[0], 1)
+    check("verify без замечаний", migrations.verify(db), [])
+
+    step = next(m for m in migrations.MIGRATIONS if m.version == 4)
+    recorded = step.checksum
+    migrations.TIME_INDEXES["actions"].append("action")
+    try:
+        check("правка помощника меняет сумму шага", step.checksum != recorded, True)
+        check("и видна в verify", len(migrations.verify(db)), 1)
+    finally:
+        migrations.TIME_INDEXES["actions"].pop()
+    legacy = min(step.accepted_checksums - {step.checksum})
+    with db.conn:
+        db.conn.execute("UPDATE schema_migrations SET checksum = ? WHERE version = 4", (legacy,))
+    check("сумма до учёта deps принимается", migrations.verify(db), [])
+    db.close()
+
+
+def scenario_session_id(path):
+    db = Database(path)
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO scenario_logs (user_id, scenario, step, metadata) VALUES (?, 'card_of_day', ?, ?)",
+            [(user_id, step, f'{{"session_id": "s{user_id}"}}')
+             for user_id in (1, 2) for step in ("scenario_started", "card_drawn")])
+    db.refresh_rollups()
+    db.close()
+    # База на версии 9: session_id только в metadata, агрегаты посчитаны без сессий.
+    conn = sqlite3.connect(path)
+    conn.execute("DROP INDEX idx_scenario_logs_session_id")
+    conn.execute("UPDATE scenario_logs SET session_id = NULL")
+    conn.execute("DELETE FROM schema_migrations WHERE version > 9")
+    conn.execute("PRAGMA user_version = 9")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    check("session_id заполнен из metadata",
+          db.conn.execute("SELECT COUNT(DISTINCT session_id) FROM scenario_logs").fetchone()[0], 2)
+    plan = " ".join(row[3] for row in db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT step FROM scenario_logs WHERE session_id = 's1' AND user_id = 1"))
+    check("поиск по сессии идёт по индексу", "idx_scenario_logs_session_id" in plan, True)
+    plan = " ".join(row[3] for row in db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT step, COUNT(DISTINCT session_id) FROM scenario_logs"
+        " WHERE scenario = 'card_of_day' AND d_local >= date('now', '+3 hours', '-7 days') GROUP BY step"))
+    check("воронка с ignored_users идёт по (scenario, d_local)", "idx_scenario_logs_scenario_d_local" in plan, True)
+    check("неиспользуемый индекс шага 10 удалён шагом 17", db.conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_scenario_logs_scenario_session_id_step'").fetchone()[0], 0)
+    check("агрегаты пересобраны с сессиями", db.get_card_funnel_metrics(7)["step4"]["count"], 2)
+    check("v_events отдаёт колонку", db.conn.execute("SELECT session_id FROM v_events LIMIT 1").fetchone()[0], "s1")
+    db.log_scenario_step(3, "card_of_day", "scenario_started", {"session_id": "s3"})
+    check("log_scenario_step пишет колонку",
+          db.conn.execute("SELECT session_id FROM scenario_logs WHERE user_id = 3").fetchone()[0], "s3")
+    db.close()
+
+
+def scenario_step_counters(path):
+    db = Database(path)
+    evening = db.start_user_scenario(1, "evening_reflection")
+    for step in ("started", "good_moments_provided", "completed"):
+        db.log_scenario_step(1, "evening_reflection", step, {"session_id": evening})
+    db.complete_user_scenario(1, "evening_reflection", evening)
+    # «Карта дня»: первый шаг до строки сессии, строка под именем с колодой
+    db.log_scenario_step(1, "card_of_day", "scenario_started", {"session_id": "c1"})
+    db.start_user_scenario(1, "card_of_day_nature", session_id="c1")
+    for step in ("card_drawn", "completed"):
+        db.log_scenario_step(1, "card_of_day", step, {"session_id": "c1"})
+    db.complete_user_scenario(1, "card_of_day", "c1")
+    abandoned = db.start_user_scenario(2, "evening_reflection")
+    for step in ("started", "good_moments_provided"):
+        db.log_scenario_step(2, "evening_reflection", step, {"session_id": abandoned})
+    db.abandon_user_scenario(2, "evening_reflection", abandoned)
+
+    def sessions():
+        return {row[0]: tuple(row[1:]) for row in db.conn.execute(
+            "SELECT session_id, status, steps_count, last_step FROM user_scenarios")}
+
+    expected = {evening: ("completed", 3, "completed"), "c1": ("completed", 3, "completed"),
+                abandoned: ("abandoned", 2, "good_moments_provided")}
+    check("счётчик шагов по сессии", sessions(), expected)
+    db.close()
+
+    # База на версии 12: счётчика нет, steps_count — все шаги пользователя в сценарии.
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE user_scenarios SET steps_count = 99, last_step = NULL")
+    conn.execute("INSERT INTO scenario_logs (user_id, scenario, step, session_id, timestamp)"
+                 " VALUES (1, 'evening_reflection', 'late', ?, datetime('now', '+1 hour'))", (evening,))
+    conn.execute("DELETE FROM schema_migrations WHERE version > 12")
+    conn.execute("PRAGMA user_version = 12")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    check("пересчёт по сессиям, шаги после завершения не в счёт", sessions(), expected)
+    check("user_stats пересобран", db.conn.execute(
+        "SELECT total_steps FROM user_stats WHERE user_id = 1").fetchone()[0], 6)
+    db.close()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    print("Новая база и повторный запуск")
+    scenario_fresh_and_warm(os.path.join(tmp, "fresh.db"))
+    print("База до реестра миграций")
+    scenario_legacy(os.path.join(tmp, "legacy.db"))
+    print("Повтор шагов-функций и контрольные суммы")
+    scenario_rerun_and_deps(os.path.join(tmp, "rerun.db"))
+    print("session_id из metadata")
+    scenario_session_id(os.path.join(tmp, "session.db"))
+    print("Счётчик шагов сессии")
+    scenario_step_counters(os.path.join(tmp, "steps.db"))
+
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,7 +15,9 @@
     доставки посчитает его несколько раз;
   * если сеть не вернулась за отведённое окно, неудача фиксируется явно;
   * повторы не выполняются подряд внутри одного прохода, иначе сбой у первых
-    адресатов задерживал бы напоминания всем остальным.
+    адресатов задерживал бы напоминания всем остальным;
+  * доступность адресата обновляется через db.aio (поток записи), а не
+    синхронным коммитом в event loop.
 """
 import asyncio
 import os
@@ -55,10 +57,16 @@ class FakeDB:
     def __init__(self):
         self.actions = []
         self.card_available = True     # не вытянул ли человек карту сам
+        self.reachability = []
+        self.aio = None
 
     def save_action(self, user_id, username, name, action, details, timestamp):
         self.actions.append({"user_id": user_id, "action": action, "details": details})
 
+    def record_reachability(self, user_id, status=None, error=None):
+        self.reachability.append((user_id, status, "sync"))
+        return True
+
     def get_user(self, user_id):
         return {"name": "Тест"}
 
@@ -66,6 +74,17 @@ class FakeDB:
         return self.card_available
 
 
+class FakeAio:
+    """Фасад db.aio: вызов уходит сюда, а не в синхронный метод базы."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def record_reachability(self, user_id, status=None, error=None):
+        self.db.reachability.append((user_id, status, "aio"))
+        return True
+
+
 def build_service():
     import modules.notification_service as ns
 
@@ -122,6 +141,11 @@ async def scenario_permanent_error():
     check("ровно одна запись", len(logs), 1)
     check("записана неудача", logs[0]["status"], "failed")
     check("причина сохранена", "Forbidden" in logs[0]["error"], True)
+    check("доступность обновлена", db.reachability, [(102, "failed", "sync")])
+
+    db.aio = FakeAio(db)
+    await svc._send_reminder(104, "morning", "текст", t0)
+    check("с фасадом — через db.aio", db.reachability[-1], (104, "failed", "aio"))
 
 
 async def scenario_gives_up():
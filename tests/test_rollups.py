@@ -0,0 +1,134 @@
+"""
+Тест дневных агрегатов дашборда (database/rollups.py).
+
+Запуск:  python tests/test_rollups.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * агрегаты дают те же числа DAU и воронки, что и VIEW, по которым считали раньше;
+  * инкрементальное обновление по отметке rowid совпадает с пересборкой с нуля —
+    в том числе когда новые события дописываются в уже посчитанный день;
+  * ignored_users в агрегаты не попадают;
+  * колода берётся и из deck, и из deck_name (card_drawn пишет второе);
+  * когорты: маска активности, матрица удержания и событие задним числом
+    раньше первого дня пользователя.
+"""
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+from database import rollups  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+STEPS = ["scenario_started", "initial_resource_selected", "card_drawn", "completed"]
+
+
+def log_events(db, users, days_ago, steps=STEPS):
+    """События сценария «Карта дня» для users за день days_ago (время — UTC, как пишет log_scenario_step)."""
+    rows = []
+    for user_id in users:
+        session_id = f"{user_id}_card_of_day_{days_ago}"
+        for step in steps:
+            meta = {"session_id": session_id}
+            if step == "card_drawn":
+                meta["deck_name"] = "nature" if user_id % 2 else "message"
+            rows.append((user_id, "card_of_day", step, json.dumps(meta), f"-{days_ago} days", session_id))
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO scenario_logs (user_id, scenario, step, metadata, timestamp, session_id)"
+            " VALUES (?, ?, ?, ?, datetime('now', ?), ?)", rows)
+
+
+def snapshot(db):
+    return {table: sorted(tuple(row) for row in db.conn.execute(f"SELECT * FROM {table}"))
+            for table in rollups.TABLES + ("user_cohorts",)}
+
+
+def funnel_from_view(db, days):
+    rows = db.conn.execute(f"""
+        SELECT event, COUNT(DISTINCT session_id) FROM v_events
+        WHERE scenario = 'card_of_day' AND d_local >= date('now', '+3 hours', '-{days} days')
+        GROUP BY event""").fetchall()
+    return {event: count for event, count in rows}
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "rollups.db"))
+    with db.conn:
+        db.conn.execute("INSERT INTO ignored_users (user_id) VALUES (999)")
+
+    print("Первичное заполнение")
+    log_events(db, [1, 2, 3, 999], 0)
+    log_events(db, [1, 2], 1)
+    log_events(db, [4, 5, 6], 3, steps=STEPS[:3])
+    check("новые события посчитаны", db.refresh_rollups() > 0, True)
+    check("повторный refresh ничего не делает", db.refresh_rollups(), 0)
+
+    view_today = db.conn.execute(
+        "SELECT dau FROM v_dau_daily WHERE d_local = date('now', '+3 hours')").fetchone()[0]
+    dau = db.get_dau_metrics()
+    check("DAU за сегодня как у VIEW", dau["dau_today"], view_today)
+    check("ignored_users не считается", dau["dau_today"], 3)
+
+    funnel = db.get_card_funnel_metrics(7)
+    view = funnel_from_view(db, 7)
+    check("воронка: старты как у VIEW", funnel["step1"]["count"], view["scenario_started"])
+    check("воронка: карты как у VIEW", funnel["step4"]["count"], view["card_drawn"])
+    check("воронка: завершения как у VIEW", funnel["step7"]["count"], view["completed"])
+
+    stats = db.get_scenario_stats("card_of_day", 7)
+    check("старты сценария", stats["total_starts"], 8)
+    check("завершения сценария", stats["total_completions"], 5)
+
+    decks = db.get_deck_popularity_metrics(7)["decks"]
+    check("колоды из deck_name", {name: d["total_draws"] for name, d in decks.items()},
+          {"nature": 4, "message": 4})
+
+    matrix = {c["first_day"][-5:]: c for c in db.get_cohort_retention_matrix(30, 7)}
+    yesterday = db.conn.execute("SELECT strftime('%m-%d', 'now', '+3 hours', '-1 day')").fetchone()[0]
+    three_days = db.conn.execute("SELECT strftime('%m-%d', 'now', '+3 hours', '-3 days')").fetchone()[0]
+    check("когорта вчера: размер и D1", (matrix[yesterday]["size"], matrix[yesterday]["retained"][1]), (2, 2))
+    check("когорта вчера: D2 ещё не наступил", matrix[yesterday]["retained"][2], None)
+    check("когорта 3 дня назад: D1", matrix[three_days]["retained"][1], 0)
+    check("D1 retention по когортам", db.get_retention_metrics(7)["d1_retention"], 40.0)
+
+    print("Дописывание в уже посчитанный день")
+    log_events(db, [7, 8], 0)
+    log_events(db, [1], 0, steps=["card_drawn"])  # тот же день, та же сессия
+    db.refresh_rollups()
+    check("DAU вырос", db.get_dau_metrics()["dau_today"], 5)
+    log_events(db, [3], 5, steps=["scenario_started"])  # задним числом, раньше first_day
+    db.refresh_rollups()
+    activity = db.conn.execute("SELECT activity FROM user_cohorts WHERE user_id = 3").fetchone()[0]
+    check("маска сдвинулась к новому первому дню", activity, (1 << 0) | (1 << 5))
+    incremental = snapshot(db)
+    db.rebuild_rollups()
+    check("инкремент совпадает с пересборкой", incremental, snapshot(db))
+
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
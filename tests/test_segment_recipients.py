@@ -11,7 +11,9 @@
   * признак блокировки берётся из обоих журналов — рассылок и напоминаний;
   * время в этих журналах хранится в разных форматах ('2025-12-02 10:17:41' против
     '2026-08-08T19:00:39+03:00'), и сравнение на свежесть обязано это переживать;
-  * побеждает самый свежий сигнал: разблокировавший бота возвращается в рассылку.
+  * побеждает самый свежий сигнал: разблокировавший бота возвращается в рассылку;
+  * user_reachability, заполненная по журналам, даёт тот же ответ, что и прежний
+    запрос по ним, а сигналы в момент отправки обновляют её без пересборки.
 """
 import os
 import sqlite3
@@ -34,7 +36,7 @@ def check(name, actual, expected):
 
 
 class FakeDB:
-    """Минимальная база с двумя журналами — только то, что читает проверяемый метод."""
+    """Минимальная база с двумя журналами и user_reachability — только то, что трогают проверяемые методы."""
 
     def __init__(self, path):
         self.conn = sqlite3.connect(path)
@@ -46,6 +48,12 @@ class FakeDB:
                 id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
                 action TEXT, details TEXT, timestamp TEXT);
         """)
+        # ts_epoch/d_local — теми же определениями, что и в настоящей схеме.
+        from database.migrations import add_time_columns
+        add_time_columns(self.conn, "mailing_logs", "sent_at")
+        add_time_columns(self.conn, "actions", "timestamp")
+        from database import reachability
+        self.conn.executescript(reachability.SCHEMA_SQL)
 
     def mailing(self, user_id, status, when, error=None):
         # Формат журнала рассылок: без 'T' и без часового пояса.
@@ -74,9 +82,10 @@ def main():
     os.close(fd)
     try:
         db = FakeDB(path)
-        # Метод не трогает состояние объекта, поэтому проверяем реальный код
-        # на подставной базе, не поднимая всю настоящую.
+        # Методы не трогают состояние объекта, кроме conn, поэтому проверяем
+        # реальный код на подставной базе, не поднимая всю настоящую.
         db.get_unreachable_user_ids = Database.get_unreachable_user_ids.__get__(db)
+        db.record_reachability = Database.record_reachability.__get__(db)
 
         long_ago = datetime(2025, 12, 2, 10, 17, 41)
         yesterday = datetime.now() - timedelta(days=1)
@@ -91,6 +100,8 @@ def main():
         db.reminder(104, ok=False, when=yesterday)             # свежая блокировка
         db.reminder(106, ok=False, when=yesterday)             # известен только по напоминаниям
 
+        from database import reachability
+        reachability.backfill(db.conn)
         unreachable = db.get_unreachable_user_ids()
 
         print("Признак недоступности:")
@@ -107,6 +118,22 @@ def main():
         members = [101, 102, 103, 104, 105, 106]
         recipients = [uid for uid in members if uid not in unreachable]
         check("в рассылку уходят только достижимые", recipients, [101, 103, 105])
+
+        print("Сигналы в момент отправки:")
+        db.record_reachability(102, "sent")
+        db.record_reachability(101, "blocked", "Forbidden: bot was blocked by the user")
+        db.record_reachability(103, "failed", "Timed out")
+        unreachable = db.get_unreachable_user_ids()
+        check("успешная отправка снимает блокировку", 102 in unreachable, False)
+        check("блокировка при отправке видна сразу", 101 in unreachable, True)
+        check("сетевой сбой блокировкой не считается", 103 in unreachable, False)
+        reachability.record(db.conn, 104, "sent", ts=int(long_ago.timestamp()))
+        db.conn.commit()
+        check("запоздавший старый сигнал свежий не перетирает",
+              104 in db.get_unreachable_user_ids(), True)
+        check("ошибка сохраняется",
+              db.conn.execute("SELECT last_error FROM user_reachability WHERE user_id = 101").fetchone()[0],
+              "Forbidden: bot was blocked by the user")
     finally:
         try:
             os.unlink(path)
@@ -0,0 +1,107 @@
+"""
+Тест экрана медленных запросов (modules/admin/slow_queries.py).
+
+Запуск:  python tests/test_slow_queries.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * длинный отчёт укладывается в лимит сообщения Telegram целыми строками:
+    раньше text[:4090] резал HTML посреди <code> или сущности, и Telegram
+    отказывался разбирать сообщение;
+  * о не влезших строках говорит «…и ещё N»;
+  * короткий отчёт выводится целиком и без этой строки.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN = 777
+os.environ["ADMIN_ID"] = str(ADMIN)  # до импорта config
+
+from modules.admin.slow_queries import MESSAGE_LIMIT, show_admin_slow_queries  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+class FakeLoggingService:
+    async def log_action(self, user_id, action, details=None):
+        pass
+
+
+class FakeProfiler:
+    threshold_ms = 50.0
+
+    def __init__(self, statements: int):
+        # Кавычки и < раздувают текст при экранировании: 180 символов SQL дают
+        # почти тысячу символов HTML.
+        sql = "SELECT * FROM actions WHERE details LIKE '%\"<x>\"%' AND " * 4
+        self.statements = [{"sql": sql, "ms": 900 - n, "method": "get_actions", "at": "12:00:00",
+                            "rows": 10, "plan": "SCAN actions " + "\"<>\" " * 60} for n in range(statements)]
+
+    def top_methods(self, limit):
+        return [{"method": f"get_metric_{n}", "total_ms": 1000.0, "calls": 3, "avg_ms": 333.3, "max_ms": 500.0}
+                for n in range(limit)]
+
+    def slowest(self, limit):
+        return self.statements[:limit]
+
+
+def render(profiler) -> str:
+    message = FakeMessage()
+    db = SimpleNamespace(profiler=profiler)
+    asyncio.run(show_admin_slow_queries(message, db, FakeLoggingService(), ADMIN))
+    return message.texts[-1]
+
+
+def balanced(text: str) -> bool:
+    return all(text.count(f"<{tag}>") == text.count(f"</{tag}>") for tag in ("b", "i", "code"))
+
+
+def main():
+    print("Длинный отчёт")
+    text = render(FakeProfiler(statements=5))
+    check("в лимите сообщения", len(text) <= MESSAGE_LIMIT, True)
+    check("теги не разрезаны", balanced(text), True)
+    more = re.search(r"…и ещё (\d+)", text)
+    check("есть строка «…и ещё N»", more is not None, True)
+    shown = text.count("<code>get_actions</code>")
+    check("N — число не показанных запросов", int(more.group(1)) if more else None, 5 - shown)
+
+    print("Короткий отчёт")
+    text = render(FakeProfiler(statements=1))
+    check("показан целиком", text.count("<code>get_actions</code>"), 1)
+    check("без «…и ещё»", "и ещё" in text, False)
+
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
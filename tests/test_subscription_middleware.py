@@ -13,7 +13,11 @@
   * подписка не турникет — при любой ошибке пользователь проходит дальше (fail-open);
   * обращение к Telegram не чаще раза в сутки на человека;
   * на callback'ах к Telegram не ходим вовсе и НЕ отмечаем проверку сделанной,
-    иначе нажатие кнопки «съест» приглашение для следующего сообщения.
+    иначе нажатие кнопки «съест» приглашение для следующего сообщения;
+  * с настоящей базой обычный апдейт не делает ни одного запроса, отметки о
+    проверке переживают перезапуск, а завершение первой карты сразу видно
+    middleware (кэш database/subscription_cache.py); вытеснение из кэша и
+    кэш размера 0 не превращают завершивших карту в незавершивших.
 """
 import ast
 import asyncio
@@ -21,6 +25,7 @@ import io
 import logging
 import os
 import sys
+import tempfile
 from datetime import datetime, date, timedelta
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -28,6 +33,10 @@ sys.path.insert(0, ROOT)
 
 from aiogram import types  # noqa: E402
 
+from database.async_db import call_db  # noqa: E402
+from database.db import Database  # noqa: E402
+from database.subscription_cache import SubscriptionCache  # noqa: E402
+
 logging.disable(logging.CRITICAL)
 
 SRC = io.open(os.path.join(ROOT, "main.py"), encoding="utf-8").read()
@@ -50,6 +59,7 @@ class FakeBot:
 class FakeDB:
     def __init__(self, completed=True):
         self.completed = completed
+        self.subscriptions = SubscriptionCache()
 
     def has_completed_scenario_first_time(self, uid, scenario):
         return self.completed
@@ -60,6 +70,9 @@ class FakeDB:
     def save_action(self, *args):
         pass
 
+    def save_subscription_check(self, uid, day, status):
+        self.subscriptions.mark_checked(uid, day, status)
+
 
 class QuietLogger:
     def warning(self, *a, **k): pass
@@ -87,11 +100,10 @@ def build():
         "TIMEZONE": None,
         "bot": FakeBot(),
         "CHANNEL_ID": "@ch",
+        "call_db": call_db,
     }
     exec(ast.get_source_segment(SRC, CLS), ns)
-    mw = ns["SubscriptionMiddleware"]()
-    mw._checked_on.clear()
-    return mw
+    return ns["SubscriptionMiddleware"]()
 
 
 USER = types.User(id=1, is_bot=False, first_name="T", username="t")
@@ -117,22 +129,82 @@ def check(label, condition, detail):
     return condition
 
 
+async def run_with_database():
+    """Тот же middleware поверх настоящей Database во временном каталоге."""
+    ok = True
+    path = os.path.join(tempfile.mkdtemp(), "bot.db")
+    db = Database(path)
+    session_id = db.start_user_scenario(1, "card_of_day", session_id="1_card_of_day_mw")
+
+    reset(status="left")
+    mw = build()
+    await mw(handler, msg(), {"db": db})
+    db.complete_user_scenario(1, "card_of_day", session_id)
+    await mw(handler, msg(), {"db": db})
+    ok &= check("завершил первую карту — приглашение на следующем сообщении",
+                state["api_calls"] == 1 and state["invites"] == 1,
+                f'api={state["api_calls"]} invites={state["invites"]}')
+
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    for _ in range(5):
+        await mw(handler, msg(), {"db": db})
+        await mw(handler, cb(), {"db": db})
+    db.conn.set_trace_callback(None)
+    ok &= check("обычный апдейт — ни запросов к базе, ни к Telegram",
+                not statements and state["api_calls"] == 1,
+                f'запросов={len(statements)} api={state["api_calls"]}')
+    db.close()
+
+    reset(status="left")
+    db = Database(path)
+    await mw(handler, msg(), {"db": db})
+    ok &= check("после перезапуска проверка за сегодня не повторяется",
+                state["api_calls"] == 0 and db.subscriptions.first_card(1) is True,
+                f'api={state["api_calls"]} first_card={db.subscriptions.first_card(1)}')
+    db.close()
+
+    for size in (1, 0):
+        db = Database(path, subscription_cache_size=size)
+        for uid in (21, 22):
+            sid = db.start_user_scenario(uid, "card_of_day_nature", session_id=f"{uid}_card_of_day_evict")
+            db.complete_user_scenario(uid, "card_of_day", sid)
+        # Завершил до появления subscription_checks: есть только строка сессии с колодой
+        with db.conn:
+            db.conn.execute("INSERT INTO user_scenarios (user_id, scenario, started_at, status, session_id)"
+                            " VALUES (23, 'card_of_day_nature', '2026-01-01', 'completed', '23_old')")
+        answers = [db.has_completed_scenario_first_time(uid, "card_of_day") for uid in (21, 22, 23, 21, 24)]
+        ok &= check(f"кэш размера {size} — промах читает базу, а не кэширует «нет»",
+                    answers == [True, True, True, True, False], f'ответы={answers}')
+        db.close()
+
+    small = SubscriptionCache(maxsize=2)
+    for uid in (1, 2, 3):
+        small.mark_checked(uid, date.today())
+    ok &= check("кэш ограничен maxsize — вытесняется самый старый",
+                not small.checked(1, date.today()) and small.checked(3, date.today()),
+                f'stats={small.stats()}')
+    return ok
+
+
 async def run_all():
     types.Message.answer = fake_answer
     ok = True
 
     reset()
     mw = build()
+    fdb = FakeDB()
     for _ in range(5):
-        await mw(handler, cb(), {"db": FakeDB()})
+        await mw(handler, cb(), {"db": fdb})
     ok &= check("callback ×5 — Telegram не дёргаем",
                 state["api_calls"] == 0 and state["handler_calls"] == 5,
                 f'api={state["api_calls"]} handler={state["handler_calls"]}')
 
     reset()
     mw = build()
+    fdb = FakeDB()
     for _ in range(5):
-        await mw(handler, msg(), {"db": FakeDB()})
+        await mw(handler, msg(), {"db": fdb})
     ok &= check("message ×5 за день — максимум 1 запрос",
                 state["api_calls"] == 1 and state["invites"] == 1,
                 f'api={state["api_calls"]} invites={state["invites"]}')
@@ -140,58 +212,67 @@ async def run_all():
     reset(raise_=True)
     state["raise"] = True
     mw = build()
+    fdb = FakeDB()
     for _ in range(4):
-        await mw(handler, msg(), {"db": FakeDB()})
+        await mw(handler, msg(), {"db": fdb})
     ok &= check("сетевая ошибка — fail-open, 1 попытка в день",
                 state["api_calls"] == 1 and state["handler_calls"] == 4,
                 f'api={state["api_calls"]} handler={state["handler_calls"]}')
 
     reset(status="left")
     mw = build()
+    fdb = FakeDB()
     for _ in range(3):
-        await mw(handler, msg(), {"db": FakeDB()})
+        await mw(handler, msg(), {"db": fdb})
     ok &= check("неподписанный — приглашение раз в сутки",
                 state["invites"] == 1, f'invites={state["invites"]}')
 
     reset(status="member")
     mw = build()
+    fdb = FakeDB()
     for _ in range(3):
-        await mw(handler, msg(), {"db": FakeDB()})
+        await mw(handler, msg(), {"db": fdb})
     ok &= check("подписанный — приглашения нет",
                 state["invites"] == 0 and state["api_calls"] == 1,
                 f'invites={state["invites"]} api={state["api_calls"]}')
 
     reset(status="left")
     mw = build()
+    fdb = FakeDB()
     for _ in range(10):
-        await mw(handler, cb(), {"db": FakeDB()})
-    await mw(handler, msg(), {"db": FakeDB()})
+        await mw(handler, cb(), {"db": fdb})
+    await mw(handler, msg(), {"db": fdb})
     ok &= check("callback'и не съедают приглашение",
                 state["invites"] == 1 and state["api_calls"] == 1,
                 f'после 10 callback\'ов message получил invites={state["invites"]}')
 
     reset()
     mw = build()
-    await mw(handler, msg(ADMIN), {"db": FakeDB()})
+    fdb = FakeDB()
+    await mw(handler, msg(ADMIN), {"db": fdb})
     ok &= check("админ — без запросов",
                 state["api_calls"] == 0 and state["handler_calls"] == 1,
                 f'api={state["api_calls"]}')
 
     reset()
     mw = build()
-    await mw(handler, msg(), {"db": FakeDB(completed=False)})
+    fdb = FakeDB(completed=False)
+    await mw(handler, msg(), {"db": fdb})
     ok &= check("не завершал card_of_day — без запросов",
                 state["api_calls"] == 0 and state["handler_calls"] == 1,
                 f'api={state["api_calls"]}')
 
     reset(status="left")
     mw = build()
-    await mw(handler, msg(), {"db": FakeDB()})
-    mw._checked_on[1] = date.today() - timedelta(days=1)
-    await mw(handler, msg(), {"db": FakeDB()})
+    fdb = FakeDB()
+    await mw(handler, msg(), {"db": fdb})
+    fdb.subscriptions.day = date.today() - timedelta(days=1)  # шард проверок остался от вчера
+    await mw(handler, msg(), {"db": fdb})
     ok &= check("новый день — проверка повторяется",
                 state["api_calls"] == 2, f'api={state["api_calls"]}')
 
+    ok &= await run_with_database()
+
     print("\nИТОГ:", "все проверки пройдены" if ok else "ЕСТЬ ПАДЕНИЯ")
     return ok
 
@@ -0,0 +1,179 @@
+"""
+Тест метрик апдейтов (modules/update_metrics.py).
+
+Запуск:  python tests/test_update_metrics.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Апдейты прогоняются через настоящий Dispatcher aiogram с сессией бота, которая
+никуда не ходит, и настоящую Database во временном каталоге.
+
+Что защищаем:
+  * время пишется по хендлеру, состоянию FSM и префиксу callback_data без чисел;
+  * SQL-запросы апдейта считаются и на соединении Database, и в потоках db.aio —
+    и не считаются вне апдейта (фоновые задачи, рассылки);
+  * вызовы Telegram API считаются через middleware сессии;
+  * упавший хендлер тоже попадает в метрики — как ошибка;
+  * число ключей в разрезе ограничено.
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram import Bot, Dispatcher, F, types  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.filters import Command  # noqa: E402
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from database.async_db import AsyncDatabase, call_db  # noqa: E402
+from database.db import Database  # noqa: E402
+from modules import update_metrics as um  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+class OfflineSession(BaseSession):
+    """Сессия бота без сети: любой метод API успешно возвращает True."""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+USER = types.User(id=7, is_bot=False, first_name="T")
+CHAT = types.Chat(id=7, type="private")
+
+
+def message_update(update_id, text):
+    message = types.Message(message_id=update_id, date=datetime.now(), chat=CHAT, from_user=USER, text=text)
+    return types.Update(update_id=update_id, message=message)
+
+
+def callback_update(update_id, data):
+    message = types.Message(message_id=update_id, date=datetime.now(), chat=CHAT, from_user=USER, text="x")
+    callback = types.CallbackQuery(id=str(update_id), from_user=USER, chat_instance="ci", data=data, message=message)
+    return types.Update(update_id=update_id, callback_query=callback)
+
+
+def by_key(metrics, group):
+    return {item["key"]: item for item in metrics.top(group, 50)}
+
+
+async def run(db):
+    bot = Bot(token="42:TEST", session=OfflineSession())
+    dp = Dispatcher(storage=MemoryStorage())
+    metrics = um.UpdateMetrics(window=50)
+    dp.update.outer_middleware(metrics)
+    dp.message.middleware(metrics.mark_handler)
+    dp.callback_query.middleware(metrics.mark_handler)
+    bot.session.middleware(um.ApiCallCounter())
+
+    async def card_handler(message: types.Message, state: FSMContext):
+        db.get_user(message.from_user.id)
+        await message.bot.send_chat_action(message.chat.id, "typing")
+        await message.bot.send_chat_action(message.chat.id, "typing")
+        await state.set_state("UserState:waiting_for_initial_response")
+
+    async def aio_handler(message: types.Message):
+        await call_db(db, "get_user_cards", message.from_user.id)  # в потоке читателя db.aio
+
+    async def answer_handler(message: types.Message, state: FSMContext):
+        await state.clear()
+
+    async def page_handler(callback: types.CallbackQuery):
+        await callback.answer()
+
+    async def broken_handler(message: types.Message):
+        raise RuntimeError("хендлер упал")
+
+    dp.message.register(card_handler, Command("card"))
+    dp.message.register(aio_handler, Command("aio"))
+    dp.message.register(broken_handler, Command("broken"))
+    dp.message.register(answer_handler, F.text)
+    dp.callback_query.register(page_handler)
+
+    print("Разрезы")
+    await dp.feed_update(bot, message_update(1, "/card"))
+    await dp.feed_update(bot, message_update(2, "ответ"))
+    await dp.feed_update(bot, message_update(3, "/aio"))
+    for n, data in enumerate(("admin_users_page_3", "admin_users_page_4", "author_ans:2:1", "deck_choice_nature")):
+        await dp.feed_update(bot, callback_update(10 + n, data))
+    handlers = by_key(metrics, "handler")
+    check("ключи хендлеров", sorted(handlers),
+          sorted(f"run.<locals>.{name}" for name in ("card_handler", "answer_handler", "aio_handler", "page_handler")))
+    card = handlers["run.<locals>.card_handler"]
+    check("запросы к базе посчитаны", card["avg_statements"] > 0, True)
+    check("и из потока db.aio", handlers["run.<locals>.aio_handler"]["avg_statements"] > 0, True)
+    check("вызовы Telegram API посчитаны", card["avg_api_calls"], 2.0)
+    check("состояние, с которым пришёл апдейт", by_key(metrics, "state")["UserState:waiting_for_initial_response"]["count"], 1)
+    check("префиксы callback_data без чисел", sorted(by_key(metrics, "callback")),
+          ["admin_users_page", "author_ans", "deck_choice_nature"])
+    check("answerCallbackQuery — вызов API кнопки",
+          by_key(metrics, "handler")["run.<locals>.page_handler"]["avg_api_calls"], 1.0)
+    check("p50 <= p95 <= p99 <= max", card["p50"] <= card["p95"] <= card["p99"] <= card["max"], True)
+
+    print("Ошибки и вне апдейта")
+    try:
+        await dp.feed_update(bot, message_update(20, "/broken"))
+    except RuntimeError:
+        pass
+    check("упавший хендлер посчитан как ошибка", by_key(metrics, "handler")["run.<locals>.broken_handler"]["errors"], 1)
+    before = metrics.updates
+    db.get_user(USER.id)
+    await bot.send_chat_action(CHAT.id, "typing")
+    check("вне апдейта ничего не пишется", (metrics.updates, len(metrics.groups["handler"])), (before, 5))
+
+    print("Ограничение ключей")
+    record = um.UpdateRecord()
+    for n in range(um.MAX_KEYS + 10):
+        metrics._add("callback", f"k{n}", 1.0, record, False)
+    check("ключей не больше MAX_KEYS + прочие", len(metrics.groups["callback"]), um.MAX_KEYS + 1)
+    check("лишнее — в прочие", metrics.groups["callback"][um.OTHER_KEY].count, 10 + 3)
+
+    metrics.add_source("users", db.get_user_cache_stats)
+    check("статистика источников", "hits" in metrics.source_stats()["users"], True)
+    metrics.reset()
+    check("сброс", (metrics.updates, metrics.top("handler")), (0, []))
+    await bot.session.close()
+
+
+def main():
+    check("callback_prefix: числа в середине", um.callback_prefix("author_p2:3:1"), "author_p2")
+    check("callback_prefix: v2 не число", um.callback_prefix("feedback_v2_helped_15"), "feedback_v2_helped")
+
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "bot.db"))
+    AsyncDatabase(db, readers=1)
+    asyncio.run(run(db))
+    db.aio.close()
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Тест частичного обновления пользователя (Database.update_user).
+
+Запуск:  python tests/test_update_user.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Раньше update_user делал INSERT OR REPLACE всех колонок и затирал то, что не
+передали. Что защищаем:
+  * last_request_nature, last_request_message и gender переживают обновление
+    других полей;
+  * first_seen ставится один раз: ни повторная передача, ни обновление без него
+    его не меняют;
+  * неизвестный ключ пропускается, а остальные поля того же вызова записываются;
+  * новый пользователь получает те же умолчания, что создаёт get_user.
+"""
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def row(db, user_id):
+    """Строка users из базы в обход кэша get_user."""
+    found = db.conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return dict(found) if found else None
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "bot.db"))
+    nature_at = datetime(2026, 9, 1, 10, 0)
+    message_at = datetime(2026, 9, 2, 11, 30)
+    first_seen = datetime(2026, 8, 15, 9, 0)
+
+    print("Новый пользователь")
+    db.update_user(1, {"name": "Аня", "first_seen": first_seen})
+    created = row(db, 1)
+    check("строка создана", created["name"], "Аня")
+    check("умолчания как у get_user", (created["username"], created["bonus_available"]), ("", 0))
+    check("first_seen из вызова", created["first_seen"], first_seen.isoformat())
+
+    print("Обновление других полей")
+    db.update_user(1, {"last_request_nature": nature_at, "last_request_message": message_at, "gender": "female"})
+    db.update_user(1, {"reminder_time": "09:00"})
+    db.update_user(1, {"name": "Анна", "bonus_available": True})
+    updated = row(db, 1)
+    check("last_request_nature сохранился", updated["last_request_nature"], nature_at.isoformat())
+    check("last_request_message сохранился", updated["last_request_message"], message_at.isoformat())
+    check("gender сохранился", updated["gender"], "female")
+    check("reminder_time сохранился", updated["reminder_time"], "09:00")
+    check("переданные поля записаны", (updated["name"], updated["bonus_available"]), ("Анна", 1))
+
+    print("first_seen ставится один раз")
+    db.update_user(1, {"first_seen": datetime(2026, 10, 1, 12, 0)})
+    check("повторная передача не меняет", row(db, 1)["first_seen"], first_seen.isoformat())
+    db.update_user(1, {"username": "anna"})
+    check("обновление без него не меняет", row(db, 1)["first_seen"], first_seen.isoformat())
+    db.conn.execute("UPDATE users SET first_seen = NULL WHERE user_id = 1")
+    db.conn.commit()
+    db.update_user(1, {"first_seen": first_seen})
+    check("пустой — заполняется", row(db, 1)["first_seen"], first_seen.isoformat())
+
+    print("Неизвестный ключ")
+    db.update_user(1, {"no_such_column": "x", "name": "Аня"})
+    check("остальные поля записаны", row(db, 1)["name"], "Аня")
+    check("колонка не появилась", "no_such_column" in row(db, 1), False)
+    before = row(db, 1)
+    db.update_user(1, {"no_such_column": "x"})
+    check("вызов только с неизвестным ключом ничего не меняет", row(db, 1), before)
+    db.update_user(2, {"no_such_column": "x"})
+    check("и заводит пустого пользователя, как get_user", row(db, 2)["name"], "")
+
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
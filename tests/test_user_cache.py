@@ -0,0 +1,163 @@
+"""
+Тест кэша get_user (Database.user_cache, database/cache.py).
+
+Запуск:  python tests/test_user_cache.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * повторный get_user отдаётся из кэша, без запроса к базе;
+  * запись через update_user и update_user_first_seen видна следующему get_user —
+    и на том же соединении, и через потоки db.aio;
+  * чтение, которое шло из базы одновременно с записью, не кладёт в кэш
+    устаревшую строку (поколения LRUCache);
+  * наружу отдаются копии: правка словаря вызывающим не портит кэш;
+  * запись в обход Database становится видна не позже чем через ttl.
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.async_db import AsyncDatabase  # noqa: E402
+from database.cache import MISSING  # noqa: E402
+from database.db import Database  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def statements(db, func):
+    """Сколько SQL-запросов сделал func на соединении db."""
+    seen = []
+    db.conn.set_trace_callback(seen.append)
+    try:
+        func()
+    finally:
+        db.conn.set_trace_callback(None)
+    return len(seen)
+
+
+def clear_first_seen(db, user_id):
+    with db.conn:
+        db.conn.execute("UPDATE users SET first_seen = NULL WHERE user_id = ?", (user_id,))
+
+
+def scenario_writes(db):
+    print("Запись видна следующему чтению")
+    db.get_user(1)
+    check("повторное чтение — без запроса к базе", statements(db, lambda: db.get_user(1)), 0)
+    db.update_user(1, {"name": "Аня"})
+    check("update_user", db.get_user(1)["name"], "Аня")
+    db.update_user(1, {"reminder_time": "08:30"})
+    check("update_user другого поля", (db.get_user(1)["name"], db.get_user(1)["reminder_time"]), ("Аня", "08:30"))
+
+    clear_first_seen(db, 1)
+    db.user_cache.clear()
+    check("first_seen пуст и закэширован", db.get_user(1)["first_seen"], None)
+    first_seen = datetime(2026, 9, 1, 10, 0)
+    db.update_user_first_seen(1, first_seen)
+    check("update_user_first_seen", db.get_user(1)["first_seen"], first_seen.isoformat())
+
+
+def scenario_copies(db):
+    print("Копии")
+    user = db.get_user(2)
+    user["name"] = "испорчено"
+    user["bonus_available"] = True
+    fresh = db.get_user(2)
+    check("правка словаря не попала в кэш", (fresh["name"], fresh["bonus_available"]), ("", False))
+    check("каждый вызов — новый словарь", db.get_user(2) is db.get_user(2), False)
+
+
+def scenario_race(db):
+    print("Чтение наперегонки с записью")
+    db.get_user(3)
+    db.user_cache.invalidate(3)
+    loaded, release = threading.Event(), threading.Event()
+    load_user = db._load_user
+    results = []
+
+    def slow_load(user_id):
+        row = load_user(user_id)
+        loaded.set()          # строка прочитана, но ещё не в кэше
+        release.wait(5)
+        return row
+
+    db._load_user = slow_load
+    reader = threading.Thread(target=lambda: results.append(db.get_user(3)))
+    reader.start()
+    loaded.wait(5)
+    db.update_user(3, {"name": "новое"})
+    release.set()
+    reader.join(5)
+    del db._load_user
+
+    check("гонка: читатель получил то, что прочитал", results[0]["name"], "")
+    check("устаревшая строка не попала в кэш", db.user_cache.get(3) is MISSING, True)
+    check("следующее чтение видит запись", db.get_user(3)["name"], "новое")
+
+
+async def scenario_aio(db):
+    print("Через db.aio")
+    adb = AsyncDatabase(db, readers=2)
+    try:
+        await adb.get_user(4)
+        await adb.update_user(4, {"name": "Бо"})
+        check("читатель видит запись писателя", (await adb.get_user(4))["name"], "Бо")
+        check("и основное соединение", db.get_user(4)["name"], "Бо")
+        first_seen = datetime(2026, 9, 2, 11, 0)
+        await adb.run_write(clear_first_seen, 4)
+        db.user_cache.clear()
+        await adb.get_user(4)
+        await adb.update_user_first_seen(4, first_seen)
+        check("update_user_first_seen через писателя", (await adb.get_user(4))["first_seen"], first_seen.isoformat())
+    finally:
+        adb.close()
+
+
+def scenario_ttl(tmp):
+    print("Запись в обход Database")
+    db = Database(os.path.join(tmp, "ttl.db"), user_cache_ttl=0.1)
+    db.get_user(5)
+    db.conn.execute("UPDATE users SET name = 'снаружи' WHERE user_id = 5")
+    db.conn.commit()
+    check("до ttl — из кэша", db.get_user(5)["name"], "")
+    time.sleep(0.15)
+    check("после ttl — из базы", db.get_user(5)["name"], "снаружи")
+    db.close()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db = Database(os.path.join(tmp, "bot.db"))
+    scenario_writes(db)
+    scenario_copies(db)
+    scenario_race(db)
+    asyncio.run(scenario_aio(db))
+    db.close()
+    scenario_ttl(tmp)
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
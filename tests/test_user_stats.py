@@ -0,0 +1,113 @@
+"""
+Тест счётчиков личной статистики (database/user_stats.py).
+
+Запуск:  python tests/test_user_stats.py
+Код возврата 0 — все проверки пройдены, 1 — есть падения.
+
+Что защищаем:
+  * серии дней: продолжение, разрыв, повтор в тот же день, старт задним числом;
+  * гистограммы по московскому времени, а не по UTC;
+  * живое обновление из start/complete_user_scenario даёт ту же строку, что и
+    заполнение по истории в миграции — в том числе когда завершение без
+    session_id закрывает сразу несколько открытых сессий.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.db import Database, TIMEZONE  # noqa: E402
+from database import user_stats  # noqa: E402
+
+failures = []
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print(f"  OK   {name}")
+    else:
+        print(f"  FAIL {name}: ожидалось {expected}, получено {actual}")
+        failures.append(name)
+
+
+def start(db, user_id, started_at, status="completed", steps=4):
+    """Старт сценария в заданное время — то же, что делает start/complete_user_scenario."""
+    with db.conn:
+        db.conn.execute(
+            "INSERT INTO user_scenarios (user_id, scenario, started_at, status, steps_count) VALUES (?, 'card_of_day', ?, ?, ?)",
+            (user_id, started_at.isoformat(), status, steps))
+        db.conn.execute(user_stats.START_SQL, user_stats.start_params(user_id, started_at))
+        if status == "completed":
+            db.conn.execute(user_stats.COMPLETE_SQL, {"user_id": user_id, "sessions": 1, "steps": steps})
+
+
+def msk(*args):
+    return TIMEZONE.localize(datetime(*args))
+
+
+def row(db, user_id):
+    return tuple(db.conn.execute("SELECT * FROM user_stats WHERE user_id = ?", (user_id,)).fetchone())
+
+
+def main():
+    db = Database(os.path.join(tempfile.mkdtemp(), "stats.db"))
+    day = msk(2026, 3, 2, 8, 30)                          # понедельник, утро по Москве
+
+    print("Серии дней")
+    for offset in (0, 1, 2):                              # три дня подряд
+        start(db, 1, day + timedelta(days=offset))
+    start(db, 1, day + timedelta(days=2, hours=5), status="in_progress")  # тот же день
+    start(db, 1, day + timedelta(days=5))                 # разрыв
+    start(db, 1, day + timedelta(days=6))
+    start(db, 1, day - timedelta(days=10))                # задним числом
+
+    stats = db.get_user_advanced_stats(1)
+    check("максимальная серия", stats["max_consecutive_days"], 3)
+    check("текущая серия", stats["current_streak"], 2)
+    check("уникальные дни", stats["total_unique_days"], 6)
+    check("первый день сдвинулся назад", stats["first_day"], "2026-02-20")
+    check("последний день", stats["last_day"], "2026-03-08")
+    check("процент завершения", stats["completion_rate"], round(6 / 7 * 100, 1))
+    check("средняя глубина", stats["avg_session_depth"], 4.0)
+
+    print("Время по Москве")
+    check("любимое время — утро", stats["favorite_time"], "утро (6-12)")
+    # 02:30 по Москве — ещё ночь, хотя по UTC это 23:30 предыдущего дня
+    start(db, 2, msk(2026, 3, 3, 2, 30))
+    night = db.get_user_advanced_stats(2)
+    check("ночной старт — ночь", night["favorite_time"], "ночь (0-6)")
+    check("ночной старт — вторник по Москве", night["favorite_day"], "вторник")
+
+    print("Живое обновление и заполнение по истории")
+    session = db.start_user_scenario(3, "evening_reflection")
+    db.log_scenario_step(3, "evening_reflection", "started", {"session_id": session})
+    db.complete_user_scenario(3, "evening_reflection", session)
+    check("новичок без истории", db.get_user_advanced_stats(4)["favorite_time"], "нет данных")
+
+    # Две открытые сессии, завершение без session_id закрывает обе
+    start(db, 5, msk(2026, 3, 4, 9, 0), status="in_progress", steps=3)
+    start(db, 5, msk(2026, 3, 4, 10, 0), status="in_progress", steps=5)
+    db.complete_user_scenario(5, "card_of_day")
+    completed, steps = db.conn.execute(
+        "SELECT completed_sessions, total_steps FROM user_stats WHERE user_id = 5").fetchone()
+    check("две сессии разом: шаги не умножены на число сессий", (completed, steps), (2, 8))
+
+    live = {uid: row(db, uid) for uid in (1, 2, 3, 5)}
+    user_stats.backfill(db.conn)
+    check("заполнение по истории совпадает с живыми счётчиками",
+          {uid: row(db, uid) for uid in (1, 2, 3, 5)}, live)
+
+    db.close()
+    print()
+    if failures:
+        print(f"ПАДЕНИЙ: {len(failures)} — {', '.join(failures)}")
+        return 1
+    print("Все проверки пройдены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
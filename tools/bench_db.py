@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк базы: время каждого публичного метода Database и каждого экрана админки.
+
+Разовые замеры (bench_update_user, index_advisor) отвечали на один вопрос и не
+ловили медленное сползание: метрика, которая полгода назад считалась за 20 мс,
+незаметно доходила до секунды. Здесь один прогон на одной и той же синтетике
+(tools/synthetic_data.py, размер 10k/100k/1m) с отчётом в JSON, который
+сравнивается с отчётом прошлого коммита:
+
+  1. база — синтетика нужного размера или копия существующей (исходник не трогается);
+  2. кэши get_user и снимков админки выключены, чтобы мерить запросы, а не кэш;
+  3. сначала читающие методы, потом пишущие (на отдельном пользователе), последним
+     archive_actions — он переносит строки и меняет базу под остальными;
+  4. каждый случай — медиана --repeat повторов; методы без случая перечисляются
+     в отчёте, чтобы новый метод не выпал из замеров молча;
+  5. с --baseline случаи, ставшие медленнее в --threshold раз и хотя бы на
+     --min-ms, помечаются как регрессии, и код возврата 1.
+
+Запуск:
+    python tools/bench_db.py --scale 10k --json bench.json
+    python tools/bench_db.py --scale 10k --json new.json --baseline bench.json
+    python tools/bench_db.py /data/bot.db [--repeat 5] [--threshold 1.5] [--min-ms 2]
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Экраны админки проверяют ID; база — временная копия, отправлять боту нечего
+os.environ.setdefault("ADMIN_ID", "1")
+
+from config import ADMIN_IDS, TIMEZONE
+from database.db import Database
+from modules.logging_service import LoggingService
+from tools.index_advisor import StubMessage, admin_views, prepare
+from tools.synthetic_data import SCALES
+
+BENCH_USER = 999_000_001
+# Не методы работы с данными или меняют сам объект Database
+EXCLUDED = {
+    "close": "закрывает соединение",
+    "enable_write_behind": "переключает режим записи, а не работает с данными",
+    "decode_date": "конвертер типов sqlite3",
+    "decode_timestamp": "конвертер типов sqlite3",
+}
+
+
+# --- Случаи ---
+
+def read_cases(ctx: dict) -> list:
+    """[(метод, *аргументы)] для читающих методов."""
+    user, today = ctx["user_id"], ctx["today"]
+    cases = []
+    for days in (1, 7, 30):
+        cases += [
+            ("get_retention_metrics", days), ("get_dau_metrics", days),
+            ("get_scenario_stats", "card_of_day", days), ("get_scenario_stats", "evening_reflection", days),
+            ("get_scenario_step_stats", "card_of_day", days),
+            ("get_card_funnel_metrics", days), ("get_card_funnel_metrics", days, True),
+            ("get_value_metrics", days), ("get_value_metrics", days, True),
+            ("get_deck_popularity_metrics", days), ("get_evening_reflection_metrics", days),
+            ("get_user_requests_stats", days), ("get_user_requests_sample", 10, days),
+            ("get_new_users_stats", days), ("get_users_with_recent_reflections", days),
+            ("get_admin_dashboard_summary", days, True),
+        ]
+    cases += [
+        ("get_cohort_retention_matrix", 30, 30), ("get_unreachable_user_ids",), ("get_reminder_times",),
+        ("get_all_users",), ("get_all_posts",), ("get_all_mailings",), ("get_pending_mailings",),
+        ("get_post", ctx["post_id"]), ("get_mailing", ctx["mailing_id"]), ("get_mailing_stats", 1),
+        ("get_author_test_stats", 30), ("get_author_test_session", user),
+        ("get_actions", user), ("get_actions", None, ctx["now"] - timedelta(days=1)),
+        ("iter_actions", user), ("iter_actions", user, None, None, None, None, ("timestamp",), None, True),
+        ("get_user", user), ("get_user_profile", user), ("get_user_first_seen", user),
+        ("get_user_advanced_stats", user), ("get_user_scenario_history", user),
+        ("get_user_requests_by_user", user), ("get_user_cards", user, "nature"), ("count_user_cards", user),
+        ("get_referrals", user), ("get_last_recharge_method", user),
+        ("get_reflections_for_last_n_days", user, 7), ("get_all_reflection_texts", user),
+        ("get_last_reflection_date", user), ("count_reflections", user),
+        ("get_today_card_of_the_day", user), ("is_card_available", user, today),
+        ("is_deck_available", user, "nature", today), ("has_completed_scenario_first_time", user, "card_of_day"),
+        ("is_admin", user), ("get_training_progress", user), ("get_training_session", ctx["training_id"]),
+        ("get_user_training_sessions", user),
+        ("get_event_buffer_stats",), ("get_user_cache_stats",), ("get_subscription_cache_stats",),
+    ]
+    return cases
+
+
+def write_cases(ctx: dict) -> list:
+    """[(метод, *аргументы)] для пишущих методов: всё на BENCH_USER и его собственных записях."""
+    user, now = BENCH_USER, ctx["now"]
+    session = f"{user}_card_of_day_bench"
+    return [
+        ("update_user", user, {"name": "bench", "reminder_time": "09:00"}),
+        ("update_user_first_seen", user, now), ("update_user_profile", user, {"mood": "calm"}),
+        ("save_action", user, "bench", "bench", "card_drawn_direct", {"deck": "nature"}, now),
+        ("start_user_scenario", user, "card_of_day", session),
+        ("log_scenario_step", user, "card_of_day", "card_drawn", {"session_id": session, "card_number": 1}),
+        ("complete_user_scenario", user, "card_of_day", session),
+        ("abandon_user_scenario", user, "evening_reflection"),
+        ("save_user_request", user, "bench", session, 1),
+        ("save_evening_reflection", user, now.date().isoformat(), "bench", "bench", None, now),
+        ("add_user_card", user, 1), ("reset_user_cards", user), ("add_referral", user, user + 1),
+        ("add_recharge_method", user, "walk", now),
+        ("save_subscription_check", user, now.date(), "member"),
+        ("record_reachability", user, "sent"), ("log_mailing_result", ctx["mailing_id"], user, "sent"),
+        ("update_mailing_status", ctx["mailing_id"], "completed", 1, 0),
+        ("update_post", ctx["post_id"], "bench"),
+        ("save_author_test_progress", user, 1, {"1": 2}, 2, 0, []), ("complete_author_test", user, "green"),
+        ("reset_author_test", user), ("cancel_author_test", user),
+        ("init_training_progress", user), ("update_training_progress", user, {"sessions_completed": 1}),
+        ("update_training_session", ctx["training_id"], {"attempts": 1}),
+        ("flush_events",), ("refresh_rollups",), ("rebuild_rollups",),
+        ("create_tables",), ("create_indexes",), ("create_author_tables",),
+        ("create_post", "bench", "bench", user), ("create_mailing", ctx["post_id"], "bench", False, user, [user]),
+        ("start_training_session", user), ("delete_post", ctx["post_id"]),
+    ]
+
+
+def context(db: Database) -> dict:
+    """Аргументы случаев: самый активный пользователь и служебные записи, созданные до замеров."""
+    row = db.conn.execute("SELECT user_id FROM scenario_logs GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    now = datetime.now(TIMEZONE)
+    post_id = db.create_post("bench", "bench", BENCH_USER)
+    return {
+        "user_id": row[0] if row else BENCH_USER,
+        "now": now,
+        "today": now.date(),
+        "post_id": post_id,
+        "mailing_id": db.create_mailing(post_id, "bench", False, BENCH_USER, [BENCH_USER]),
+        "training_id": db.start_training_session(BENCH_USER),
+    }
+
+
+# --- Замеры ---
+
+def label(name: str, args) -> str:
+    """Имя случая для сравнения отчётов: даты заменены типом, чтобы не меняться от запуска к запуску."""
+    shown = [f"<{type(a).__name__}>" if hasattr(a, "isoformat") else repr(a) for a in args]
+    return f"{name}({', '.join(shown)})"
+
+
+def call_method(db: Database, name: str, args):
+    """Вызов метода; генератор (iter_actions) дочитывается до конца, иначе мерить нечего."""
+    result = getattr(db, name)(*args)
+    if inspect.isgenerator(result):
+        for _ in result:
+            pass
+    return result
+
+
+def measure(call, repeat: int, warmup: bool = False) -> dict:
+    """Медиана и лучший из repeat вызовов, мс. warmup — ещё один вызов до замеров (прогрев кэша страниц)."""
+    if warmup:
+        call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3), "runs": repeat}
+
+
+def run_cases(db: Database, repeat: int) -> dict:
+    ctx = context(db)
+    results = {}
+    for name, *args in read_cases(ctx):
+        results[label(name, args)] = measure(lambda: call_method(db, name, args), repeat, warmup=True)
+    for name, *args in write_cases(ctx):
+        results[label(name, args)] = measure(lambda: call_method(db, name, args), repeat)
+
+    if ADMIN_IDS:
+        admin_id = int(ADMIN_IDS[0])
+        service = LoggingService(log_dir=tempfile.mkdtemp())
+        service.db = db
+        loop = asyncio.new_event_loop()
+        try:
+            for view, *args in admin_views():
+                call = lambda: loop.run_until_complete(view(StubMessage(), db, service, admin_id, *args))
+                results[label(f"admin:{view.__name__}", args)] = measure(call, repeat, warmup=True)
+        finally:
+            loop.close()
+
+    # Один раз и последним: переносит строки старше 30 дней в архив
+    results[label("archive_actions", [30])] = measure(lambda: db.archive_actions(30), 1)
+    return results
+
+
+def uncovered(results: dict) -> list:
+    public = {name for name, _ in inspect.getmembers(Database, inspect.isfunction) if not name.startswith("_")}
+    covered = {key.split("(", 1)[0] for key in results}
+    return sorted(public - covered - set(EXCLUDED))
+
+
+def meta(db: Database, args, users) -> dict:
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], capture_output=True, text=True, timeout=10,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    tables = ("users", "actions", "scenario_logs", "user_scenarios", "evening_reflections",
+              "mailing_logs", "user_requests", "user_cards")
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "created": datetime.now(TIMEZONE).isoformat(timespec="seconds"),
+        "source": args.db_path or f"synthetic:{users}",
+        "days": args.days,
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "rows": {t: db.conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in tables},
+    }
+
+
+# --- Сравнение ---
+
+def compare(report: dict, baseline: dict, threshold: float, min_ms: float) -> list:
+    """
+    [(случай, было мс, стало мс)] для случаев, ставших медленнее порога. Сравнивается
+    лучший из повторов: медиана на загруженной машине гуляет в полтора раза.
+    """
+    regressions = []
+    for name, result in report["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if before and result["min_ms"] > before["min_ms"] * threshold and result["min_ms"] - before["min_ms"] >= min_ms:
+            regressions.append((name, before["min_ms"], result["min_ms"]))
+    return regressions
+
+
+def print_report(report: dict, baseline: dict = None, regressions=(), top: int = 20):
+    cases = report["cases"]
+    total = sum(c["ms"] for c in cases.values())
+    print(f"\nСлучаев: {len(cases)}, сумма медиан {total:.1f} мс"
+          f" (коммит {report['meta']['commit'] or '?'}, SQLite {report['meta']['sqlite']})")
+    print(f"\nСамые медленные ({min(top, len(cases))}):")
+    for name, c in sorted(cases.items(), key=lambda item: item[1]["ms"], reverse=True)[:top]:
+        was = (baseline or {}).get("cases", {}).get(name)
+        diff = f"  было {was['ms']:9.2f}" if was else ""
+        print(f"  {c['ms']:9.2f} мс{diff}  {name}")
+
+    if report["uncovered"]:
+        print(f"\nМетоды без случая: {', '.join(report['uncovered'])}")
+    if baseline is None:
+        return
+    missing = sorted(set(baseline.get("cases", {})) - set(cases))
+    if missing:
+        print(f"\nСлучаи из базового отчёта, которых нет сейчас: {len(missing)}")
+    print(f"\nРегрессии относительно {baseline['meta'].get('commit') or 'базового отчёта'}:")
+    for name, before, after in sorted(regressions, key=lambda r: r[2] - r[1], reverse=True):
+        print(f"  {before:9.2f} → {after:9.2f} мс  x{after / before if before else float('inf'):.2f}  {name}")
+    if not regressions:
+        print("    нет")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database и экранов админки")
+    parser.add_argument("db_path", nargs="?", help="база, с которой снимается копия")
+    parser.add_argument("--scale", choices=SCALES, help="синтетика на 10k, 100k или 1m пользователей")
+    parser.add_argument("--users", type=int, help="синтетика на произвольное число пользователей")
+    parser.add_argument("--days", type=int, default=90, help="глубина истории синтетики")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов на случай")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.5, help="во сколько раз медленнее — регрессия")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="минимальное замедление в мс — меньшее считается шумом")
+    args = parser.parse_args()
+    users = SCALES[args.scale] if args.scale else args.users
+    if not args.db_path and not users:
+        parser.error("нужен путь к базе, --scale или --users")
+    if args.db_path and not os.path.exists(args.db_path):
+        print(f"Ошибка: База данных {args.db_path} не найдена.")
+        return 1
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.synthetic = users
+        prepared = prepare(args, workdir)
+        path = prepared.path
+        prepared.close()
+        # Заново без кэшей: get_user, флаг первой карты и снимки админки должны каждый раз идти в базу
+        db = Database(path, user_cache_size=0, dashboard_ttl=0, subscription_cache_size=0)
+        info = meta(db, args, users)
+        results = run_cases(db, args.repeat)
+        db.close()
+
+    report = {"meta": info, "cases": results, "uncovered": uncovered(results)}
+    regressions = compare(report, baseline, args.threshold, args.min_ms) if baseline else []
+    print_report(report, baseline, regressions)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчёт: {args.json}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
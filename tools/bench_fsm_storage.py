@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Накладные расходы SQLiteStorage (database/fsm_storage.py) на один апдейт против MemoryStorage.
+
+Апдейт воспроизводит то, что делает шаг «Карты дня»: FSMContextMiddleware читает
+состояние, хендлер читает data, дописывает в неё пару ключей и переводит в
+следующее состояние. Пользователи чередуются, как в живом потоке. Фоновая запись
+SQLiteStorage работает во время замера, её время в потоке добавляется к итогу —
+то есть в «на апдейт» входит и доля сброса на диск.
+
+Апдейты растягиваются на --flushes интервалов записи. Раньше 20000 апдейтов
+укладывались в доли секунды, и за замер случался один сброс — в итог попадала
+одна-единственная запись на диск, а не установившийся режим. Теперь сбросов
+несколько, и печатается время одного сброса (среднее и максимум) и строк на
+сброс. В «мкс/апдейт» входит только время самих апдейтов и сбросов, паузы между
+пачками апдейтов не считаются.
+
+Запуск:
+    python tools/bench_fsm_storage.py [--users 1000] [--updates 20000] [--interval-ms 500] [--flushes 10]
+
+С --interval-ms 5 изменения почти не склеиваются — худший случай, около строки
+на апдейт.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database.db import Database
+from database.fsm_storage import SQLiteStorage
+
+BOT_ID = 1
+STATES = ("UserState:waiting_for_initial_resource", "UserState:waiting_for_request_text_input",
+          "UserState:waiting_for_initial_response", "UserState:waiting_for_grok_response")
+LIMIT_MS = 1.0
+
+
+async def one_update(storage, key, n):
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    data.update(session_id=f"{key.user_id}_card_of_day", step=n, user_request="Что мне сейчас важно? " * 3)
+    await storage.set_data(key, data)
+    await storage.set_state(key, STATES[n % len(STATES)])
+
+
+async def run(storage, users, updates, duration_sec: float = 0.0) -> float:
+    """Прогоняет апдейты пачками по 50, растянув их на duration_sec. Возвращает время самих апдейтов."""
+    keys = [StorageKey(bot_id=BOT_ID, chat_id=1_000_000 + i, user_id=1_000_000 + i) for i in range(users)]
+    pause = duration_sec / max(updates // 50, 1)
+    busy = 0.0
+    started = time.perf_counter()
+    for n in range(updates):
+        await one_update(storage, keys[n % users], n)
+        if n % 50 == 49:
+            busy += time.perf_counter() - started
+            await asyncio.sleep(pause)  # отдаём цикл фоновой записи, как между апдейтами в боте
+            started = time.perf_counter()
+    return busy + time.perf_counter() - started
+
+
+async def main_async(args):
+    memory_sec = await run(MemoryStorage(), args.users, args.updates)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        storage = SQLiteStorage(db.path, interval_ms=args.interval_ms)
+        storage.start()
+        sqlite_sec = await run(storage, args.users, args.updates, args.flushes * args.interval_ms / 1000)
+        await storage.flush()
+        stats = storage.stats()
+        flush_sec = storage.total_flush_ms / 1000
+        await storage.close()
+
+        restarted = SQLiteStorage(db.path)
+        loaded = len(restarted.records)
+        restarted.conn.close()
+        db.close()
+
+    memory_us = memory_sec / args.updates * 1e6
+    sqlite_us = (sqlite_sec + flush_sec) / args.updates * 1e6
+    overhead_ms = (sqlite_us - memory_us) / 1000
+    print(f"Апдейтов: {args.updates}, пользователей: {args.users}")
+    print(f"MemoryStorage             {memory_us:8.1f} мкс/апдейт")
+    print(f"SQLiteStorage             {sqlite_us:8.1f} мкс/апдейт (с долей записи на диск)")
+    print(f"  сбросов: {stats['flushes']}, строк записано: {stats['written_rows']}"
+          f" ({stats['written_rows'] / args.updates:.2f} на апдейт,"
+          f" {stats['written_rows'] / max(stats['flushes'], 1):.0f} на сброс)")
+    print(f"  один сброс: в среднем {stats['avg_flush_ms']:.1f} мс, max {stats['max_flush_ms']:.1f} мс")
+    if stats["flushes"] < args.flushes:
+        print(f"  ! сбросов меньше запрошенных {args.flushes}: замер ближе к одиночной записи, чем к потоку")
+    print(f"  после перезапуска загружено: {loaded} из {args.users}")
+    verdict = "в пределах" if overhead_ms < LIMIT_MS else "ПРЕВЫШЕН"
+    print(f"\nНакладные расходы: {overhead_ms * 1000:.1f} мкс на апдейт — бюджет {LIMIT_MS:.0f} мс {verdict}")
+    return 0 if overhead_ms < LIMIT_MS else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк SQLiteStorage против MemoryStorage")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--interval-ms", type=int, default=500)
+    parser.add_argument("--flushes", type=int, default=10, help="на сколько интервалов записи растянуть апдейты")
+    args = parser.parse_args()
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение скорости update_user: старый INSERT OR REPLACE против частичного UPSERT.
+
+Старый вариант воспроизведён здесь же (get_user + INSERT OR REPLACE всех колонок),
+чтобы сравнивать на одной и той же базе и одной и той же нагрузке: обновление
+last_request_nature при вытягивании карты, как в draw_card_direct.
+
+Запуск:
+    python tools/bench_update_user.py [--users 500] [--updates 5000] [--cache]
+
+По умолчанию кэш get_user выключен, чтобы старый вариант честно платил за чтение
+перед записью, как было до кэша. С --cache видно, сколько остаётся при тёплом кэше.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import Database
+
+
+def legacy_update_user(db, user_id, data):
+    """update_user в том виде, в каком он был до перехода на UPSERT."""
+    current = db.get_user(user_id)
+    last_request = data.get("last_request", current.get("last_request"))
+    if isinstance(last_request, datetime):
+        last_request = last_request.isoformat()
+    first_seen = current.get("first_seen") or data.get("first_seen") or datetime.now().isoformat()
+    with db.conn:
+        db.conn.execute("""
+            INSERT OR REPLACE INTO users (user_id, name, username, last_request, reminder_time, reminder_time_evening, bonus_available, first_seen, last_request_nature, last_request_message)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, data.get("name", current.get("name", "")), data.get("username", current.get("username", "")),
+              last_request, data.get("reminder_time", current.get("reminder_time")),
+              data.get("reminder_time_evening", current.get("reminder_time_evening")),
+              int(data.get("bonus_available", current.get("bonus_available", False))), first_seen,
+              data.get("last_request_nature"), data.get("last_request_message")))
+    db._invalidate_user(user_id)
+
+
+def run(label, db, update, users, updates):
+    started = time.perf_counter()
+    for i in range(updates):
+        update(db, 1_000_000 + i % users, {"last_request_nature": datetime.now().isoformat()})
+    elapsed = time.perf_counter() - started
+    rate = updates / elapsed if elapsed else float("inf")
+    print(f"{label:<28} {updates} обновлений за {elapsed:.2f} с — {rate:,.0f} записей/с")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк update_user")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--cache", action="store_true", help="не выключать кэш get_user")
+    args = parser.parse_args()
+
+    rates = {}
+    for label, update in (("INSERT OR REPLACE (старый)", legacy_update_user),
+                          ("UPSERT по колонкам (новый)", Database.update_user)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"), user_cache_size=2048 if args.cache else 0)
+            for i in range(args.users):
+                db.update_user(1_000_000 + i, {"name": f"user{i}", "reminder_time": "09:00", "gender": "female"})
+            rates[label] = run(label, db, update, args.users, args.updates)
+
+            kept = db.conn.execute(
+                "SELECT COUNT(*) FROM users WHERE reminder_time = '09:00' AND gender = 'female'").fetchone()[0]
+            print(f"{'':<28} сохранили reminder_time и gender: {kept} из {args.users}")
+            db.close()
+
+    old, new = rates.values()
+    print(f"\nУскорение: x{new / old:.2f}")
+
+
+if __name__ == "__main__":
+    main()
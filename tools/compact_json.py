@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Переписывает actions.details и scenario_logs.metadata в компактный JSON
+(database/json_codec.py) и показывает, сколько байт сэкономлено.
+
+Новые строки бот уже пишет компактно; инструмент нужен один раз для истории.
+Строки переписываются порциями, каждая в своей транзакции, поэтому запускать
+можно на работающей базе. Повторный запуск ничего не меняет.
+
+Запуск:
+    python tools/compact_json.py /data/bot.db [--batch 1000] [--archives] [--vacuum]
+
+--archives — то же для месячных архивов actions (database/archive.py),
+--vacuum   — вернуть освободившиеся страницы файлу базы (нужен auto_vacuum=INCREMENTAL,
+             см. tools/enable_incremental_vacuum.py).
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import archive
+from database.db import Database
+from database.json_codec import DEFAULT_BATCH, compact_column
+
+COLUMNS = (("actions", "details"), ("scenario_logs", "metadata"))
+
+
+def report(label, rewritten, before, after):
+    saved = before - after
+    pct = saved / before * 100 if before else 0
+    print(f"{label:<40} строк: {rewritten:>8}  байт: {before:>11} -> {after:>11}  (-{saved}, {pct:.0f}%)")
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компактный JSON в actions/scenario_logs")
+    parser.add_argument("db_path")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--archives", action="store_true", help="обработать и месячные архивы actions")
+    parser.add_argument("--vacuum", action="store_true", help="вернуть свободные страницы файлу базы")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_path):
+        print(f"Ошибка: База данных {args.db_path} не найдена.")
+        return 1
+
+    db = Database(args.db_path)
+    total = 0
+    for table, column in COLUMNS:
+        total += report(f"{table}.{column}", *compact_column(db.conn, table, column, args.batch))
+
+    if args.archives:
+        for month, file in db.conn.execute("SELECT month, file FROM actions_archive ORDER BY month").fetchall():
+            path = os.path.join(db.archive_dir, file)
+            if not os.path.exists(path):
+                print(f"{file:<40} файл не найден, пропущен")
+                continue
+            arch = sqlite3.connect(path)
+            try:
+                total += report(file, *compact_column(arch, "actions", "details", args.batch))
+            finally:
+                arch.close()
+
+    if args.vacuum:
+        freed = archive.compact(db.conn)
+        print(f"Освобождено страниц: {freed}")
+    print(f"\nИтого сэкономлено: {total} байт")
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Переводит базу бота на auto_vacuum=INCREMENTAL (database/archive.py).
+
+Без этого ежедневный архив actions не возвращает место файлу: compact пропускает
+базу и пишет об этом в лог. Перевод — полный VACUUM: файл переписывается целиком
+и всё это время заблокирован, а на диске нужно ещё столько же места под копию.
+Поэтому запускать один раз и только при остановленном боте. Повторный запуск
+ничего не делает.
+
+Запуск:
+    python tools/enable_incremental_vacuum.py /data/bot.db
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перевод базы на auto_vacuum=INCREMENTAL")
+    parser.add_argument("db_path")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_path):
+        print(f"Ошибка: База данных {args.db_path} не найдена.")
+        return 1
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        size_before = os.path.getsize(args.db_path)
+        started = time.perf_counter()
+        if not archive.enable_incremental_vacuum(conn):
+            print("База уже на auto_vacuum=INCREMENTAL, ничего не сделано.")
+            return 0
+        print(f"Готово за {time.perf_counter() - started:.1f} с: "
+              f"{size_before} -> {os.path.getsize(args.db_path)} байт, "
+              f"auto_vacuum={conn.execute('PRAGMA auto_vacuum').fetchone()[0]}")
+    except sqlite3.Error as e:
+        print(f"Ошибка: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Импорт старых data/*.json (состояние бота до SQLite) в базу — database/legacy_import.py.
+
+Файлы читаются потоково и пишутся короткими транзакциями по --batch строк,
+поэтому запускать можно на работающей базе. Повторный запуск ничего не
+дублирует. По каждому файлу печатается, сколько прочитано и записано и с какой
+скоростью.
+
+Запуск:
+    python tools/import_legacy.py /data/bot.db [--data data] [--batch 1000]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import Database
+from database.json_codec import DEFAULT_BATCH
+from database.legacy_import import import_legacy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт data/*.json в SQLite")
+    parser.add_argument("db_path")
+    parser.add_argument("--data", default="data", help="каталог со старыми JSON-файлами")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        print(f"Ошибка: каталог {args.data} не найден.")
+        return 1
+
+    db = Database(args.db_path)
+    reports = import_legacy(db.conn, args.data, db.archive_dir, args.batch)
+    for r in reports:
+        bad = f"  битых: {r['bad']}" if r["bad"] else ""
+        print(f"{r['file']:<22} прочитано: {r['read']:>8}  записано: {r['written']:>8}"
+              f"  {r['seconds']:>7.2f} с  {r['rows_per_sec']:>8} строк/с{bad}")
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
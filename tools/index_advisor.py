@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Советчик индексов по реальной нагрузке: какие индексы ускорят метрики и админку.
+
+Индексы в create_indexes и в шагах миграций добавлялись по месту, и было
+неясно, каких не хватает (actions(action, timestamp)? mailing_logs(user_id,
+sent_at)?) и какие не нужны. Инструмент отвечает замером, а не догадкой:
+
+  1. берёт копию базы (исходный файл не трогается) или строит синтетическую
+     (tools/synthetic_data.py);
+  2. прогоняет нагрузку — метрические методы Database, экраны админки
+     modules/admin/* и запросы заранее заданных кандидатов (SEED_CANDIDATES) —
+     и записывает через трассировку все SELECT;
+  3. для каждого запроса меряет время (медиана повторов) и разбирает EXPLAIN
+     QUERY PLAN: полные проходы (SCAN) и временные B-деревья для GROUP BY /
+     ORDER BY / DISTINCT;
+  4. из колонок условий, группировок и сортировок проблемных запросов собирает
+     кандидатов, создаёт каждый по очереди, меряет до и после запросы, чей план
+     его выбрал, считает размер индекса (dbstat) и удаляет его;
+  5. печатает кандидатов, давших ускорение, и индексы, которые не попали ни в
+     один план.
+
+Ускорение считается только по запросам, которые выбрали кандидата. Раньше
+до/после складывались по всем запросам к таблице, и кандидат, которого не брал
+ни один план, получал «ускорение» из шума замеров. Кандидат без таких запросов
+ускорения не получает и в отчёте помечен отдельно.
+
+Запуск:
+    python tools/index_advisor.py /data/bot.db            # копия боевой базы
+    python tools/index_advisor.py --synthetic 5000        # синтетика на 5000 человек
+    [--repeat 5] [--min-speedup 1.2] [--min-saved-ms 1] [--candidate "actions(action, ts_epoch)"] [--json report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import ADMIN_IDS
+from database.db import Database
+from database.profiler import normalize_sql
+from modules.logging_service import LoggingService
+
+# Кандидаты, о которых спрашивали заранее, и запросы, ради которых спрашивали.
+# Кандидат проверяется всегда, даже если планы на него не указали, а его запрос
+# входит в нагрузку: без запроса, который может выбрать индекс, замер до/после
+# ничего не говорит. :user_id — самый активный пользователь базы.
+SEED_CANDIDATES = {
+    # напоминания за неделю (reminder_sent по всем пользователям)
+    ("actions", ("action", "ts_epoch")):
+        "SELECT user_id, ts_epoch FROM actions WHERE action = 'reminder_sent'"
+        " AND ts_epoch >= CAST(strftime('%s', 'now') AS INTEGER) - 7 * 86400",
+    # последняя рассылка человеку
+    ("mailing_logs", ("user_id", "sent_at")):
+        "SELECT mailing_id, status, sent_at FROM mailing_logs WHERE user_id = :user_id ORDER BY sent_at DESC LIMIT 1",
+    # запросы пользователей за неделю по текстовому времени
+    ("user_requests", ("timestamp",)):
+        "SELECT user_id, request_text FROM user_requests WHERE timestamp >= datetime('now', '-7 days')"
+        " ORDER BY timestamp DESC",
+}
+MAX_INDEX_COLUMNS = 3
+
+_SQL_KEYWORDS = {"where", "join", "left", "inner", "cross", "on", "group", "order", "limit", "union",
+                 "natural", "using", "having", "window", "as", "outer", "full", "right"}
+_FROM = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_PLAN_TARGET = re.compile(r"^(SCAN|SEARCH) (\w+)")
+_PLAN_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+_TEMP_BTREE = re.compile(r"USE TEMP B-TREE FOR (GROUP BY|ORDER BY|DISTINCT|RIGHT PART OF ORDER BY|LAST TERM OF ORDER BY)")
+_CLAUSE_END = r"(?=\bLIMIT\b|\bHAVING\b|\bORDER\b|\bWINDOW\b|\)|;|$)"
+
+
+# --- Подготовка базы ---
+
+def prepare(args, workdir: str) -> Database:
+    path = os.path.join(workdir, "advisor.db")
+    if args.db_path:
+        # backup API, а не копирование файла: заберёт и то, что ещё лежит в WAL
+        src = sqlite3.connect(f"file:{args.db_path}?mode=ro", uri=True)
+        dst = sqlite3.connect(path)
+        src.backup(dst)
+        dst.close()
+        src.close()
+        db = Database(path)
+    else:
+        from tools.synthetic_data import populate
+        db = Database(path)
+        print(f"Строю синтетическую базу: {args.synthetic} пользователей, {args.days} дней...")
+        populate(db, args.synthetic, args.days)
+    with db.conn:
+        db.conn.execute("ANALYZE")
+    return db
+
+
+# --- Нагрузка ---
+
+class StubMessage:
+    """Сообщение-заглушка для экранов админки: текст никуда не отправляется."""
+
+    def __init__(self):
+        self.texts = []
+        self.bot = None
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+    async def answer(self, text, **kwargs):
+        self.texts.append(text)
+
+
+def _db_workload(db: Database, user_id: int) -> list:
+    """Метрические и админские методы Database с типичными аргументами."""
+    calls = []
+    for days in (1, 7, 30):
+        calls += [
+            ("get_retention_metrics", days), ("get_dau_metrics", days),
+            ("get_scenario_stats", "card_of_day", days), ("get_scenario_stats", "evening_reflection", days),
+            ("get_scenario_step_stats", "card_of_day", days),
+            ("get_card_funnel_metrics", days), ("get_card_funnel_metrics", days, True),
+            ("get_value_metrics", days), ("get_value_metrics", days, True),
+            ("get_deck_popularity_metrics", days), ("get_evening_reflection_metrics", days),
+            ("get_user_requests_stats", days), ("get_user_requests_sample", 10, days),
+            ("get_new_users_stats", days), ("get_users_with_recent_reflections", days),
+        ]
+    calls += [
+        ("get_cohort_retention_matrix", 30, 30), ("get_unreachable_user_ids",), ("get_reminder_times",),
+        ("get_all_users",), ("get_all_posts",), ("get_all_mailings",), ("get_pending_mailings",),
+        ("get_author_test_stats", 30), ("get_mailing_stats", 1),
+        ("get_user_advanced_stats", user_id), ("get_actions", user_id), ("get_user_profile", user_id),
+        ("get_user_scenario_history", user_id), ("get_user_requests_by_user", user_id),
+        ("get_reflections_for_last_n_days", user_id, 7), ("get_today_card_of_the_day", user_id),
+    ]
+    return calls
+
+
+def admin_views() -> list:
+    """Экраны админки с типичными аргументами: [(view, *args)], вызов view(message, db, service, admin_id, *args)."""
+    from modules.admin import cohorts, dashboard, posts, training_logs, user_segments, users
+    from modules.admin.author_test_stats import show_admin_author_test_stats
+
+    return [
+        (dashboard.show_admin_dashboard, 7), (dashboard.show_admin_retention,), (dashboard.show_admin_funnel, 7),
+        (dashboard.show_admin_value, 7), (dashboard.show_admin_decks, 7), (dashboard.show_admin_reflections, 7),
+        (dashboard.show_admin_recent_reflections, 7), (dashboard.show_admin_logs,),
+        (cohorts.show_admin_cohorts,), (users.show_admin_users,), (users.show_admin_users_list,),
+        (users.show_admin_requests,), (users.show_admin_requests_full,),
+        (user_segments.show_admin_user_segments,), (training_logs.show_admin_training_logs,),
+        (training_logs.show_admin_training_stats,), (training_logs.show_admin_training_users,),
+        (show_admin_author_test_stats,), (posts.show_posts_list,), (posts.show_mailings_list,),
+    ]
+
+
+async def _admin_workload(db: Database, admin_id: int):
+    """Экраны админки с тем же доступом к базе, что в боте."""
+    service = LoggingService(log_dir=tempfile.mkdtemp())
+    service.db = db
+    views = admin_views()
+    for view, *args in views:
+        try:
+            await view(StubMessage(), db, service, admin_id, *args)
+        except Exception as e:
+            print(f"  ! {view.__name__}: {e}")
+
+
+def capture_workload(db: Database) -> dict:
+    """Прогоняет нагрузку и возвращает {нормализованный SELECT: пример с литералами}."""
+    admin_id = int(ADMIN_IDS[0]) if ADMIN_IDS else 0
+    row = db.conn.execute("SELECT user_id FROM scenario_logs GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    user_id = row[0] if row else admin_id
+
+    statements = {}
+
+    def trace(sql):
+        head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        if head in ("SELECT", "WITH"):
+            statements.setdefault(normalize_sql(sql), sql)
+
+    db.conn.set_trace_callback(trace)
+    try:
+        for name, *args in _db_workload(db, user_id):
+            getattr(db, name)(*args)
+        for sql in SEED_CANDIDATES.values():
+            db.conn.execute(sql, {"user_id": user_id}).fetchall()
+        if admin_id:
+            asyncio.run(_admin_workload(db, admin_id))
+        else:
+            print("ADMIN_ID не задан — экраны админки пропущены, только методы Database.")
+    finally:
+        db.conn.set_trace_callback(None)
+    return statements
+
+
+# --- Планы и замеры ---
+
+def table_columns(conn) -> dict:
+    tables = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {t: [r[1] for r in conn.execute(f"PRAGMA table_xinfo({t})")] for t in tables}
+
+
+def existing_indexes(conn) -> dict:
+    """{имя индекса: (таблица, колонки)} без автоиндексов PRIMARY KEY/UNIQUE."""
+    result = {}
+    for name, table in conn.execute(
+            "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"):
+        result[name] = (table, tuple(r[2] for r in conn.execute(f"PRAGMA index_xinfo({name})") if r[5]))
+    return result
+
+
+def expand_views(conn, sql: str) -> str:
+    """Текст запроса вместе с определениями VIEW, на которые он ссылается (для алиасов)."""
+    views = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall())
+    seen, text, queue = set(), sql, [sql]
+    while queue:
+        for name, _ in _FROM.findall(queue.pop()):
+            if name in views and name not in seen:
+                seen.add(name)
+                text += "\n" + views[name]
+                queue.append(views[name])
+    return text
+
+
+def aliases(text: str, tables: dict) -> dict:
+    result = {}
+    for table, alias in _FROM.findall(text):
+        if table in tables:
+            result[table] = table
+            if alias and alias.lower() not in _SQL_KEYWORDS:
+                result[alias] = table
+    return result
+
+
+def explain(conn, sql: str) -> list[str]:
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def problems(plan: list[str], alias_map: dict) -> list[tuple[str, str]]:
+    """[(таблица, 'scan' | 'temp b-tree ...')] по плану."""
+    found, last_table = [], None
+    for line in plan:
+        target = _PLAN_TARGET.match(line)
+        if target:
+            last_table = alias_map.get(target.group(2))
+            if target.group(1) == "SCAN" and last_table:
+                found.append((last_table, "scan"))
+        btree = _TEMP_BTREE.search(line)
+        if btree and last_table:
+            found.append((last_table, "temp b-tree " + btree.group(1).lower()))
+    return found
+
+
+def time_query(conn, sql: str, repeat: int) -> float:
+    """Медиана времени выполнения с выборкой всех строк, мс."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _columns_in(pattern: str, text: str, columns: list[str]) -> list[str]:
+    found = []
+    for column in columns:
+        if re.search(pattern.format(col=re.escape(column)), text, re.IGNORECASE) and column not in found:
+            found.append(column)
+    return found
+
+
+def candidates_for(sql: str, table: str, columns: list[str]) -> list[tuple[str, ...]]:
+    """Кандидаты индексов по колонкам table, встречающимся в условиях и группировках."""
+    ref = r"(?<![\w'])(?:\w+\.)?{col}\b"
+    equality = _columns_in(ref + r"\s*(?:=|\bIN\b|\bIS\b)", sql, columns)
+    ranged = [c for c in _columns_in(ref + r"\s*(?:>=|<=|>|<|\bBETWEEN\b|\bLIKE\b)", sql, columns)
+              if c not in equality]
+    grouped = []
+    for clause in re.findall(r"\b(?:GROUP|ORDER)\s+BY\s+(.+?)" + _CLAUSE_END, sql, re.IGNORECASE | re.DOTALL):
+        grouped += [c for c in _columns_in(ref, clause, columns) if c not in grouped]
+
+    result = []
+    for tail in ([ranged[0]] if ranged else []), grouped, []:
+        cols = tuple(dict.fromkeys(equality + tail))[:MAX_INDEX_COLUMNS]
+        if cols and cols not in result:
+            result.append(cols)
+    return result
+
+
+def index_size(conn, name: str) -> int:
+    try:
+        return conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def parse_candidate(text: str) -> tuple[str, tuple[str, ...]]:
+    match = re.fullmatch(r"\s*(\w+)\s*\(([^)]*)\)\s*", text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"ожидалось table(col1, col2): {text}")
+    return match.group(1), tuple(c.strip() for c in match.group(2).split(",") if c.strip())
+
+
+# --- Отчёт ---
+
+def rowid_aliases(conn, tables) -> set:
+    """(таблица, колонка) для INTEGER PRIMARY KEY: индекс по ней дублирует rowid."""
+    return {(t, r[1]) for t in tables for r in conn.execute(f"PRAGMA table_info({t})")
+            if r[5] == 1 and r[2].upper() == "INTEGER"}
+
+
+def advise(db: Database, statements: dict, repeat: int, min_speedup: float, min_saved_ms: float,
+           extra=()) -> dict:
+    conn = db.conn
+    tables = table_columns(conn)
+    indexes = existing_indexes(conn)
+
+    queries, used_indexes = [], set()
+    for normalized, sql in statements.items():
+        try:
+            plan = explain(conn, sql)
+            elapsed = time_query(conn, sql, repeat)
+        except sqlite3.Error as e:
+            print(f"  ! пропущен запрос ({e}): {normalized[:100]}")
+            continue
+        for line in plan:
+            used_indexes.update(_PLAN_INDEX.findall(line))
+        alias_map = aliases(expand_views(conn, sql), tables)
+        queries.append({"sql": normalized, "example": sql, "ms": elapsed, "plan": plan,
+                        "tables": sorted(set(alias_map.values())), "problems": problems(plan, alias_map)})
+
+    proposed = {}
+    for query in queries:
+        text = expand_views(conn, query["example"])
+        for table, _ in query["problems"]:
+            for cols in candidates_for(text, table, tables[table]):
+                proposed.setdefault((table, cols), set()).add(query["sql"])
+    for table, cols in list(SEED_CANDIDATES) + list(extra):
+        if table in tables and all(c in tables[table] for c in cols):
+            proposed.setdefault((table, cols), set())
+    # Кандидат, который уже является префиксом существующего индекса, ничего не даст
+    existing_prefixes = {(t, c[:n]) for t, c in indexes.values() for n in range(1, len(c) + 1)}
+    rowids = rowid_aliases(conn, tables)
+    proposed = {key: value for key, value in proposed.items()
+                if key not in existing_prefixes and (key[0], key[1][0]) not in rowids}
+
+    results = []
+    for n, ((table, cols), sources) in enumerate(sorted(proposed.items()), 1):
+        affected = [q for q in queries if table in q["tables"]]
+        name = f"advisor_candidate_{n}"
+        conn.execute(f"CREATE INDEX {name} ON {table}({', '.join(cols)})")
+        conn.execute(f"ANALYZE {name}")
+        conn.commit()
+        size = index_size(conn, name)
+        # Мерим только запросы, чей план выбрал кандидата: у остальных разница — шум
+        gains = []
+        for query in affected:
+            if any(name in line for line in explain(conn, query["example"])):
+                gains.append({"sql": query["sql"], "before_ms": query["ms"],
+                              "after_ms": time_query(conn, query["example"], repeat)})
+        conn.execute(f"DROP INDEX {name}")
+        conn.commit()
+        before = sum(g["before_ms"] for g in gains)
+        after = sum(g["after_ms"] for g in gains)
+        results.append({
+            "index": f"{table}({', '.join(cols)})", "size_bytes": size,
+            "before_ms": before, "after_ms": after,
+            "speedup": before / after if gains and after else None, "queries_using": gains,
+        })
+
+    # На крошечных таблицах отношение времён — шум, поэтому нужен и абсолютный выигрыш
+    recommended = [r for r in results if r["speedup"] is not None and r["speedup"] >= min_speedup
+                   and r["before_ms"] - r["after_ms"] >= min_saved_ms]
+    unused = [{"index": name, "table": table, "columns": list(cols), "size_bytes": index_size(conn, name)}
+              for name, (table, cols) in sorted(indexes.items()) if name not in used_indexes]
+    return {"queries": queries, "candidates": results, "recommended": recommended, "unused_indexes": unused}
+
+
+def print_report(report: dict, top: int = 15):
+    queries = sorted(report["queries"], key=lambda q: q["ms"], reverse=True)
+    print(f"\nЗапросов в нагрузке: {len(queries)}, суммарно {sum(q['ms'] for q in queries):.1f} мс за прогон")
+    print(f"\nСамые дорогие ({min(top, len(queries))}):")
+    for q in queries[:top]:
+        flags = ", ".join(sorted({f"{t}: {p}" for t, p in q["problems"]})) or "—"
+        print(f"  {q['ms']:8.2f} мс  {q['sql'][:110]}")
+        print(f"              {flags}")
+
+    print("\nРекомендуемые индексы (время — запросы, выбравшие индекс, до → после):")
+    for r in sorted(report["recommended"], key=lambda r: r["before_ms"] - r["after_ms"], reverse=True):
+        print(f"  {r['index']:<50} {r['before_ms']:8.2f} → {r['after_ms']:8.2f} мс"
+              f"  x{r['speedup']:.2f}  {r['size_bytes'] / 1024:8.1f} KiB  запросов: {len(r['queries_using'])}")
+    if not report["recommended"]:
+        print("    нет")
+    rejected = [r for r in report["candidates"] if r not in report["recommended"]]
+    unpicked = [r for r in rejected if r["speedup"] is None]
+    print(f"\nБез заметного эффекта: {len(rejected)} кандидатов, из них ни одним планом не выбраны: {len(unpicked)}")
+    for r in rejected:
+        if r["index"] in {f"{t}({', '.join(c)})" for t, c in SEED_CANDIDATES}:
+            effect = "не выбран ни одним запросом" if r["speedup"] is None else f"x{r['speedup']:.2f}"
+            print(f"  {r['index']:<50} {effect}  запросов: {len(r['queries_using'])}")
+
+    print("\nИндексы, не попавшие ни в один план:")
+    for idx in report["unused_indexes"]:
+        print(f"    {idx['index']:<48} {idx['table']}({', '.join(idx['columns'])})  {idx['size_bytes'] / 1024:8.1f} KiB")
+    if not report["unused_indexes"]:
+        print("    нет")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Советчик индексов по нагрузке метрик и админки")
+    parser.add_argument("db_path", nargs="?", help="база, с которой снимается копия")
+    parser.add_argument("--synthetic", type=int, metavar="USERS", help="синтетическая база на USERS пользователей")
+    parser.add_argument("--days", type=int, default=90, help="глубина истории синтетики")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов на замер")
+    parser.add_argument("--min-speedup", type=float, default=1.2)
+    parser.add_argument("--min-saved-ms", type=float, default=1.0, help="минимальный выигрыш за прогон нагрузки")
+    parser.add_argument("--candidate", action="append", type=parse_candidate, default=[],
+                        help='дополнительный кандидат, например "actions(action, ts_epoch)"')
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+    if not args.db_path and not args.synthetic:
+        parser.error("нужен путь к базе или --synthetic USERS")
+    if args.db_path and not os.path.exists(args.db_path):
+        print(f"Ошибка: База данных {args.db_path} не найдена.")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = prepare(args, workdir)
+        statements = capture_workload(db)
+        report = advise(db, statements, args.repeat, args.min_speedup, args.min_saved_ms, args.candidate)
+        db.close()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчёт: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синтетическая база для замеров: пользователи с «Картой дня», вечерней рефлексией,
+напоминаниями, рассылкой и вытянутыми картами — в тех же форматах времени и
+JSON, что пишет бот.
+
+Активность устроена как у живой аудитории: первый день равномерно по окну,
+дальше человек возвращается с убывающей вероятностью, а небольшое ядро ходит
+почти каждый день. Сессии тяготеют к утру и позднему вечеру (HOUR_WEIGHTS),
+user_cards — карты текущего круга колоды: после сорока круг начинается заново.
+Генератор детерминирован при одинаковом seed.
+
+Запуск:
+    python tools/synthetic_data.py out.db [--users 2000 | --scale 100k] [--days 90] [--seed 1]
+
+Из кода: populate(db, users, days, seed) — заполняет уже открытую Database.
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import Database, TIMEZONE
+from database import reachability, user_stats
+from database.json_codec import dumps
+
+BASE_USER_ID = 1_000_000
+DECKS = ("nature", "message")
+CARD_STEPS = ("scenario_started", "initial_resource_selected", "request_skipped", "card_drawn",
+              "emotion_selected", "usefulness_rating", "mood_change_recorded", "completed")
+EVENING_STEPS = ("scenario_started", "good_moments_provided", "gratitude_provided", "completed")
+BATCH = 20_000
+CARDS_IN_DECK = 40
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+# Доля стартов «Карты дня» по часам (Москва): пик утром и перед сном
+HOUR_WEIGHTS = (1, 1, 0, 0, 0, 1, 3, 8, 10, 9, 6, 5, 5, 4, 4, 4, 4, 5, 6, 7, 8, 9, 8, 4)
+
+
+def _utc(moment: datetime) -> str:
+    """Формат CURRENT_TIMESTAMP: UTC без смещения (scenario_logs, mailing_logs, user_requests)."""
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _visits(rng: random.Random, days: int) -> list[int]:
+    """Дни визитов пользователя (сколько дней назад), от первого к последнему."""
+    first = rng.randrange(days)
+    core = rng.random() < 0.05
+    stay = 0.9 if core else rng.uniform(0.2, 0.6)
+    visits = [first]
+    for day in range(first - 1, -1, -1):
+        if rng.random() < stay:
+            visits.append(day)
+        elif not core and rng.random() < 0.3:
+            break
+    return visits
+
+
+def populate(db: Database, users: int = 2000, days: int = 90, seed: int = 1) -> dict:
+    """Заполняет базу и пересобирает производные таблицы. Возвращает число строк по таблицам."""
+    rng = random.Random(seed)
+    now = datetime.now(TIMEZONE).replace(second=0, microsecond=0)
+    rows = {name: [] for name in ("users", "actions", "scenario_logs", "user_scenarios",
+                                  "evening_reflections", "mailing_logs", "user_requests", "user_cards")}
+    counts = dict.fromkeys(rows, 0)
+
+    sql = {
+        "users": "INSERT OR IGNORE INTO users (user_id, name, username, reminder_time, first_seen) VALUES (?, ?, ?, ?, ?)",
+        "actions": "INSERT INTO actions (user_id, username, name, action, details, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        "scenario_logs": "INSERT INTO scenario_logs (user_id, scenario, step, metadata, timestamp, session_id) VALUES (?, ?, ?, ?, ?, ?)",
+        "user_scenarios": "INSERT INTO user_scenarios (user_id, scenario, started_at, completed_at, steps_count, status, session_id, last_step) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        "evening_reflections": "INSERT INTO evening_reflections (user_id, date, good_moments, gratitude, hard_moments, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        "mailing_logs": "INSERT INTO mailing_logs (mailing_id, user_id, status, error_message, sent_at) VALUES (?, ?, ?, ?, ?)",
+        "user_requests": "INSERT INTO user_requests (user_id, request_text, session_id, card_number, timestamp) VALUES (?, ?, ?, ?, ?)",
+        "user_cards": "INSERT INTO user_cards (user_id, card_number, deck_name) VALUES (?, ?, ?)",
+    }
+
+    def flush(force=False):
+        for name, pending in rows.items():
+            if pending and (force or len(pending) >= BATCH):
+                with db.conn:
+                    db.conn.executemany(sql[name], pending)
+                counts[name] += len(pending)
+                pending.clear()
+
+    with db.conn:
+        db.conn.execute("INSERT OR IGNORE INTO posts (id, title, content, created_by) VALUES (1, 'synthetic', 'synthetic', 0)")
+        db.conn.execute("INSERT OR IGNORE INTO mailings (id, post_id, title, send_to_all, created_by, status)"
+                        " VALUES (1, 1, 'synthetic', 1, 0, 'completed')")
+
+    for n in range(users):
+        user_id = BASE_USER_ID + n
+        username = f"user{n}"
+        visits = _visits(rng, days)
+        first_seen = now - timedelta(days=visits[0])
+        subscribed = rng.random() < 0.6
+        rows["users"].append((user_id, f"Имя {n}", username, "09:00" if subscribed else None, first_seen.isoformat()))
+
+        for days_ago in range(visits[0], -1, -1) if subscribed else ():
+            sent = (now - timedelta(days=days_ago)).replace(hour=9, minute=0)
+            details = {"kind": "morning", "status": "sent"}
+            if days_ago < 20 and user_id % 25 == 0:
+                details = {"kind": "morning", "status": "failed", "error": "Forbidden: bot was blocked by the user"}
+            rows["actions"].append((user_id, username, "", "reminder_sent", dumps(details), sent.isoformat()))
+
+        drawn = {deck: set() for deck in DECKS}
+        for days_ago in visits:
+            hour = rng.choices(range(24), HOUR_WEIGHTS)[0]
+            start = (now - timedelta(days=days_ago)).replace(hour=hour, minute=rng.randrange(60))
+            session_id = f"{user_id}_card_of_day_{start.strftime('%Y%m%d_%H%M%S')}"
+            depth = rng.choice((2, 4, 4, 6, 8, 8, 8))
+            deck = rng.choice(DECKS)
+            card = rng.choice([n for n in range(1, CARDS_IN_DECK + 1) if n not in drawn[deck]])
+            for i, step in enumerate(CARD_STEPS[:depth]):
+                meta = {"session_id": session_id}
+                if step == "card_drawn":
+                    meta.update(deck_name=deck, card_number=card)
+                    drawn[deck].add(card)
+                    if len(drawn[deck]) == CARDS_IN_DECK:
+                        drawn[deck].clear()
+                elif step == "usefulness_rating":
+                    meta["rating"] = rng.choice(("helped", "interesting", "notmine"))
+                elif step == "mood_change_recorded":
+                    meta["change_direction"] = rng.choice(("better", "same", "worse"))
+                rows["scenario_logs"].append((user_id, "card_of_day", step, dumps(meta),
+                                              _utc(start + timedelta(minutes=i)), session_id))
+            done = depth == len(CARD_STEPS)
+            rows["user_scenarios"].append((
+                user_id, "card_of_day", start.isoformat(),
+                (start + timedelta(minutes=depth)).isoformat() if done else None,
+                depth, "completed" if done else "abandoned", session_id, CARD_STEPS[depth - 1]))
+            rows["actions"].append((user_id, username, "", "card_drawn_direct", dumps({"deck": deck}), start.isoformat()))
+            if rng.random() < 0.3:
+                rows["user_requests"].append((user_id, "Что мне сейчас важно?", session_id, card, _utc(start)))
+
+            if rng.random() < 0.25:
+                evening = start.replace(hour=21)
+                evening_id = f"{user_id}_evening_reflection_{evening.strftime('%Y%m%d_%H%M%S')}"
+                for i, step in enumerate(EVENING_STEPS):
+                    rows["scenario_logs"].append((user_id, "evening_reflection", step,
+                                                  dumps({"session_id": evening_id}), _utc(evening + timedelta(minutes=i)),
+                                                  evening_id))
+                rows["user_scenarios"].append((user_id, "evening_reflection", evening.isoformat(),
+                                               (evening + timedelta(minutes=4)).isoformat(), 4, "completed", evening_id,
+                                               EVENING_STEPS[-1]))
+                rows["evening_reflections"].append((user_id, evening.date().isoformat(), "прогулка", "друзьям",
+                                                    None, evening.isoformat()))
+
+        rows["user_cards"] += [(user_id, card, deck) for deck in DECKS for card in sorted(drawn[deck])]
+
+        if rng.random() < 0.5:
+            status = "blocked" if user_id % 25 == 0 else "sent"
+            rows["mailing_logs"].append((1, user_id, status, "Forbidden" if status == "blocked" else None,
+                                         _utc(now - timedelta(days=rng.randrange(days)))))
+        flush()
+    flush(force=True)
+
+    # Статистика до пересчётов: без неё планировщик выбирает для них неудачные индексы
+    with db.conn:
+        db.conn.execute("ANALYZE")
+    db.rebuild_rollups()
+    user_stats.backfill(db.conn)
+    reachability.backfill(db.conn)
+    with db.conn:
+        db.conn.execute("ANALYZE")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая база для замеров")
+    parser.add_argument("db_path")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--scale", choices=SCALES, help="размер вместо --users: 10k, 100k или 1m")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    db = Database(args.db_path)
+    counts = populate(db, SCALES[args.scale] if args.scale else args.users, args.days, args.seed)
+    for table, count in counts.items():
+        print(f"{table:<22} {count:>10}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()